@@ -6,7 +6,7 @@ from django.contrib import admin
 from django.contrib.auth.models import Group
 
 from viewer.forms import UserAdmin
-from viewer.models import PathwayDatabase, EnrichmentResult, Pathway, User, PathwayHierarchy
+from viewer.models import PathwayDatabase, EnrichmentResult, JobMetrics, Pathway, User, PathwayHierarchy
 
 
 class PathwayDatabaseAdmin(admin.ModelAdmin):
@@ -15,10 +15,35 @@ class PathwayDatabaseAdmin(admin.ModelAdmin):
     )
 
 
+class JobMetricsInline(admin.TabularInline):
+    model = JobMetrics
+    fields = (
+        'stage', 'database', 'started', 'wall_time', 'cpu_time', 'peak_rss',
+    )
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
 class GseaResultsAdmin(admin.ModelAdmin):
     list_display = (
         'user', 'date', 'result_id',
     )
+    inlines = (
+        JobMetricsInline,
+    )
+
+
+class JobMetricsAdmin(admin.ModelAdmin):
+    list_display = (
+        'job', 'stage', 'database', 'started', 'wall_time', 'cpu_time', 'peak_rss',
+    )
+    list_filter = (
+        'stage',
+    )
+    search_fields = (
+        'database',
+    )
 
 
 class PathwayAdmin(admin.ModelAdmin):
@@ -39,6 +64,7 @@ class PathwayHierarchyAdmin(admin.ModelAdmin):
 
 admin.site.register(PathwayDatabase, PathwayDatabaseAdmin)
 admin.site.register(EnrichmentResult, GseaResultsAdmin)
+admin.site.register(JobMetrics, JobMetricsAdmin)
 admin.site.register(Pathway, PathwayAdmin)
 admin.site.register(User, UserAdmin)
 admin.site.register(PathwayHierarchy, PathwayHierarchyAdmin)
@@ -16,7 +16,11 @@ from viewer.src.constants import (
     CSV,
     TSV,
     TXT,
-    DECOPATH
+    DECOPATH,
+    ORA_SWEEP_CUTOFFS,
+    GSEA_ENGINE,
+    PRERANK_ENGINE,
+    DE_ENGINE,
 )
 
 """User uploaded results forms."""
@@ -72,6 +76,21 @@ class UploadFoldChangesForm(forms.Form):
         help_text="Significance threshold to filter differentially expressed genes. <strong>Default:</strong> 0.05"
     )
 
+    de_engine = forms.ChoiceField(
+        label='Differential gene expression engine',
+        choices=DE_ENGINE,
+        required=False,
+        help_text="The native engine compares moderated log-counts without R and is much faster, while DESeq2 fits a "
+                  "negative binomial model. <strong>Default:</strong> DESeq2"
+    )
+
+    contrast = forms.CharField(
+        label='Contrast',
+        required=False,
+        help_text="Class labels to compare, separated by a comma, e.g. <i>disease,control</i> for the fold changes of "
+                  "disease over control. <strong>Default:</strong> the last class label over the first one"
+    )
+
     upload_fold_changes = forms.BooleanField(
         label='Upload differential gene expression analysis results',
         required=False,
@@ -133,6 +152,20 @@ class ORAParametersForm(forms.Form):
         help_text="Significance threshold to filter ORA results. <strong>Default:</strong> 0.05"
     )
 
+    background_file_ora = forms.FileField(
+        label='Upload background genes',
+        validators=[validators.FileExtensionValidator([CSV, TSV, TXT])],
+        required=False,
+        help_text="<strong>Note:</strong> this field is optional. A list of genes to use as background, such as all "
+                  "genes measured in your experiment. <strong>Default:</strong> all HGNC symbols. The following file "
+                  "formats are supported: *.csv *.tsv or *.txt."
+    )
+
+    data_background_ora = forms.BooleanField(
+        label='Use the genes in the read counts or fold changes file as background',
+        required=False,
+    )
+
 
 class ORAOptions(forms.Form):
     """Upload ORA form class."""
@@ -148,6 +181,20 @@ class ORAOptions(forms.Form):
         help_text="<strong>Supported file formats:</strong> *.csv *.tsv or *.txt."
     )
 
+    upload_gene_list_matrix = forms.BooleanField(
+        label='Upload multiple gene lists and run ORA on each',
+        required=False,
+    )
+
+    gene_list_matrix = forms.FileField(
+        label='Upload gene lists',
+        validators=[validators.FileExtensionValidator([CSV, TSV, TXT])],
+        required=False,
+        help_text="<strong>Note:</strong> each column is run as a separate gene list and named after its header. "
+                  "Columns can either contain gene symbols or mark the gene symbols in the first column with 0/1 "
+                  "values. The following file formats are supported: *.csv *.tsv or *.txt."
+    )
+
     run_dge_ora_genes = forms.BooleanField(
         label='Run ORA on differentially expressed genes',
         required=False,
@@ -181,6 +228,21 @@ class ORAOptions(forms.Form):
         help_text="Significance threshold to filter differentially expressed genes. <strong>Default:</strong> 0.05"
     )
 
+    de_engine_ora = forms.ChoiceField(
+        label='Differential gene expression engine',
+        choices=DE_ENGINE,
+        required=False,
+        help_text="The native engine compares moderated log-counts without R and is much faster, while DESeq2 fits a "
+                  "negative binomial model. <strong>Default:</strong> DESeq2"
+    )
+
+    contrast_ora = forms.CharField(
+        label='Contrast',
+        required=False,
+        help_text="Class labels to compare, separated by a comma, e.g. <i>disease,control</i> for the fold changes of "
+                  "disease over control. <strong>Default:</strong> the last class label over the first one"
+    )
+
     upload_fold_changes_ora = forms.BooleanField(
         label='Upload differential gene expression analysis results',
         required=False,
@@ -200,6 +262,14 @@ class ORAOptions(forms.Form):
         help_text="Significance threshold to filter differentially expressed genes. <strong>Default:</strong> 0.05"
     )
 
+    threshold_sweep_ora = forms.BooleanField(
+        label='Also run ORA across multiple significance thresholds',
+        required=False,
+        help_text="Differentially expressed genes are filtered at adjusted <i>p</i>-values of "
+                  f"{', '.join(str(cutoff) for cutoff in ORA_SWEEP_CUTOFFS)} and the results of each threshold can "
+                  "be downloaded from the results page."
+    )
+
 
 """Run GSEA forms."""
 
@@ -282,6 +352,15 @@ class UploadGSEAForm(forms.Form):
         help_text="<strong>Default:</strong> 100"
     )
 
+    engine_gsea = forms.ChoiceField(
+        label='GSEA engine',
+        choices=GSEA_ENGINE,
+        required=False,
+        help_text="The native engine scores all gene sets and blocks of permutations together, which is much faster "
+                  "on large datasets. The adaptive mode stops permuting gene sets whose <i>p</i>-value is clearly "
+                  "above or below the significance threshold. <strong>Default:</strong> GSEApy"
+    )
+
     sig_threshold_gsea = forms.FloatField(
         label='Significance threshold (adjusted <i>p</i>-value)',
         required=False,
@@ -328,6 +407,16 @@ class UploadGSEAForm(forms.Form):
         help_text="<strong>Default:</strong> 100"
     )
 
+    engine_prerank = forms.ChoiceField(
+        label='GSEA engine',
+        choices=PRERANK_ENGINE,
+        required=False,
+        help_text="The native engine scores all gene sets and blocks of permutations together, which is much faster "
+                  "on large datasets. The adaptive mode stops permuting gene sets whose <i>p</i>-value is clearly "
+                  "above or below the significance threshold. The multilevel mode estimates <i>p</i>-values far "
+                  "below 1 / number of permutations. <strong>Default:</strong> GSEApy"
+    )
+
     sig_threshold_prerank = forms.FloatField(
         label='Significance threshold (adjusted <i>p</i>-value)',
         required=False,
@@ -366,6 +455,21 @@ class UploadFoldChangesFormGSEA(forms.Form):
         help_text="Significance threshold to filter differentially expressed genes. <strong>Default:</strong> 0.05"
     )
 
+    de_engine_gsea = forms.ChoiceField(
+        label='Differential gene expression engine',
+        choices=DE_ENGINE,
+        required=False,
+        help_text="The native engine compares moderated log-counts without R and is much faster, while DESeq2 fits a "
+                  "negative binomial model. <strong>Default:</strong> DESeq2"
+    )
+
+    contrast_gsea = forms.CharField(
+        label='Contrast',
+        required=False,
+        help_text="Class labels to compare, separated by a comma, e.g. <i>disease,control</i> for the fold changes of "
+                  "disease over control. <strong>Default:</strong> the last class label over the first one"
+    )
+
     upload_fold_changes_gsea = forms.BooleanField(
         label='Upload results of differential gene expression analysis',
         required=False,
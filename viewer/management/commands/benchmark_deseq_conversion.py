@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""Command to benchmark the transfer of count matrices and DESeq2 results between Python and R"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from viewer.src.deseq import from_r_results, to_r_counts
+
+#: Typical bulk RNA-seq sizes as (genes, samples)
+SIZES = [(20000, 12), (60000, 50), (60000, 200), (60000, 500)]
+
+#: Columns of the results of DESeq2
+RESULTS_COLUMNS = ['baseMean', 'log2FoldChange', 'lfcSE', 'stat', 'pvalue', 'padj']
+
+
+class Command(BaseCommand):
+    help = 'Time the data.frame conversions and the NumPy buffer transfers of counts and results to and from R'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeats', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        from rpy2.robjects import default_converter, pandas2ri, r
+        from rpy2.robjects.conversion import localconverter
+
+        to_dataframe = r('function(x) data.frame(x)')
+
+        rng = np.random.default_rng(options['seed'])
+
+        for genes, samples in SIZES:
+            counts = rng.negative_binomial(2, 0.01, size=(genes, samples))
+            names = [f'sample_{i}' for i in range(samples)]
+            count_matrix = pd.DataFrame(counts, columns=names)
+
+            def dataframe_counts():
+                with localconverter(default_converter + pandas2ri.converter):
+                    return pandas2ri.py2rpy(count_matrix)
+
+            # R data.frame shaped as the results of DESeq2 for this number of genes
+            random_results = pd.DataFrame(rng.random((genes, len(RESULTS_COLUMNS))), columns=RESULTS_COLUMNS)
+
+            with localconverter(default_converter + pandas2ri.converter):
+                results = pandas2ri.py2rpy(random_results)
+
+            def dataframe_results():
+                with localconverter(default_converter + pandas2ri.converter):
+                    return pandas2ri.rpy2py(to_dataframe(results))
+
+            timings = {
+                'counts, data.frame': self._time(dataframe_counts, options['repeats']),
+                'counts, buffer': self._time(lambda: to_r_counts(counts, names), options['repeats']),
+                'results, data.frame': self._time(dataframe_results, options['repeats']),
+                'results, buffer': self._time(lambda: from_r_results(results), options['repeats']),
+            }
+
+            self.stdout.write(
+                f'{genes} genes x {samples} samples: '
+                + ' | '.join(f'{name} {seconds:.3f}s' for name, seconds in timings.items())
+            )
+
+    @staticmethod
+    def _time(function, repeats: int) -> float:
+        """Return the best time of several calls of a function."""
+        best = float('inf')
+
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+
+        return best
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""Command to benchmark the native differential gene expression engine against DESeq2"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from scipy import stats
+
+from viewer.src.constants import GENE_SYMBOL
+from viewer.src.de_engine import differential_expression
+from viewer.src.deseq import CONTRAST_FACTOR, run_deseq
+from viewer.src.utils import read_data_file
+
+#: Simulated bulk RNA-seq datasets as (genes, samples per class)
+SIZES = [(20000, 3), (20000, 10), (60000, 50)]
+
+#: Fraction of the simulated genes that are differentially expressed
+DE_FRACTION = 0.1
+
+
+def simulate_counts(genes: int, samples_per_class: int, seed: int):
+    """Simulate negative binomial counts of two classes, a fraction of the genes being differentially expressed.
+
+    :return: count matrix with a gene symbol column, class labels dataFrame and mask of the differentially expressed
+        genes
+    """
+    rng = np.random.default_rng(seed)
+
+    means = np.exp(rng.normal(4, 2, genes))
+    dispersions = 0.05 + 1 / means
+    fold_changes = np.where(rng.random(genes) < DE_FRACTION, 2.0 ** rng.choice([-2, -1, 1, 2], genes), 1.0)
+
+    labels = np.repeat(['control', 'disease'], samples_per_class)
+    class_means = means[:, np.newaxis] * np.where(labels == 'disease', fold_changes[:, np.newaxis], 1.0)
+    size_factors = rng.uniform(0.7, 1.3, len(labels))
+
+    # Negative binomial counts as a gamma-Poisson mixture
+    rates = rng.gamma(1 / dispersions[:, np.newaxis], class_means * size_factors * dispersions[:, np.newaxis])
+    counts = rng.poisson(rates)
+
+    count_matrix = pd.DataFrame(counts, columns=[f'sample_{i}' for i in range(len(labels))])
+    count_matrix.insert(0, GENE_SYMBOL, [f'GENE{i}' for i in range(genes)])
+
+    return count_matrix, pd.DataFrame({CONTRAST_FACTOR: labels}), fold_changes != 1
+
+
+class Command(BaseCommand):
+    help = 'Run the differential gene expression analysis with DESeq2 and with the native engine and compare them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counts', help='Read counts file. If missing, simulated datasets are used')
+        parser.add_argument('--classes', help='Class labels file of the read counts')
+        parser.add_argument('--threshold', type=float, default=0.05, help='Adjusted p-value of significant genes')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['counts']:
+            if not options['classes']:
+                raise CommandError('Please provide the class labels of the read counts with --classes')
+
+            count_matrix = read_data_file(options['counts'], options['counts'])
+
+            if count_matrix.index.name == GENE_SYMBOL:
+                count_matrix.reset_index(inplace=True)
+
+            datasets = [(options['counts'], count_matrix, read_data_file(options['classes'], options['classes']), None)]
+
+        else:
+            datasets = [
+                (f'{genes} genes x {2 * samples} samples', *simulate_counts(genes, samples, options['seed']))
+                for genes, samples in SIZES
+            ]
+
+        for name, count_matrix, design_matrix, truth in datasets:
+            self.stdout.write(f'{name}:')
+
+            results = {}
+
+            for engine, run in (
+                ('DESeq2', lambda: run_deseq(count_matrix, design_matrix, '~ class_label', GENE_SYMBOL)),
+                ('native', lambda: differential_expression(count_matrix, design_matrix, GENE_SYMBOL)),
+            ):
+                start = time.time()
+                results[engine] = run()
+                self.stdout.write(f'  {engine}: {time.time() - start:.1f}s')
+
+            self._report(results['DESeq2'], results['native'], options['threshold'], truth)
+
+    def _report(self, deseq: pd.DataFrame, native: pd.DataFrame, threshold: float, truth=None):
+        """Write the concordance of the fold changes and of the significant genes of both engines."""
+        tested = deseq.log2FoldChange.notna() & native.log2FoldChange.notna()
+
+        correlation = stats.spearmanr(deseq.log2FoldChange[tested], native.log2FoldChange[tested]).correlation
+
+        significant = {
+            'DESeq2': (deseq.padj <= threshold).to_numpy(),
+            'native': (native.padj <= threshold).to_numpy(),
+        }
+        both = (significant['DESeq2'] & significant['native']).sum()
+        either = (significant['DESeq2'] | significant['native']).sum()
+
+        self.stdout.write(f'  Spearman correlation of the fold changes of {tested.sum()} genes: {correlation:.3f}')
+        self.stdout.write(
+            f'  Significant genes: {significant["DESeq2"].sum()} DESeq2, {significant["native"].sum()} native, '
+            f'{both} both (Jaccard index {both / either if either else 1:.3f})'
+        )
+
+        if truth is not None:
+            for engine, calls in significant.items():
+                recall = (calls & truth).sum() / truth.sum()
+                false_discoveries = (calls & ~truth).sum() / max(calls.sum(), 1)
+                self.stdout.write(f'  {engine}: recall {recall:.3f}, false discovery rate {false_discoveries:.3f}')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""Command to validate the native GSEA engine against GSEApy"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+from viewer.src.constants import (
+    DECOPATH_GMT, GENE_SYMBOL, GSEAPY_ENGINE, NATIVE_ENGINE, PRERANK_ENGINE,
+)
+from viewer.src.gsea import run_gsea, run_prerank
+from viewer.src.utils import read_data_file
+
+
+class Command(BaseCommand):
+    help = 'Run GSEA with GSEApy and with the native engine on the same data and compare the results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data', help='Expression dataset (GSEA) or ranked list of genes (GSEA pre-ranked)')
+        parser.add_argument('--classes', help='Class labels file. If missing, --data is run as a ranked list')
+        parser.add_argument('--gmt', help='GMT files', nargs='+', default=[DECOPATH_GMT])
+        parser.add_argument('--min_size', type=int, default=10)
+        parser.add_argument('--max_size', type=int, default=500)
+        parser.add_argument('--permutation_type', default='phenotype')
+        parser.add_argument('--permutation_num', type=int, default=100)
+        parser.add_argument('--method', default='signal_to_noise')
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--engine',
+            help='Native engine to compare with GSEApy',
+            choices=sorted({engine for engine, _ in PRERANK_ENGINE} - {GSEAPY_ENGINE}),
+            default=NATIVE_ENGINE,
+        )
+        parser.add_argument('--significance_threshold', type=float, default=0.05)
+        parser.add_argument('--output_dir', help='Directory to write the GSEApy reports to. By default, none are written')
+
+    def handle(self, *args, **options):
+        if not options['data']:
+            raise CommandError('Please provide a data file with --data')
+
+        df = read_data_file(options['data'], options['data'])
+
+        results = {}
+
+        for engine in (GSEAPY_ENGINE, options['engine']):
+            start = time.time()
+
+            if options['classes']:
+                if GENE_SYMBOL in df:
+                    df.set_index(GENE_SYMBOL, inplace=True)
+
+                class_df = read_data_file(options['classes'], options['classes'])
+
+                results[engine] = run_gsea(
+                    data=df,
+                    gmt=options['gmt'],
+                    class_vector=class_df['class_label'].to_list(),
+                    output_dir=options['output_dir'],
+                    min_size=options['min_size'],
+                    max_size=options['max_size'],
+                    permutation_type=options['permutation_type'],
+                    permutation_num=options['permutation_num'],
+                    method=options['method'],
+                    engine=engine,
+                    processes=options['processes'],
+                    seed=options['seed'],
+                    significance_threshold=options['significance_threshold'],
+                )
+
+            else:
+                results[engine] = run_prerank(
+                    rnk=df,
+                    gmt=options['gmt'],
+                    output_dir=options['output_dir'],
+                    min_size=options['min_size'],
+                    max_size=options['max_size'],
+                    permutation_num=options['permutation_num'],
+                    engine=engine,
+                    processes=options['processes'],
+                    seed=options['seed'],
+                    significance_threshold=options['significance_threshold'],
+                )
+
+            self.stdout.write(f'{engine}: {len(results[engine].index)} gene sets in {time.time() - start:.1f}s')
+
+        reference = results[GSEAPY_ENGINE].sort_index()
+        native = results[options['engine']].sort_index()
+
+        if not reference.index.equals(native.index):
+            raise CommandError('The engines tested different gene sets')
+
+        es_difference = np.abs(reference['es'].astype(float) - native['es']).max()
+        ledge_mismatches = (reference['ledge_genes'] != native['ledge_genes']).sum()
+
+        self.stdout.write(f'Maximum difference in enrichment scores: {es_difference:.3g}')
+        self.stdout.write(f'Gene sets with different leading edge genes: {ledge_mismatches}')
+
+        # Permutations are random, so NES, p-values and FDRs only agree statistically
+        for column in ('nes', 'pval', 'fdr'):
+            correlation = pd.Series(reference[column].astype(float)).corr(native[column], method='spearman')
+            self.stdout.write(f'Spearman correlation of {column}: {correlation:.3f}')
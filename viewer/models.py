@@ -4,12 +4,15 @@
 
 import json
 import pickle
+from typing import List, Optional
 
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractBaseUser
 from django.db import models
 from django.utils import timezone
 
+from viewer.src.results_storage import dump_results, is_columnar, join_sweep_results, load_results
+
 
 class PathwayDatabase(models.Model):
     """Pathway Database class storing GMT files."""
@@ -167,6 +170,7 @@ class EnrichmentResult(models.Model):
     significance_threshold_fc = models.FloatField(null=True)
     fold_change_results = models.BinaryField(null=True, blank=False)
     fold_changes_filename = models.CharField(max_length=360, default="NA")
+    sweep_results = models.BinaryField(null=True, blank=False)  # ORA p/q-values at several DEG cutoffs
     task_id = models.CharField(max_length=450, null=True, blank=False)  # Celery task ID
 
     def __str__(self):
@@ -177,8 +181,44 @@ class EnrichmentResult(models.Model):
         for attr, value in self.__dict__.items():
             yield attr, value
 
-    def get_df(self):
-        return pickle.loads(self.result)
+    def _load_results_field(self, field: str, columns: Optional[List[str]] = None):
+        """Read the results dataFrame of a field, converting pickled results of older versions to Parquet."""
+        blob = getattr(self, field)
+
+        if blob is None:
+            return None
+
+        if is_columnar(blob):
+            return load_results(blob, columns)
+
+        df = load_results(blob)
+        blob = dump_results(df)
+
+        if is_columnar(blob):
+            setattr(self, field, blob)
+            EnrichmentResult.objects.filter(result_id=self.result_id).update(**{field: blob})
+
+        return df if columns is None else df[[column for column in columns if column in df.columns]]
+
+    def get_df(self, columns: Optional[List[str]] = None):
+        """Return the results dataFrame, with all columns or only those given."""
+        return self._load_results_field('result', columns)
+
+    def get_fold_change_df(self, columns: Optional[List[str]] = None):
+        """Return the fold changes dataFrame, with all columns or only those given."""
+        return self._load_results_field('fold_change_results', columns)
+
+    def get_sweep_results(self):
+        """Return the p-values and q-values of an ORA threshold sweep, with a column per value and cutoff."""
+        if self.sweep_results is not None and not is_columnar(self.sweep_results):
+            # Older versions pickled a dictionary of the pathway x cutoff dataFrames of p-values and q-values
+            sweep_results = pickle.loads(self.sweep_results)
+            df = join_sweep_results(sweep_results['p_value'], sweep_results['q_value'])
+
+            self.sweep_results = dump_results(df)
+            EnrichmentResult.objects.filter(result_id=self.result_id).update(sweep_results=self.sweep_results)
+
+        return self._load_results_field('sweep_results')
 
     def get_job_id(self):
         return f'{self.result_id}'
@@ -193,9 +233,9 @@ class EnrichmentResult(models.Model):
         return json.loads(self.phenotype_classes)
 
     def get_fold_changes(self):
-        df = pickle.loads(self.fold_change_results)
+        df = self.get_fold_change_df()
 
-        if not df:
+        if df is None:
             return None
 
         if 'log2fc' in df.columns and 'gene_symbol' in df.columns:
@@ -208,6 +248,35 @@ class EnrichmentResult(models.Model):
                              'gene_symbol, log2fc and q-value. See the FAQs for more details.')
 
 
+class JobProgress(models.Model):
+    """Progress of a running job, kept apart from its results so it can be polled cheaply."""
+    job = models.OneToOneField(EnrichmentResult, on_delete=models.CASCADE, primary_key=True, related_name='progress')
+    stage = models.CharField(max_length=120, default="Queued")
+    step = models.IntegerField(default=0)  # Database i of n
+    total_steps = models.IntegerField(default=0)
+    permutations_done = models.IntegerField(default=0)
+    permutations_total = models.IntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+    task_ids = models.JSONField(default=list)  # Celery tasks the job fanned out to, revoked when it is stopped
+
+    def __str__(self):
+        return f'progress of job {self.job_id}: {self.stage}'
+
+
+class JobMetrics(models.Model):
+    """Resources used by a stage of a job, or by one database of its enrichment stage, to size the workers."""
+    job = models.ForeignKey(EnrichmentResult, on_delete=models.CASCADE, related_name='metrics')
+    stage = models.CharField(max_length=120)
+    database = models.CharField(max_length=360, null=True, blank=True)  # Database run separately in the stage
+    started = models.DateTimeField(default=timezone.now)
+    wall_time = models.FloatField()  # Seconds
+    cpu_time = models.FloatField()  # Seconds of the task process and of its child processes ended during the stage
+    peak_rss = models.BigIntegerField()  # Bytes of resident memory of the task process
+
+    def __str__(self):
+        return f'{self.stage} of job {self.job_id}'
+
+
 class PathwayHierarchy(models.Model):
     """Pathway hierarchy to be rendered."""
     name = models.CharField(max_length=120)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""Checkpoints of long-running jobs.
+
+A checkpoint is a directory per job holding pickled partial results: the results of each database already run and
+each round of permutations done so far. The artifacts of the uploads of the job are moved into its checkpoint, which
+references them instead of copying the data, and the tasks running the databases of a job in parallel share their
+inputs through it. A job that hits the time limit keeps its checkpoint, so it can be re-queued and resume from where it
+stopped instead of from scratch.
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+from typing import Any, List
+
+from viewer.src.constants import CHECKPOINTS_DIR
+
+#: Keyword arguments of the task that started the job
+TASK_CHECKPOINT = 'task'
+
+#: Paths of the artifacts of the uploads of the job, moved into its checkpoint
+INPUTS_CHECKPOINT = 'inputs'
+
+#: Genes, background and fold changes tested by the tasks of the databases of an ORA job
+QUERY_CHECKPOINT = 'query'
+
+#: Prefix of the null enrichment scores of each round of permutations done so far
+PERMUTATIONS_CHECKPOINT = 'permutations'
+
+#: Prefix of the files being written, which are renamed once complete
+TEMP_PREFIX = '.tmp-'
+
+_EXTENSION = '.pkl'
+
+
+class Checkpoint:
+    """Directory of named partial results of a job."""
+
+    def __init__(self, directory: str):
+        """Initialize the checkpoint, which is only created on disk when something is saved."""
+        self.directory = directory
+
+    def get_path(self, name: str) -> str:
+        """Return the path of the file an object is saved to."""
+        return os.path.join(self.directory, name + _EXTENSION)
+
+    def exists(self) -> bool:
+        """Check if anything has been saved."""
+        return os.path.isdir(self.directory)
+
+    def save(self, name: str, obj: Any) -> None:
+        """Save an object, replacing the previous one atomically so that an interrupted job never leaves it corrupt."""
+        os.makedirs(self.directory, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=TEMP_PREFIX, suffix=_EXTENSION)
+
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(temp_path, self.get_path(name))
+
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def add_file(self, name: str, path: str) -> str:
+        """Move a file into the checkpoint, so that it is kept as long as the checkpoint, and return its new path."""
+        os.makedirs(self.directory, exist_ok=True)
+
+        new_path = os.path.join(self.directory, name + os.path.splitext(path)[1])
+        shutil.move(path, new_path)
+
+        return new_path
+
+    def list_names(self, prefix: str) -> List[str]:
+        """Return the sorted names of the objects saved with a name starting with the prefix."""
+        try:
+            file_names = os.listdir(self.directory)
+
+        except FileNotFoundError:
+            return []
+
+        return sorted(
+            file_name[:-len(_EXTENSION)]
+            for file_name in file_names
+            if file_name.startswith(prefix) and file_name.endswith(_EXTENSION)
+        )
+
+    def load(self, name: str, default: Any = None) -> Any:
+        """Load an object, or return the default if it has not been saved."""
+        try:
+            with open(self.get_path(name), 'rb') as file:
+                return pickle.load(file)
+
+        except FileNotFoundError:
+            return default
+
+    def clear(self) -> None:
+        """Delete the checkpoint."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def get_database_checkpoint_name(gmt_path: str) -> str:
+    """Return the name of the results of one database, for the engines running each database separately."""
+    return 'database_' + os.path.splitext(os.path.basename(gmt_path))[0]
+
+
+def get_round_checkpoint_name(start: int) -> str:
+    """Return the name of the null enrichment scores of the round of permutations starting at the given index."""
+    # Zero-padded, so that the rounds are listed in order
+    return f'{PERMUTATIONS_CHECKPOINT}_{start:09d}'
+
+
+def get_checkpoint(job_id: str) -> Checkpoint:
+    """Return the checkpoint of a job."""
+    return Checkpoint(os.path.join(CHECKPOINTS_DIR, str(job_id)))
@@ -79,6 +79,9 @@ MAX_JOBS = 2
 GMT_FILES_DIR = os.path.join(APP_DIR, 'static', 'gmt_files')
 GMT_FILE_EXTENSION = '.gmt'
 
+#: Compiled, memory-mappable gene set pack written next to each GMT file
+GENESET_PACK_EXTENSION = '.pack'
+
 
 def make_geneset_dir():
     """Ensure that geneset directory exists."""
@@ -134,10 +137,17 @@ COMPATH_MAPPING_URLS = {
 
 def make_gsea_export_directories():
     """Ensure that gsea results export directories exist."""
-    os.makedirs(RESULTS, exist_ok=True)
+    os.makedirs(GSEA_RESULTS, exist_ok=True)
 
 
 GSEA_RESULTS = os.path.join(PROJECT_DIR, RESULTS)
+
+#: Checkpoints of GSEA jobs, kept until the job succeeds so that it can be resumed after hitting the time limit
+CHECKPOINTS_DIR = os.path.join(PROJECT_DIR, 'checkpoints')
+
+#: DESeq2 results shared by the jobs run on the same counts, design matrix and formula
+DESEQ_CACHE_DIR = os.path.join(PROJECT_DIR, 'deseq_cache')
+
 DECOPATH_GMT = os.path.join(GMT_FILES_DIR, 'decopath.gmt')
 DECOPATH_CSV = os.path.join(PROJECT_DIR, 'viewer', 'static', 'gmt_files', 'decopath.csv')
 CONCATENATE_GMT = os.path.join(PROJECT_DIR, 'viewer', 'static', 'dummy_files', 'concatenate.gmt')
@@ -167,6 +177,9 @@ DEFAULT_MIN_GSEA = 10
 DEFAULT_MAX_ORA = 1000
 DEFAULT_MIN_ORA = 10
 
+#: Significance thresholds on the adjusted p-values of differentially expressed genes used in an ORA threshold sweep
+ORA_SWEEP_CUTOFFS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1)
+
 #: Number of permutations to run GSEA
 PERMUTATION_NUM = (
     ("100", "default"),
@@ -182,6 +195,34 @@ PERMUTATION_TYPE = (
     ("gene_set", "gene set"),
 )
 
+#: Engines to run GSEA
+GSEAPY_ENGINE = 'gseapy'
+NATIVE_ENGINE = 'native'
+ADAPTIVE_ENGINE = 'native_adaptive'
+MULTILEVEL_ENGINE = 'native_multilevel'
+
+GSEA_ENGINE = (
+    (GSEAPY_ENGINE, "default"),
+    (GSEAPY_ENGINE, "GSEApy"),
+    (NATIVE_ENGINE, "native (batched permutations)"),
+    (ADAPTIVE_ENGINE, "native (adaptive permutations)"),
+)
+
+#: Engines to run GSEA pre-ranked
+PRERANK_ENGINE = GSEA_ENGINE + (
+    (MULTILEVEL_ENGINE, "native (multilevel p-values)"),
+)
+
+#: Engines to run the differential gene expression analysis
+DESEQ2_ENGINE = 'deseq2'
+NATIVE_DE_ENGINE = 'native'
+
+DE_ENGINE = (
+    (DESEQ2_ENGINE, "default"),
+    (DESEQ2_ENGINE, "DESeq2"),
+    (NATIVE_DE_ENGINE, "native (moderated log-counts, no R)"),
+)
+
 #: Pathway enrichment methods
 ENRICHMENT_METHOD = (
     (GSEA, "GSEA"),
@@ -262,6 +303,9 @@ CSV = 'csv'
 TSV = 'tsv'
 TXT = 'txt'
 
+#: Extension of the uploads parsed and validated by the web tier and handed to the workers
+UPLOAD_ARTIFACT_EXTENSION = '.upload.arrow'
+
 """User submitted results columns"""
 
 #: User submitted GSEA results expected header
@@ -285,6 +329,9 @@ DEFAULT_GSEA_RESULTS_COLUMN_NAMES = {
     'es', 'nes', 'pval', 'fdr', 'geneset_size', 'matched_size', 'genes', 'ledge_genes'
 }
 
+#: Number of permutations of each gene set, reported when GSEA is run with adaptive permutations
+PERMUTATIONS_COLUMN = 'permutations'
+
 #: Fold changes header
 USER_FOLD_CHANGES_COLUMN_NAME = {
     'log2fc', 'q_value'
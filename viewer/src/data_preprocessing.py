@@ -7,6 +7,7 @@ from typing import Dict, Union, List, Optional
 import pandas as pd
 
 from viewer.src.constants import *
+from viewer.src.geneset_pack import load_pack
 from viewer.src.response_handler import *
 from viewer.src.utils import _get_hgnc_mapping_dict, get_missing_columns
 
@@ -15,7 +16,7 @@ logger = logging.getLogger(__name__)
 """Check if data files submitted by user are valid."""
 
 
-def _read_text_file(file_path: str, filename, index_col: int = 0) -> Union[pd.DataFrame, str]:
+def _read_text_file(file_path: str, filename, index_col: Optional[int] = 0) -> Union[pd.DataFrame, str]:
     """Check read data file."""
     try:
         if file_path.endswith(CSV):
@@ -163,6 +164,61 @@ def process_data_ora(file_path: str, filename: str) -> Union[pd.DataFrame, str]:
     return check_symbols
 
 
+def process_gene_list_matrix(file_path: str, filename: str) -> Union[Dict[str, List[str]], str]:
+    """Check if a file with multiple gene lists is valid and return a dictionary of gene list name to gene symbols.
+
+    Each column is a gene list. Columns either list gene symbols or flag the gene symbols in the first column with
+    0/1 values.
+    """
+    check_read_res = _read_text_file(file_path, filename, index_col=None)
+
+    if isinstance(check_read_res, str):
+        return check_read_res
+
+    check_df = _check_df_validity(filename, check_read_res)
+
+    if isinstance(check_df, str):
+        return check_df
+
+    indicator_columns = check_df.columns[1:]
+
+    # Gene x gene list matrix of 0/1 values
+    if len(indicator_columns) and all(pd.api.types.is_numeric_dtype(check_df[column]) for column in indicator_columns):
+        genes = check_df.iloc[:, 0].astype(str).str.strip()
+
+        gene_lists = {
+            str(column): genes[check_df[column].fillna(0).to_numpy() != 0].tolist()
+            for column in indicator_columns
+        }
+
+    # One column of gene symbols per gene list
+    else:
+        gene_lists = {
+            str(column): check_df[column].dropna().astype(str).str.strip().tolist()
+            for column in check_df.columns
+        }
+
+    hgnc_symbols = _get_hgnc_mapping_dict()
+
+    all_genes = {gene for genes in gene_lists.values() for gene in genes}
+    blacklist = {gene for gene in all_genes if gene not in hgnc_symbols}
+
+    if not all_genes or len(blacklist) / len(all_genes) > 0.4:
+        return HGNC_SYMBOL_CHECK_MSG
+
+    # Remove blacklisted symbols and empty gene lists
+    gene_lists = {
+        name: [gene for gene in genes if gene not in blacklist]
+        for name, genes in gene_lists.items()
+    }
+
+    return {
+        name: genes
+        for name, genes in gene_lists.items()
+        if genes
+    }
+
+
 """Check if .gmt file is valid."""
 
 
@@ -220,15 +276,9 @@ def parse_custom_gmt(file: str) -> Union[Dict[str, list], str]:
 def parse_gmt_file(gmt_path: str, min_size=3, max_size=3000) -> Union[Dict[str, list], str]:
     """Parse gmt file."""
     try:
-        with open(gmt_path) as f:
-
-            genesets_dict = {
-                line.strip().split("\t")[0]: line.strip().split("\t")[2:]
-                for line in f
-            }
+        pack = load_pack(gmt_path)
 
-        return {
-            k: v for k, v in genesets_dict.items() if min_size <= len(v) <= max_size}
+        return pack.to_dict(pack.size_filter(min_size=min_size, max_size=max_size))
 
     except IOError:
         return GMT_FILE_ERROR_MSG
@@ -11,6 +11,7 @@ import pandas as pd
 from viewer.models import PathwayDatabase, EnrichmentResult, Pathway, PathwayHierarchy
 from viewer.src.constants import *
 from viewer.src.data_preprocessing import parse_gmt_file
+from viewer.src.results_storage import dump_results
 from viewer.src.utils import (
     handle_file_download,
     parse_hierarchy_excel,
@@ -155,7 +156,7 @@ def load_results_metadata(
     # Load Enrichment Results model with results and fold changes uploaded by user
     if isinstance(fold_change_results, pd.DataFrame) and isinstance(results, pd.DataFrame):
         enrichment_results_object, created = EnrichmentResult.objects.get_or_create(
-            result=pickle.dumps(results),
+            result=dump_results(results),
             user=current_user,
             data_filename=data_filename,
             class_filename=class_filename,
@@ -170,13 +171,13 @@ def load_results_metadata(
             calculation_method=calculation_method,
             enrichment_method=enrichment_method,
             significance_threshold_fc=significance_threshold_fc,
-            fold_change_results=pickle.dumps(fold_change_results),
+            fold_change_results=dump_results(fold_change_results),
             fold_changes_filename=fold_changes_filename,
         )
     # Load Enrichment Results model with results and metadata to run DEG uploaded by user
     elif read_counts_path and isinstance(results, pd.DataFrame):
         enrichment_results_object, created = EnrichmentResult.objects.get_or_create(
-            result=pickle.dumps(results),
+            result=dump_results(results),
             user=current_user,
             data_filename=data_filename,
             class_filename=class_filename,
@@ -196,7 +197,7 @@ def load_results_metadata(
 
     elif isinstance(results, pd.DataFrame) and not (read_counts_path or fold_change_results):
         enrichment_results_object, created = EnrichmentResult.objects.get_or_create(
-            result=pickle.dumps(results),
+            result=dump_results(results),
             user=current_user,
             phenotype_classes=json.dumps(class_labels),
             data_filename=data_filename,
@@ -230,7 +231,7 @@ def load_results_metadata(
             calculation_method=calculation_method,
             enrichment_method=enrichment_method,
             significance_threshold_fc=significance_threshold_fc,
-            fold_change_results=pickle.dumps(fold_change_results),
+            fold_change_results=dump_results(fold_change_results),
             fold_changes_filename=fold_changes_filename,
         )
 
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""Native differential gene expression engine.
+
+A lightweight alternative to DESeq2 that only needs NumPy and SciPy, so it runs without R. The counts are normalized
+with the median-of-ratios size factors of DESeq2 and log-transformed. Each gene is then compared between two class
+labels with a t-test whose variance is moderated with the empirical Bayes method of limma (Smyth, 2004): the variance of
+each gene is shrunk towards a prior fitted on the variances of all genes, which makes the test stable with few samples.
+The p-values are adjusted with the Benjamini-Hochberg procedure.
+
+The results have the same columns as those of DESeq2, but the fold changes are differences of the mean log-counts
+rather than estimates of a negative binomial model.
+"""
+
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import special, stats
+from statsmodels.stats.multitest import multipletests
+
+from viewer.src.deseq import CONTRAST_FACTOR, get_testable_genes
+
+logger = logging.getLogger(__name__)
+
+#: Pseudo-count added to the normalized counts before the log-transformation
+PSEUDO_COUNT = 0.5
+
+
+def median_of_ratios(counts: np.ndarray) -> np.ndarray:
+    """Return the size factor of each sample as the median ratio of its counts to the geometric mean of each gene.
+
+    :param counts: (genes x samples) counts
+    """
+    with np.errstate(divide='ignore'):
+        log_counts = np.log(counts)
+
+    log_geometric_means = log_counts.mean(axis=1)
+
+    # Genes with a zero count in any sample have no geometric mean
+    usable = np.isfinite(log_geometric_means)
+
+    if not usable.any():
+        raise ValueError('Every gene has a zero count in at least one sample, so the counts cannot be normalized')
+
+    return np.exp(np.median(log_counts[usable] - log_geometric_means[usable, np.newaxis], axis=0))
+
+
+def _trigamma_inverse(x: float) -> float:
+    """Solve trigamma(y) = x with Newton's method, as limma does."""
+    if x > 1e7:
+        return 1 / np.sqrt(x)
+
+    if x < 1e-6:
+        return 1 / x
+
+    y = 0.5 + 1 / x
+
+    for _ in range(50):
+        trigamma = special.polygamma(1, y)
+        step = trigamma * (1 - trigamma / x) / special.polygamma(2, y)
+        y += step
+
+        if -step / y < 1e-8:
+            break
+
+    return y
+
+
+def fit_variance_prior(variances: np.ndarray, df: int) -> Tuple[float, float]:
+    """Fit the scaled inverse chi-squared prior of the variances of the genes.
+
+    :param variances: residual variance of each gene
+    :param df: residual degrees of freedom of each variance
+    :return: degrees of freedom and scale of the prior. The degrees of freedom are infinite when the variances are all
+        consistent with a single value, and zero when the prior cannot be fitted, so that the variances are not
+        moderated and the tests are ordinary t-tests.
+    """
+    if len(variances) < 2:
+        logger.warning(f'Cannot fit the prior of the variances on {len(variances)} genes, so they are not moderated')
+        return 0.0, 0.0
+
+    log_variances = np.log(variances) - special.digamma(df / 2) + np.log(df / 2)
+    mean = log_variances.mean()
+    excess = log_variances.var(ddof=1) - special.polygamma(1, df / 2)
+
+    if not np.isfinite(excess):
+        logger.warning('Cannot fit the prior of the variances, so they are not moderated')
+        return 0.0, 0.0
+
+    if excess <= 0:
+        return np.inf, float(np.exp(mean))
+
+    prior_df = 2 * _trigamma_inverse(excess)
+
+    return prior_df, float(np.exp(mean + special.digamma(prior_df / 2) - np.log(prior_df / 2)))
+
+
+def differential_expression(
+    count_matrix: pd.DataFrame,
+    design_matrix: pd.DataFrame,
+    gene_column: str,
+    contrast: Optional[Tuple[str, str]] = None,
+    min_count: int = 10,
+) -> pd.DataFrame:
+    """Compare the expression of each gene between two class labels.
+
+    :param count_matrix: read counts with a column of gene identifiers and a column per sample
+    :param design_matrix: dataFrame with a row per sample, in the order of the columns of the counts, and the class
+        label of each sample
+    :param gene_column: name of the column of gene identifiers
+    :param contrast: class labels (numerator, denominator) to compare. By default, the last class label is compared to
+        the first one, as in DESeq2.
+    :param min_count: genes need at least this many reads in as many samples as the smallest class to be tested
+    :return: results with the columns of DESeq2 and the gene identifiers in gene_column
+    """
+    if gene_column not in count_matrix.columns:
+        raise ValueError('Wrong gene id column name')
+
+    counts = count_matrix.drop(gene_column, axis=1).to_numpy(dtype=np.float64)
+    labels = design_matrix[CONTRAST_FACTOR].astype(str).to_numpy()
+
+    if len(labels) != counts.shape[1]:
+        raise ValueError(
+            f'The read counts have {counts.shape[1]} samples but the class labels file has {len(labels)} samples'
+        )
+
+    levels = sorted(set(labels))
+
+    if len(levels) < 2:
+        raise ValueError('At least two class labels are needed to compare the expression of genes')
+
+    numerator, denominator = contrast or (levels[-1], levels[0])
+
+    if numerator not in levels or denominator not in levels:
+        raise ValueError(f'Class labels {numerator} and {denominator} cannot be compared')
+
+    # Residual variance of a model with one mean per class label
+    df = len(labels) - len(levels)
+
+    if df < 1:
+        raise ValueError('At least one class label needs two samples to estimate the variance of the genes')
+
+    normalized = counts / median_of_ratios(counts)
+    log_counts = np.log2(normalized + PSEUDO_COUNT)
+
+    class_index = np.searchsorted(levels, labels)
+    class_sizes = np.bincount(class_index, minlength=len(levels))
+    class_means = np.stack([log_counts[:, class_index == i].mean(axis=1) for i in range(len(levels))], axis=1)
+
+    variances = ((log_counts - class_means[:, class_index]) ** 2).sum(axis=1) / df
+
+    keep = get_testable_genes(counts, design_matrix, min_count)
+
+    logger.info(f'Testing {keep.sum()} of {len(keep)} genes with enough reads')
+
+    # Empirical Bayes moderation of the variances
+    prior_df, prior_variance = fit_variance_prior(variances[keep & (variances > 0)], df)
+
+    if np.isinf(prior_df):
+        moderated = np.full_like(variances, prior_variance)
+    else:
+        moderated = (prior_df * prior_variance + df * variances) / (prior_df + df)
+
+    i, j = levels.index(numerator), levels.index(denominator)
+
+    log2_fold_changes = class_means[:, i] - class_means[:, j]
+    standard_errors = np.sqrt(moderated * (1 / class_sizes[i] + 1 / class_sizes[j]))
+    statistics = log2_fold_changes / standard_errors
+
+    if np.isinf(prior_df):
+        pvalues = 2 * stats.norm.sf(np.abs(statistics))
+    else:
+        pvalues = 2 * stats.t.sf(np.abs(statistics), df + prior_df)
+
+    results = pd.DataFrame({
+        'baseMean': normalized.mean(axis=1),
+        'log2FoldChange': log2_fold_changes,
+        'lfcSE': standard_errors,
+        'stat': statistics,
+        'pvalue': pvalues,
+        'padj': np.nan,
+    })
+
+    # Genes with too few reads are not tested, as in DESeq2
+    results.loc[~keep, ['log2FoldChange', 'lfcSE', 'stat', 'pvalue']] = np.nan
+
+    if keep.any():
+        results.loc[keep, 'padj'] = multipletests(pvalues[keep], method='fdr_bh')[1]
+
+    results[gene_column] = count_matrix[gene_column].values
+
+    return results
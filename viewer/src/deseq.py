@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+
+"""Differential expression analysis with DESeq2.
+
+Loading rpy2, R and the Bioconductor dependencies of DESeq2 takes several seconds and a lot of memory, so it is not done
+for each job. Each Celery worker process keeps a small pool of long-lived processes that embed R and load DESeq2 once,
+when they start. Jobs send them the counts as a NumPy array, which is pickled as a single buffer, and get the results
+back as a dataFrame.
+
+The counts are copied once from a column-major int32 buffer into an R integer matrix, and the results are read back as
+NumPy vectors straight from the memory of the R vectors. Going through R data.frames instead costs about as much as
+DESeq2 itself on large count matrices (see the benchmark_deseq_conversion command).
+
+The pool processes are recycled after a number of jobs so that the memory R does not return is eventually freed.
+
+Users often run ORA, GSEA and fold change uploads on the same counts and class labels, so the results are cached on
+disk under a hash of the counts, the design matrix and the design formula, and later jobs with the same inputs skip
+DESeq2. The least recently used results are evicted once the cache exceeds its size or they exceed its age limit.
+
+With three or more class labels, the model is fitted once and the results of every pairwise contrast of the class labels
+are extracted from it and cached together with the default contrast. Jobs on the other contrasts of the same inputs then
+reuse them instead of refitting the model.
+
+Genes with too few reads to be tested are filtered out before the model is fitted, as recommended by the DESeq2
+vignette, and their results are reported as missing. The dispersion and Wald steps of DESeq2 and the extraction of the
+results run on a multicore BiocParallel backend with the number of workers set for DESeq2.
+"""
+
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from billiard import Pool
+from billiard.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+
+from viewer.src.checkpoint import TEMP_PREFIX, Checkpoint
+from viewer.src.constants import DESEQ_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+#: Factor of the design matrix the contrasts are defined on
+CONTRAST_FACTOR = 'class_label'
+
+#: Columns of the DESeq2 results whose sign depends on the direction of the contrast
+SIGNED_COLUMNS = ['log2FoldChange', 'stat']
+
+#: DESeq2 and BiocParallel packages loaded in a pool process
+_deseq = None
+_biocparallel = None
+
+#: Pool of the current Celery worker process, created on first use
+_pool: Optional[Pool] = None
+
+
+def _load_deseq() -> None:
+    """Embed R and load DESeq2 in a pool process."""
+    global _deseq, _biocparallel
+
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.packages import importr
+
+    pandas2ri.activate()
+    _deseq = importr('DESeq2')
+    _biocparallel = importr('BiocParallel')
+
+    logger.info('imported DESeq2')
+
+
+def to_r_counts(counts: np.ndarray, samples: List[str]):
+    """Copy a (genes x samples) count matrix into an R integer matrix in a single copy of its buffer."""
+    from rpy2 import rinterface as ri
+
+    counts = np.asfortranarray(counts, dtype=np.int32)
+
+    matrix = ri.IntSexpVector.from_memoryview(memoryview(counts.ravel(order='F')))
+    matrix.do_slot_assign('dim', ri.IntSexpVector(counts.shape))
+    matrix.do_slot_assign('dimnames', ri.ListSexpVector([ri.NULL, ri.StrSexpVector(samples)]))
+
+    return matrix
+
+
+def from_r_results(results) -> pd.DataFrame:
+    """Read a DESeq2 results object as a dataFrame of NumPy vectors, without converting an R data.frame."""
+    from rpy2.robjects import default_converter, r
+    from rpy2.robjects.conversion import localconverter
+
+    with localconverter(default_converter):
+        columns = r('function(x) lapply(as.data.frame(x), as.numeric)')(results)
+
+        return pd.DataFrame({
+            name: np.array(column.memoryview())
+            for name, column in zip(columns.names, columns)
+        })
+
+
+def _run_deseq(
+    counts: np.ndarray,
+    samples: List[str],
+    design_matrix: pd.DataFrame,
+    design_formula: str,
+    factor: str,
+    processes: int = 1,
+) -> Dict[Optional[Tuple[str, str]], pd.DataFrame]:
+    """Fit DESeq2 once in a pool process and return the results of the default and of every pairwise contrast.
+
+    :param processes: number of processes of the BiocParallel backend
+    :return: results of the default contrast under None and of each pair of levels (numerator, denominator) of the
+        factor, in the order of the levels of the factor
+    """
+    from rpy2.robjects import Formula, StrVector, default_converter, r
+    from rpy2.robjects.conversion import localconverter
+
+    logger.info(f"running DESeq with {processes} processes")
+
+    # Forked R workers for the steps of DESeq2 that are parallel per gene
+    parallel = {'parallel': True, 'BPPARAM': _biocparallel.MulticoreParam(workers=processes)} if processes > 1 else {}
+
+    dds = _deseq.DESeqDataSetFromMatrix(
+        countData=to_r_counts(counts, samples),
+        colData=design_matrix,
+        design=Formula(design_formula),
+    )
+    dds = _deseq.DESeq(dds, **parallel)
+
+    logger.info("Get DESeq2 results")
+
+    results = {None: from_r_results(_deseq.results(dds, **parallel))}
+
+    if factor not in design_matrix.columns:
+        return results
+
+    with localconverter(default_converter):
+        levels = list(r('function(dds, factor) levels(dds[[factor]])')(dds, factor))
+
+    for i, denominator in enumerate(levels):
+        for numerator in levels[i + 1:]:
+            results[numerator, denominator] = from_r_results(
+                _deseq.results(dds, contrast=StrVector([factor, numerator, denominator]), **parallel)
+            )
+
+    return results
+
+
+def get_deseq_pool() -> Pool:
+    """Return the pool of DESeq2 processes of this worker, starting it if needed."""
+    global _pool
+
+    if _pool is None:
+        _pool = Pool(
+            settings.DESEQ_PROCESSES,
+            initializer=_load_deseq,
+            maxtasksperchild=settings.DESEQ_MAX_TASKS_PER_PROCESS,
+        )
+
+    return _pool
+
+
+def _terminate_deseq_pool() -> None:
+    """Terminate the pool, e.g. when a job gave up waiting for a process that is still running DESeq2."""
+    global _pool
+
+    if _pool is not None:
+        _pool.terminate()
+        _pool = None
+
+
+def get_deseq_cache_key(
+    counts: np.ndarray,
+    samples: List[str],
+    design_matrix: pd.DataFrame,
+    design_formula: str,
+    factor: str,
+    min_count: int,
+) -> str:
+    """Return the hash of the inputs of DESeq2 the cached results are stored under."""
+    key = hashlib.sha256()
+
+    counts = np.ascontiguousarray(counts, dtype=np.int32)
+    key.update(repr(counts.shape).encode())
+    key.update(counts.tobytes())
+
+    key.update('\t'.join(samples).encode())
+    key.update('\t'.join(map(str, design_matrix.columns)).encode())
+    key.update(pd.util.hash_pandas_object(design_matrix, index=True).to_numpy().tobytes())
+    key.update(design_formula.encode())
+    key.update(factor.encode())
+    key.update(str(min_count).encode())
+
+    return key.hexdigest()
+
+
+def _evict_deseq_cache(cache: Checkpoint) -> None:
+    """Remove the results older than the maximum age, then the least recently used ones until the cache fits.
+
+    Results other workers are still writing are neither counted nor removed.
+    """
+    entries = []
+
+    for entry in os.scandir(cache.directory):
+        # Results still being written by another worker
+        if entry.name.startswith(TEMP_PREFIX):
+            continue
+
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:  # Evicted by another worker
+            continue
+
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    oldest = time.time() - settings.DESEQ_CACHE_MAX_AGE_DAYS * 24 * 60 * 60
+    total_size = sum(size for _, size, _ in entries)
+
+    for mtime, size, path in sorted(entries):
+        if mtime >= oldest and total_size <= settings.DESEQ_CACHE_MAX_BYTES:
+            break
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # Evicted by another worker
+            pass
+
+        total_size -= size
+
+
+def get_testable_genes(counts: np.ndarray, design_matrix: pd.DataFrame, min_count: int) -> np.ndarray:
+    """Return the mask of the genes with at least min_count reads in as many samples as the smallest class."""
+    if CONTRAST_FACTOR in design_matrix.columns:
+        smallest_class = int(design_matrix[CONTRAST_FACTOR].value_counts().min())
+    else:
+        smallest_class = 1
+
+    return (counts >= min_count).sum(axis=1) >= smallest_class
+
+
+def _get_deseq_results(
+    count_matrix: pd.DataFrame,
+    design_matrix: pd.DataFrame,
+    design_formula: str,
+    gene_column: str,
+) -> Dict[Optional[Tuple[str, str]], pd.DataFrame]:
+    """Return the results of all contrasts from the cache, or fit DESeq2 in the pool of DESeq2 processes."""
+    try:
+        assert gene_column in count_matrix.columns, 'Wrong gene id column name'
+
+    except AttributeError:
+        raise Exception('Wrong Pandas dataframe?')
+
+    counts = count_matrix.drop(gene_column, axis=1)
+
+    values = counts.to_numpy()
+
+    # DESeq2 rejects non-integer counts, which would otherwise be truncated by the int32 conversion
+    if not np.array_equal(values, np.round(values)):
+        raise ValueError('The read counts must be integers')
+
+    logger.info(
+        f'Number of columns in counts data {counts.shape[1]} | '
+        f'Number of rows in design matrix {design_matrix.shape[0]}'
+    )
+
+    samples = counts.columns.tolist()
+    min_count = settings.DESEQ_MIN_COUNT
+
+    cache = Checkpoint(DESEQ_CACHE_DIR)
+    key = get_deseq_cache_key(values, samples, design_matrix, design_formula, CONTRAST_FACTOR, min_count)
+    results = cache.load(key)
+
+    if results is not None:
+        logger.info(f'Reusing the cached DESeq2 results {key}')
+
+        # Mark the results as recently used, unless another worker just evicted them
+        try:
+            os.utime(cache.get_path(key))
+        except FileNotFoundError:
+            pass
+
+    else:
+        keep = get_testable_genes(values, design_matrix, min_count)
+
+        logger.info(f'Testing {keep.sum()} of {len(keep)} genes with enough reads')
+
+        try:
+            results = get_deseq_pool().apply(
+                _run_deseq,
+                (values[keep], samples, design_matrix, design_formula, CONTRAST_FACTOR, settings.DESEQ_WORKERS),
+            )
+
+        except SoftTimeLimitExceeded:
+            _terminate_deseq_pool()
+            raise
+
+        # Filtered genes have missing results, as the genes DESeq2 filters itself
+        positions = np.flatnonzero(keep)
+        results = {
+            contrast: contrast_results.set_index(positions).reindex(np.arange(len(keep)))
+            for contrast, contrast_results in results.items()
+        }
+
+        cache.save(key, results)
+        _evict_deseq_cache(cache)
+
+    gene_id = count_matrix[gene_column].values
+
+    for contrast_results in results.values():
+        contrast_results[gene_column] = gene_id
+
+    return results
+
+
+def _select_contrast(
+    results: Dict[Optional[Tuple[str, str]], pd.DataFrame],
+    contrast: Optional[Tuple[str, str]],
+) -> pd.DataFrame:
+    """Return the results of a contrast, reversing the sign of the results of the opposite contrast if needed."""
+    if contrast is None:
+        return results[None]
+
+    numerator, denominator = contrast
+
+    if (numerator, denominator) in results:
+        return results[numerator, denominator]
+
+    if (denominator, numerator) not in results:
+        raise ValueError(f'Class labels {numerator} and {denominator} cannot be compared')
+
+    reversed_results = results[denominator, numerator].copy()
+    reversed_results[SIGNED_COLUMNS] = -reversed_results[SIGNED_COLUMNS]
+
+    return reversed_results
+
+
+def run_deseq(
+    count_matrix: pd.DataFrame,
+    design_matrix: pd.DataFrame,
+    design_formula: str,
+    gene_column: str,
+    contrast: Optional[Tuple[str, str]] = None,
+) -> pd.DataFrame:
+    """Run DESeq2 on a count matrix in the pool of DESeq2 processes.
+
+    :param count_matrix: read counts with a column of gene identifiers and a column per sample
+    :param design_matrix: dataFrame with a row per sample and the variables of the design formula as columns
+    :param design_formula: design formula, e.g. '~ class_label'
+    :param gene_column: name of the column of gene identifiers
+    :param contrast: class labels (numerator, denominator) to compare. By default, the last class label is compared to
+        the first one.
+    :return: DESeq2 results with a row per gene and the gene identifiers in gene_column
+    """
+    results = _get_deseq_results(count_matrix, design_matrix, design_formula, gene_column)
+
+    return _select_contrast(results, contrast)
+
@@ -2,7 +2,7 @@
 
 """Form processing module."""
 
-from typing import Tuple, Union, Any
+from typing import Any, List, Tuple, Union
 
 import pandas as pd
 
@@ -12,13 +12,14 @@ from viewer.src.data_preprocessing import (
     check_text_file,
     process_data_file,
     check_label_compliance,
-    process_data_ora
+    process_data_ora,
+    process_gene_list_matrix,
 )
 from viewer.src.db_utils import load_results_metadata
-from viewer.src.form_processing_utils import get_genesets, _check_fold_changes_form
+from viewer.src.form_processing_utils import check_contrast, get_genesets, save_upload, _check_fold_changes_form
 from viewer.src.response_handler import *
-from viewer.src.utils import get_database_by_id, get_missing_columns
-from viewer.tasks import deploy_gsea, deploy_ora, deploy_deseq, deploy_prerank
+from viewer.src.utils import concatenate_files, get_database_by_id, get_missing_columns
+from viewer.tasks import deploy_gsea, deploy_ora, deploy_ora_batch, deploy_deseq, deploy_prerank
 
 
 def process_user_results(
@@ -29,7 +30,7 @@ def process_user_results(
 ) -> Union[Tuple[EnrichmentResult, Any], str, bool]:
     """Process user submitted results file and load enrichment result model."""
     fold_changes_df = None
-    read_counts_path = None
+    read_counts_df = None
 
     # Get cleaned data
     clean_results_data = results_form.cleaned_data['results_file']
@@ -40,6 +41,8 @@ def process_user_results(
     clean_read_counts = results_form_fc.cleaned_data['read_counts_file']
     clean_class_labels = results_form_fc.cleaned_data['class_file']
     significance_val_analysis = results_form_fc.cleaned_data['significance_value_run']
+    de_engine = results_form_fc.cleaned_data['de_engine']
+    contrast = results_form_fc.cleaned_data['contrast']
 
     # Get optional fold changes
     clean_fold_changes = results_form_fc.cleaned_data['fold_changes_file']
@@ -63,7 +66,12 @@ def process_user_results(
 
     # Process files to run DGE analysis
     elif len(fc_check) == 4:
-        read_counts_path, sig_cutoff, class_labels_list, class_label_path = fc_check
+        read_counts_df, sig_cutoff, class_labels_list, class_labels_df = fc_check
+
+        contrast = check_contrast(contrast, class_labels_list)
+
+        if isinstance(contrast, str):
+            return contrast
 
     # return HTTPBadRequest
     else:
@@ -139,7 +147,11 @@ def process_user_results(
         job.save()
 
     # Load results and metadata into results model
-    elif read_counts_path:
+    elif read_counts_df is not None:
+        # The workers read the parsed read counts and class labels instead of the uploaded files
+        read_counts_path = save_upload(read_counts_df, clean_read_counts)
+        class_label_path = save_upload(class_labels_df, clean_class_labels)
+
         job = load_results_metadata(
             results=results_df.copy(),
             current_user=current_user,
@@ -168,7 +180,9 @@ def process_user_results(
             design_matrix_filename=str(clean_class_labels),
             read_counts_filename=str(clean_read_counts),
             user_mail=user_email,
-            job_id=job.get_job_id()
+            job_id=job.get_job_id(),
+            de_engine=de_engine or DESEQ2_ENGINE,
+            contrast=contrast,
         )
 
         return job, task
@@ -206,11 +220,11 @@ def process_files_run_ora(
     form,
     db_form,
     parameters_form,
-) -> Union[Tuple[EnrichmentResult, Any], str, bool]:
+) -> Union[Tuple[Union[EnrichmentResult, List[EnrichmentResult]], Any], str, bool]:
     """Process user submitted files to run ORA and load enrichment results model."""
     gene_list_path = None
-    fold_changes_path = None
-    read_counts_path = None
+    gene_list_matrix_path = None
+    fold_changes_df = None
 
     # Get cleaned database selection
     select_database = db_form.cleaned_data['select_databases']
@@ -219,25 +233,35 @@ def process_files_run_ora(
     min_size = parameters_form.cleaned_data['minimum_size_ora']
     max_size = parameters_form.cleaned_data['maximum_size_ora']
     sig_threshold_ora = parameters_form.cleaned_data['sig_threshold_ora']
+    clean_background = parameters_form.cleaned_data['background_file_ora']
+    data_background = parameters_form.cleaned_data['data_background_ora']
 
     # Get cleaned optional gene list form
     clean_gene_list = form.cleaned_data['gene_list']
 
+    # Get cleaned optional multiple gene lists form
+    clean_gene_list_matrix = form.cleaned_data['gene_list_matrix']
+
     # Get cleaned optional read counts matrix form
     clean_read_counts = form.cleaned_data['read_counts_file_ora']
     clean_class_labels = form.cleaned_data['class_file_ora']
     significance_val_analysis = form.cleaned_data['significance_value_run_ora']
+    de_engine = form.cleaned_data['de_engine_ora']
+    contrast = form.cleaned_data['contrast_ora']
 
     # Get cleaned optional fold changes form
     clean_fold_changes = form.cleaned_data['fold_changes_file_ora']
     significance_val_results = form.cleaned_data['significance_value_upload_ora']
 
+    # Get optional threshold sweep on DEGs
+    sweep_cutoffs = list(ORA_SWEEP_CUTOFFS) if form.cleaned_data['threshold_sweep_ora'] else None
+
     # return HTTPBadRequest if no files submitted
-    if not (clean_gene_list or clean_read_counts or clean_fold_changes):
+    if not (clean_gene_list or clean_gene_list_matrix or clean_read_counts or clean_fold_changes):
         return ORA_EMPTY_FORM_MSG
 
     # return HTTPBadRequest if more than 1 file submitted
-    elif [clean_gene_list, clean_read_counts, clean_fold_changes].count(None) < 2:
+    elif [clean_gene_list, clean_gene_list_matrix, clean_read_counts, clean_fold_changes].count(None) < 3:
         return ORA_UPLOAD_MSG
 
     # Ensure either FC are uploaded or analysis is run and in latter case ensure read counts and labels both submitted
@@ -255,11 +279,15 @@ def process_files_run_ora(
 
     elif len(fc_check) == 2:
         fold_changes_df, sig_cutoff = fc_check
-        fold_changes_path = clean_fold_changes.transient_file_path()
 
     # Process files to run DGE analysis
     elif len(fc_check) == 4:
-        read_counts_path, sig_cutoff, class_labels_list, class_label_path = fc_check
+        read_counts_df, sig_cutoff, class_labels_list, class_labels_df = fc_check
+
+        contrast = check_contrast(contrast, class_labels_list)
+
+        if isinstance(contrast, str):
+            return contrast
 
     # return HTTPBadRequest
     else:
@@ -278,12 +306,38 @@ def process_files_run_ora(
 
         set_gene_symbols = set(ora_file_val.index.values)
 
+    # Get path to temporary uploaded file with multiple gene lists
+    if clean_gene_list_matrix:
+        gene_list_matrix_path = clean_gene_list_matrix.transient_file_path()
+
+        # Check if gene lists file is valid
+        gene_lists = process_gene_list_matrix(gene_list_matrix_path, str(clean_gene_list_matrix))
+
+        # return HTTPBadRequest
+        if isinstance(gene_lists, str):
+            return gene_lists
+
+        if not gene_lists:
+            return ORA_GENE_LISTS_MSG
+
+    # Get optional background genes
+    background = None
+
+    if clean_background:
+        background_file_val = process_data_ora(clean_background.transient_file_path(), str(clean_background))
+
+        # return HTTPBadRequest
+        if isinstance(background_file_val, str):
+            return background_file_val
+
+        background = list(set(background_file_val.index.values))
+
     # Ensure at least two databases are selected
     if len(select_database) < 2:
         return False
 
-    # Concatenate genesets in GMT format and process forms
-    mapping_is_valid, database_list, gmt_file_path = get_genesets(
+    # Get the genesets in GMT format of each database and process forms
+    mapping_is_valid, database_list, gmt_files = get_genesets(
         select_database, method=ORA
     )
 
@@ -323,16 +377,60 @@ def process_files_run_ora(
         )
 
         task = deploy_ora.delay(
-            gmt_file_path=gmt_file_path,
+            gmt_files=gmt_files,
             min_size=min_size,
             max_size=max_size,
             user_mail=user_email,
             job_id=job.get_job_id(),
             set_gene_symbols=list(set_gene_symbols),
+            background=background,
+        )
+
+    # Run ORA on each gene list of the user uploaded file in a single task
+    elif gene_list_matrix_path:
+        # Load one enrichment results model per gene list
+        jobs = [
+            load_results_metadata(
+                results=None,
+                current_user=current_user,
+                data_filename=f'{str(clean_gene_list_matrix)} [{gene_list_name}]',
+                class_filename="NA",
+                class_labels=['NA'],
+                sample_number=None,
+                databases=database_list,
+                min_size=min_size,
+                max_size=max_size,
+                significance_threshold=sig_threshold_ora,
+                permutation_type="NA",
+                permutation_number=None,
+                calculation_method="NA",
+                enrichment_method=ORA,
+                significance_threshold_fc=None,
+                fold_changes_filename="NA",
+                fold_change_results=None,
+                read_counts_path=None,
+            )
+            for gene_list_name in gene_lists
+        ]
+
+        # The gene lists share the databases in a single task, so their genesets are concatenated
+        task = deploy_ora_batch.delay(
+            gmt_file_path=concatenate_files(gmt_files, database_list),
+            min_size=min_size,
+            max_size=max_size,
+            user_mail=user_email,
+            job_ids=[job.get_job_id() for job in jobs],
+            gene_lists=list(gene_lists.values()),
+            background=background,
         )
 
+        return jobs, task
+
     # Run ORA on DEGs from fold change results file
-    elif fold_changes_path:
+    elif fold_changes_df is not None:
+        # The worker reads the parsed fold changes instead of the uploaded file
+        fold_changes_path = save_upload(fold_changes_df, clean_fold_changes)
+
         # Load enrichment results model with metadata and fold changes
         job = load_results_metadata(
             results=None,
@@ -356,17 +454,24 @@ def process_files_run_ora(
         )
 
         task = deploy_ora.delay(
-            gmt_file_path=gmt_file_path,
+            gmt_files=gmt_files,
             min_size=min_size,
             max_size=max_size,
             user_mail=user_email,
             job_id=job.get_job_id(),
             sig_threshold_fc=sig_cutoff,
             fold_changes_path=fold_changes_path,
+            background=background,
+            data_background=data_background,
+            sweep_cutoffs=sweep_cutoffs,
         )
 
     # Run DESeq2 and ORA on significant DEGs
     else:
+        # The worker reads the parsed read counts and class labels instead of the uploaded files
+        read_counts_path = save_upload(read_counts_df, clean_read_counts)
+        class_label_path = save_upload(class_labels_df, clean_class_labels)
+
         # Load enrichment results model
         job = load_results_metadata(
             results=None,
@@ -390,7 +495,7 @@ def process_files_run_ora(
         )
 
         task = deploy_ora.delay(
-            gmt_file_path=gmt_file_path,
+            gmt_files=gmt_files,
             min_size=min_size,
             max_size=max_size,
             user_mail=user_email,
@@ -398,6 +503,11 @@ def process_files_run_ora(
             sig_threshold_fc=sig_cutoff,
             read_counts_path=read_counts_path,
             design_matrix_path=class_label_path,
+            background=background,
+            data_background=data_background,
+            sweep_cutoffs=sweep_cutoffs,
+            de_engine=de_engine or DESEQ2_ENGINE,
+            contrast=contrast,
         )
 
     return job, task
@@ -411,6 +521,7 @@ def process_files_run_gsea(
     fc_form
 ) -> Union[Tuple[EnrichmentResult, Any], str, bool]:
     """Process user submitted files to run enrichment and load GSEA model."""
+    read_counts_df = None
     read_counts_path = None
     fold_changes_path = None
     class_path = None
@@ -429,12 +540,14 @@ def process_files_run_gsea(
     min_size_gsea = form.cleaned_data['minimum_size_gsea']
     permutation_type = form.cleaned_data['permutation_type']
     permutation_num_gsea = form.cleaned_data['permutation_num_gsea']
+    engine_gsea = form.cleaned_data['engine_gsea']
     sig_threshold_gsea = form.cleaned_data['sig_threshold_gsea']
 
     # Get optional parameters preranked
     max_size_prerank = form.cleaned_data['maximum_size_gsea_prerank']
     min_size_prerank = form.cleaned_data['minimum_size_gsea_prerank']
     permutation_num_prerank = form.cleaned_data['permutation_num_prerank']
+    engine_prerank = form.cleaned_data['engine_prerank']
     sig_threshold_prerank = form.cleaned_data['sig_threshold_prerank']
 
     # Get optional files to run DGE analysis
@@ -442,6 +555,8 @@ def process_files_run_gsea(
     clean_classes_fc = fc_form.cleaned_data['class_file_fc_gsea']
 
     significance_val_analysis = fc_form.cleaned_data['significance_value_run_gsea']
+    de_engine = fc_form.cleaned_data['de_engine_gsea']
+    contrast = fc_form.cleaned_data['contrast_gsea']
 
     # Get optional fold changes
     clean_fold_changes = fc_form.cleaned_data['fold_changes_file_gsea']
@@ -482,7 +597,12 @@ def process_files_run_gsea(
         fold_changes_df, sig_cutoff = fc_check
 
     elif len(fc_check) == 4:
-        read_counts_path, sig_cutoff, _, class_path = fc_check
+        read_counts_df, sig_cutoff, class_labels_list, class_labels_df = fc_check
+
+        contrast = check_contrast(contrast, class_labels_list)
+
+        if isinstance(contrast, str):
+            return contrast
 
     # return HTTPBadRequest
     else:
@@ -581,6 +701,19 @@ def process_files_run_gsea(
     if mapping_is_valid is False:
         return MAPPING_SELECTION_MSG
 
+    # The worker reads the parsed files instead of the uploaded ones, which are all valid by now
+    if clean_exp_data:
+        data_path = save_upload(expression_df, clean_exp_data)
+        class_path = save_upload(class_file_val, clean_cls)
+    else:
+        preranked_path = save_upload(prerank_file_val, clean_preranked_data)
+
+        if read_counts_df is not None:
+            class_path = save_upload(class_labels_df, clean_class_labels)
+
+    if read_counts_df is not None:
+        read_counts_path = save_upload(read_counts_df, clean_read_counts)
+
     if isinstance(fold_changes_df, pd.DataFrame):
         # Load metadata to Enrichment results model
         job = load_results_metadata(
@@ -619,6 +752,7 @@ def process_files_run_gsea(
                 permutation_type=permutation_type,
                 permutation_num=permutation_num_gsea,
                 method=method,
+                engine=engine_gsea or GSEAPY_ENGINE,
                 user_mail=user_email,
                 job_id=job.get_job_id(),
             )
@@ -634,6 +768,7 @@ def process_files_run_gsea(
                 min_size=min_size,
                 max_size=max_size,
                 permutation_num=permutation_num,
+                engine=engine_prerank or GSEAPY_ENGINE,
                 user_mail=user_email,
                 job_id=job.get_job_id(),
             )
@@ -676,10 +811,13 @@ def process_files_run_gsea(
                 permutation_type=permutation_type,
                 permutation_num=permutation_num,
                 method=method,
+                engine=engine_gsea or GSEAPY_ENGINE,
                 user_mail=user_email,
                 job_id=job.get_job_id(),
                 read_counts_path=read_counts_path,
                 read_counts_filename=str(clean_read_counts),
+                de_engine=de_engine or DESEQ2_ENGINE,
+                contrast=contrast,
             )
 
         # GSEA Pre-ranked
@@ -693,12 +831,15 @@ def process_files_run_gsea(
                 min_size=min_size,
                 max_size=max_size,
                 permutation_num=permutation_num,
+                engine=engine_prerank or GSEAPY_ENGINE,
                 user_mail=user_email,
                 job_id=job.get_job_id(),
                 read_counts_path=read_counts_path,
                 read_counts_filename=str(clean_read_counts),
                 class_labels_path=class_path,
                 class_filename=class_filename,
+                de_engine=de_engine or DESEQ2_ENGINE,
+                contrast=contrast,
             )
 
     return job, task
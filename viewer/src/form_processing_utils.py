@@ -3,9 +3,11 @@
 """Form processing utils module."""
 
 import pickle
-from typing import List, Tuple, Union
+from datetime import timedelta
+from typing import List, Optional, Tuple, Union
 
 import pandas as pd
+from cleanup_later.models import CleanupFile
 from django.db.models import QuerySet
 
 from viewer.models import Pathway, PathwayDatabase
@@ -15,12 +17,15 @@ from viewer.src.data_preprocessing import (
     process_data_file,
     check_label_compliance, _read_text_file, _check_df_validity, _check_mapping_df
 )
-from viewer.src.response_handler import MAPPING_SELECTION_MSG, RUN_DGE_ANALYSIS_MSG, DGE_OPTIONS_MSG
-from viewer.src.utils import concatenate_files, get_missing_columns
+from viewer.src.response_handler import CONTRAST_MSG, MAPPING_SELECTION_MSG, RUN_DGE_ANALYSIS_MSG, DGE_OPTIONS_MSG
+from viewer.src.utils import get_missing_columns, save_upload_artifact
 
 
-def get_genesets(selected_database: QuerySet, method: str) -> Union[str, Tuple[bool, List, str]]:
-    """Process forms submitted by user and generate gene sets."""
+def get_genesets(selected_database: QuerySet, method: str) -> Union[str, Tuple[bool, List, List[str]]]:
+    """Process forms submitted by user and return the GMT file of each selected database.
+
+    Each database of a job runs in its own task, so the GMT files are not concatenated.
+    """
     # Check if mappings are valid
     mapping_is_valid = True
 
@@ -53,8 +58,7 @@ def get_genesets(selected_database: QuerySet, method: str) -> Union[str, Tuple[b
     gmt_files_list = list(gmt_files_path)
 
     if method == ORA:
-        # Concatenate gmt files selected by user
-        gmt_files = concatenate_files(gmt_files_list, databases)
+        gmt_files = gmt_files_list
 
     else:
         gmt_files = [
@@ -65,6 +69,17 @@ def get_genesets(selected_database: QuerySet, method: str) -> Union[str, Tuple[b
     return mapping_is_valid, databases, gmt_files
 
 
+def save_upload(df: pd.DataFrame, upload) -> str:
+    """Hand an upload parsed by the web tier to the workers as an artifact and return its path.
+
+    The workers never read the uploaded text file, so it is removed after 30 minutes. The workers remove the artifact,
+    so it must only be saved once all the forms of the job are valid and the job is about to be queued.
+    """
+    CleanupFile.register(upload.transient_file_path(), timedelta(minutes=30))
+
+    return save_upload_artifact(df)
+
+
 def add_forms_to_formset(request, formset, extra: int):
     """Add additional forms to formset."""
 
@@ -164,15 +179,29 @@ def _check_fold_changes_form(
         class_label_df = class_file
 
         # Get list of class labels in order corresponding to read counts file
-        class_labels = check_label_compliance(read_counts_df, class_label_df)
+        class_labels_list = check_label_compliance(read_counts_df, class_label_df)
 
-        if isinstance(class_labels, str):
-            return class_labels
+        if isinstance(class_labels_list, str):
+            return class_labels_list
 
         if significance_val_analysis is None:
             significance_val_analysis = PADJ
 
-        return counts_path, significance_val_analysis, class_labels, class_path
+        # The callers hand the parsed files to the workers once all the forms are valid
+        return read_counts_df, significance_val_analysis, class_labels_list, class_label_df
+
+
+def check_contrast(contrast: Optional[str], class_labels: List) -> Union[Optional[List[str]], str]:
+    """Check the contrast submitted to run DGE analysis and return its class labels [numerator, denominator]."""
+    if not contrast:
+        return None
+
+    labels = [label.strip() for label in contrast.split(',')]
+
+    if len(labels) != 2 or labels[0] == labels[1] or not set(labels).issubset(map(str, class_labels)):
+        return CONTRAST_MSG
+
+    return labels
 
 
 def process_fold_changes_upload(clean_fold_changes) -> Union[pd.DataFrame, str]:
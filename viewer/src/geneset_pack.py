@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+"""Compiled gene set packs.
+
+A pack is a single binary file written next to a GMT file. It holds the gene sets as CSR-style integer arrays
+(``indptr``/``indices`` into a gene symbol table) together with the pathway and gene string tables and a precomputed
+size array. Web and worker processes memory-map the pack instead of re-reading and re-splitting the GMT text, and the
+pack is recompiled automatically whenever the source GMT file changes.
+"""
+
+import functools
+import json
+import logging
+import os
+import struct
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from viewer.src.constants import GENESET_PACK_EXTENSION
+
+logger = logging.getLogger(__name__)
+
+#: Pack file signature and format version
+PACK_MAGIC = b'DPPACK01'
+PACK_VERSION = 1
+
+#: Byte alignment of the arrays stored in a pack
+_ALIGNMENT = 64
+
+#: Order in which arrays are written to the pack
+_PACK_ARRAYS = ('pathways', 'genes', 'indptr', 'indices', 'sizes')
+
+
+class GenesetPack:
+    """Gene sets of a GMT file stored as CSR arrays over a gene symbol table."""
+
+    def __init__(
+        self,
+        pathways: np.ndarray,
+        genes: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        sizes: np.ndarray,
+    ):
+        """Initialize the pack.
+
+        :param pathways: pathway identifiers in GMT order
+        :param genes: gene symbol table
+        :param indptr: offsets of each pathway in indices
+        :param indices: gene table positions of each pathway, in GMT order and including duplicates
+        :param sizes: number of genes listed for each pathway
+        """
+        self.pathways = pathways
+        self.genes = genes
+        self.indptr = indptr
+        self.indices = indices
+        self.sizes = sizes
+        self._gene_index = None
+
+    def __len__(self):
+        return len(self.pathways)
+
+    @property
+    def gene_index(self) -> Dict[str, int]:
+        """Return the mapping from gene symbol to position in the gene table."""
+        if self._gene_index is None:
+            self._gene_index = {gene: index for index, gene in enumerate(self.genes.tolist())}
+
+        return self._gene_index
+
+    def size_filter(
+        self,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        exclusive_min: bool = False,
+    ) -> np.ndarray:
+        """Return the positions of the pathways whose size is within the given limits.
+
+        :param min_size: lower size limit, inclusive unless exclusive_min is set
+        :param max_size: inclusive upper size limit
+        :param exclusive_min: exclude pathways of exactly min_size genes
+        """
+        mask = np.ones(len(self), dtype=bool)
+
+        if min_size is not None:
+            mask &= self.sizes > min_size if exclusive_min else self.sizes >= min_size
+        if max_size is not None:
+            mask &= self.sizes <= max_size
+
+        return np.flatnonzero(mask)
+
+    def get_geneset(self, position: int) -> List[str]:
+        """Return the genes of the pathway at the given position."""
+        return self.genes[self.indices[self.indptr[position]:self.indptr[position + 1]]].tolist()
+
+    def to_dict(self, positions: Optional[np.ndarray] = None) -> Dict[str, List[str]]:
+        """Return a dictionary of pathway to gene list, as parsed from the GMT file."""
+        if positions is None:
+            positions = range(len(self))
+
+        return {
+            str(self.pathways[position]): self.get_geneset(position)
+            for position in positions
+        }
+
+    def gene_ids(self, genes: Iterable[str]) -> np.ndarray:
+        """Return the sorted gene table positions of the given gene symbols, ignoring symbols not in the pack."""
+        gene_index = self.gene_index
+        return np.array(sorted({gene_index[gene] for gene in genes if gene in gene_index}), dtype=np.int64)
+
+    def incidence_matrix(
+        self,
+        positions: Optional[np.ndarray] = None,
+        gene_ids: Optional[np.ndarray] = None,
+    ) -> sparse.csr_matrix:
+        """Return the binary gene x pathway incidence matrix of the selected pathways.
+
+        Rows follow the gene table of the pack and columns follow positions. If gene_ids is given, the rows of all
+        other genes are left empty.
+        """
+        if gene_ids is None:
+            data = np.ones(len(self.indices), dtype=np.int32)
+        else:
+            keep = np.zeros(len(self.genes), dtype=np.int32)
+            keep[gene_ids] = 1
+            data = keep[self.indices]
+
+        # Copy the memory-mapped arrays, which are read-only
+        matrix = sparse.csr_matrix((data, self.indices, self.indptr), shape=(len(self), len(self.genes)), copy=True)
+
+        if positions is not None:
+            matrix = matrix[positions]
+
+        # Duplicated symbols in a GMT line count once
+        matrix.sum_duplicates()
+        matrix.eliminate_zeros()
+        matrix.data[:] = 1
+
+        return matrix.T.tocsr()
+
+
+def get_pack_path(gmt_path: str) -> str:
+    """Return the path of the compiled pack of a GMT file."""
+    return gmt_path + GENESET_PACK_EXTENSION
+
+
+def _get_source_stamp(gmt_path: str) -> Tuple[int, int]:
+    """Return the modification time and size of a GMT file."""
+    stat = os.stat(gmt_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _parse_gmt(gmt_path: str) -> Dict[str, List[str]]:
+    """Parse a GMT file into a dictionary of pathway to gene list."""
+    with open(gmt_path) as file:
+        return {
+            fields[0]: fields[2:]
+            for fields in (line.strip().split('\t') for line in file)
+            if fields[0]
+        }
+
+
+def _string_table(strings) -> np.ndarray:
+    """Return a fixed-width unicode array of the given strings."""
+    strings = list(strings)
+    return np.array(strings, dtype=f'<U{max([1] + [len(string) for string in strings])}')
+
+
+def _write_pack(pack_path: str, arrays: Dict[str, np.ndarray], source: Dict) -> None:
+    """Write arrays to a pack file, replacing any existing pack atomically."""
+    header = {'version': PACK_VERSION, 'source': source, 'arrays': {}}
+
+    offset = 0
+    for name in _PACK_ARRAYS:
+        array = arrays[name]
+        header['arrays'][name] = {'dtype': array.dtype.str, 'length': len(array), 'offset': offset}
+        offset = _align(offset + array.nbytes)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(len(PACK_MAGIC) + 8 + len(header_bytes))
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(pack_path) or None, suffix=GENESET_PACK_EXTENSION)
+
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(PACK_MAGIC)
+            file.write(struct.pack('<Q', len(header_bytes)))
+            file.write(header_bytes)
+
+            for name in _PACK_ARRAYS:
+                file.seek(data_start + header['arrays'][name]['offset'])
+                file.write(np.ascontiguousarray(arrays[name]).tobytes())
+
+        os.replace(temp_path, pack_path)
+
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def compile_pack(gmt_path: str) -> str:
+    """Compile a GMT file into a pack written next to it and return the pack path."""
+    source = _get_source_stamp(gmt_path)
+    genesets_dict = _parse_gmt(gmt_path)
+
+    gene_index = {}
+    indices = [
+        gene_index.setdefault(gene, len(gene_index))
+        for genes in genesets_dict.values()
+        for gene in genes
+    ]
+    sizes = np.array([len(genes) for genes in genesets_dict.values()], dtype=np.int32)
+
+    arrays = {
+        'pathways': _string_table(genesets_dict),
+        'genes': _string_table(gene_index),
+        'indptr': np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]),
+        'indices': np.array(indices, dtype=np.int32),
+        'sizes': sizes,
+    }
+
+    pack_path = get_pack_path(gmt_path)
+    _write_pack(pack_path, arrays, {'mtime_ns': source[0], 'size': source[1]})
+
+    logger.info(f'Compiled {len(sizes)} gene sets from {gmt_path} into {pack_path}')
+
+    return pack_path
+
+
+def _read_pack_header(pack_path: str) -> Tuple[Dict, int]:
+    """Read the header of a pack file and return it with the offset of the array data."""
+    with open(pack_path, 'rb') as file:
+        if file.read(len(PACK_MAGIC)) != PACK_MAGIC:
+            raise ValueError(f'{pack_path} is not a gene set pack')
+
+        header_length, = struct.unpack('<Q', file.read(8))
+        header = json.loads(file.read(header_length).decode('utf-8'))
+
+    return header, _align(len(PACK_MAGIC) + 8 + header_length)
+
+
+def _is_pack_current(pack_path: str, source: Tuple[int, int]) -> bool:
+    """Check if a pack exists and was compiled from the current version of its GMT file."""
+    try:
+        header, _ = _read_pack_header(pack_path)
+    except (IOError, ValueError):
+        return False
+
+    return (
+        header['version'] == PACK_VERSION
+        and (header['source']['mtime_ns'], header['source']['size']) == source
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _open_pack(pack_path: str, source: Tuple[int, int]) -> GenesetPack:
+    """Memory-map a pack file. Cached per process and per version of the source GMT file."""
+    header, data_start = _read_pack_header(pack_path)
+
+    buffer = np.memmap(pack_path, dtype=np.uint8, mode='r')
+
+    arrays = {
+        name: np.frombuffer(
+            buffer,
+            dtype=np.dtype(spec['dtype']),
+            count=spec['length'],
+            offset=data_start + spec['offset'],
+        ) if spec['length'] else np.empty(0, dtype=np.dtype(spec['dtype']))
+        for name, spec in header['arrays'].items()
+    }
+
+    return GenesetPack(**arrays)
+
+
+def load_pack(gmt_path: str) -> GenesetPack:
+    """Load the pack of a GMT file, compiling it first if it is missing or out of date."""
+    source = _get_source_stamp(gmt_path)
+    pack_path = get_pack_path(gmt_path)
+
+    if not _is_pack_current(pack_path, source):
+        compile_pack(gmt_path)
+
+    return _open_pack(pack_path, source)
@@ -2,24 +2,35 @@
 
 """This module runs GSEA and pre-ranked GSEA."""
 
-from typing import List, Union
+import os
+from typing import Callable, List, Optional, Union
 
 import gseapy
 import pandas as pd
 
+from viewer.src import gsea_engine
+from viewer.src.checkpoint import Checkpoint, get_database_checkpoint_name
+from viewer.src.constants import ADAPTIVE_ENGINE, GSEAPY_ENGINE, MULTILEVEL_ENGINE, NATIVE_ENGINE
+from viewer.src.progress import ProgressReporter
+
 
 def perform_gsea(
     data: Union[str, pd.DataFrame],
     gmt: str,
     class_vector: List,
-    output_dir: str,
+    output_dir: Optional[str],
     min_size: int,
     max_size: int,
     permutation_type: str,
     permutation_num: int,
-    method: str
+    method: str,
+    processes: int = 1,
+    seed: Optional[int] = None,
 ):
-    """Run GSEA on a given dataset and geneset."""
+    """Run GSEA on a given dataset and geneset.
+
+    Without an output directory, GSEApy keeps its results in memory and writes no reports.
+    """
     return gseapy.gsea(
         data=data,
         gene_sets=gmt,
@@ -31,19 +42,25 @@ def perform_gsea(
         method=method,
         outdir=output_dir,
         no_plot=True,  # Skip plotting
-        processes=1,
+        processes=processes,
+        seed=seed,
     )
 
 
 def perform_prerank(
     rnk: pd.DataFrame,
     gmt: str,
-    output_dir: str,
+    output_dir: Optional[str],
     min_size: int,
     max_size: int,
     permutation_num: int,
+    processes: int = 1,
+    seed: Optional[int] = None,
 ):
-    """Run GSEA on a pre-ranked list of genes."""
+    """Run GSEA on a pre-ranked list of genes.
+
+    Without an output directory, GSEApy keeps its results in memory and writes no reports.
+    """
     return gseapy.prerank(
         rnk=rnk,
         gene_sets=gmt,
@@ -52,5 +69,159 @@ def perform_prerank(
         permutation_num=permutation_num,
         outdir=output_dir,
         no_plot=True,  # Skip plotting
-        processes=1,
+        processes=processes,
+        seed=seed,
+    )
+
+
+def run_gsea(
+    data: pd.DataFrame,
+    gmt: Union[str, List[str]],
+    class_vector: List,
+    output_dir: Optional[str],
+    min_size: int,
+    max_size: int,
+    permutation_type: str,
+    permutation_num: int,
+    method: str,
+    engine: str = GSEAPY_ENGINE,
+    processes: int = 1,
+    seed: Optional[int] = None,
+    significance_threshold: Optional[float] = None,
+    progress: Optional[ProgressReporter] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> pd.DataFrame:
+    """Run GSEA with the selected engine and return the results dataFrame.
+
+    With several GMT files, the native engine ranks the genes and runs the permutations once for all databases, while
+    GSEApy is run once per database. The adaptive engine stops permuting gene sets whose p-value is clearly above or
+    below the nominal cutoffs derived from the FDR threshold. With a checkpoint, the native engines resume from the last
+    round of permutations saved and GSEApy skips the databases already run. GSEApy only writes its reports if an output
+    directory is given, while the native engines never write any.
+    """
+    gmt_files = _get_gmt_files(gmt)
+
+    if engine in (NATIVE_ENGINE, ADAPTIVE_ENGINE):
+        return gsea_engine.gsea(
+            data=data,
+            gmt=gmt_files,
+            class_vector=class_vector,
+            min_size=min_size,
+            max_size=max_size,
+            permutation_type=permutation_type,
+            permutation_num=int(permutation_num),
+            method=method,
+            seed=seed,
+            processes=processes,
+            significance_threshold=significance_threshold if engine == ADAPTIVE_ENGINE else None,
+            progress=progress.permutations if progress else None,
+            checkpoint=checkpoint,
+        )
+
+    return _run_per_database(
+        gmt_files,
+        lambda gmt_file: perform_gsea(
+            data=data,
+            gmt=gmt_file,
+            class_vector=class_vector,
+            output_dir=output_dir,
+            min_size=min_size,
+            max_size=max_size,
+            permutation_type=permutation_type,
+            permutation_num=permutation_num,
+            method=method,
+            processes=processes,
+            seed=seed,
+        ).res2d,
+        progress,
+        checkpoint,
+    )
+
+
+def run_prerank(
+    rnk: pd.DataFrame,
+    gmt: Union[str, List[str]],
+    output_dir: Optional[str],
+    min_size: int,
+    max_size: int,
+    permutation_num: int,
+    engine: str = GSEAPY_ENGINE,
+    processes: int = 1,
+    seed: Optional[int] = None,
+    significance_threshold: Optional[float] = None,
+    progress: Optional[ProgressReporter] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> pd.DataFrame:
+    """Run GSEA pre-ranked with the selected engine and return the results dataFrame.
+
+    With several GMT files, the native engine runs the permutations once for all databases, while GSEApy is run once per
+    database. The adaptive engine stops permuting gene sets whose p-value is clearly above or below the nominal cutoffs
+    derived from the FDR threshold. The multilevel engine estimates the p-values the permutations cannot resolve. With a
+    checkpoint, the native engines resume from the last round of permutations saved and GSEApy skips the databases
+    already run. GSEApy only writes its reports if an output directory is given, while the native engines never write
+    any.
+    """
+    gmt_files = _get_gmt_files(gmt)
+
+    if engine in (NATIVE_ENGINE, ADAPTIVE_ENGINE, MULTILEVEL_ENGINE):
+        return gsea_engine.prerank(
+            rnk=rnk,
+            gmt=gmt_files,
+            min_size=min_size,
+            max_size=max_size,
+            permutation_num=int(permutation_num),
+            seed=seed,
+            processes=processes,
+            significance_threshold=significance_threshold if engine == ADAPTIVE_ENGINE else None,
+            multilevel=engine == MULTILEVEL_ENGINE,
+            progress=progress.permutations if progress else None,
+            checkpoint=checkpoint,
+        )
+
+    return _run_per_database(
+        gmt_files,
+        lambda gmt_file: perform_prerank(
+            rnk=rnk,
+            gmt=gmt_file,
+            output_dir=output_dir,
+            min_size=min_size,
+            max_size=max_size,
+            permutation_num=permutation_num,
+            processes=processes,
+            seed=seed,
+        ).res2d,
+        progress,
+        checkpoint,
     )
+
+
+def _run_per_database(
+    gmt_files: List[str],
+    run_database: Callable[[str], pd.DataFrame],
+    progress: Optional[ProgressReporter] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> pd.DataFrame:
+    """Run each database separately and concatenate the results, reusing the results saved in the checkpoint."""
+    results = []
+
+    for step, gmt_file in enumerate(gmt_files, start=1):
+        name = get_database_checkpoint_name(gmt_file)
+        result = checkpoint.load(name) if checkpoint else None
+
+        if result is None:
+            if progress:
+                progress.database(step, len(gmt_files), name=os.path.splitext(os.path.basename(gmt_file))[0])
+
+            result = run_database(gmt_file)
+
+            if checkpoint:
+                checkpoint.save(name, result)
+
+        results.append(result)
+
+    return pd.concat(results)
+
+
+def _get_gmt_files(gmt: Union[str, List[str]]) -> List[str]:
+    """Return the list of GMT files of one or several databases."""
+    return [gmt] if isinstance(gmt, str) else list(gmt)
@@ -0,0 +1,1316 @@
+# -*- coding: utf-8 -*-
+
+"""Native GSEA engine.
+
+Computes the same statistics as GSEApy's GSEA and pre-ranked GSEA, but scores all gene sets and a whole block of
+permutations at once. Each gene set is stored as the positions of its genes in the ranked list, so the running sum of a
+gene set only has to be evaluated at its hits: its maximum is reached right after a hit and its minimum right before
+one. Permutations only change these positions and their weights, either by re-ranking genes after shuffling the class
+labels (phenotype permutations) or by drawing random positions for their genes (gene set permutations).
+
+In adaptive mode, permutations run in rounds and gene sets stop being permuted once the confidence interval of their
+p-value is entirely above or below the nominal cutoffs derived from the FDR threshold of the job, so the rest of the
+budget goes to borderline gene sets.
+
+For pre-ranked GSEA, p-values below the resolution of the permutations can be estimated with the multilevel split Monte
+Carlo method of fgsea (Korotkevich et al., 2021). Random gene sets of the same size as the tested gene sets are
+iteratively conditioned on higher and higher enrichment scores, so the number of samples grows with the log of the
+p-value instead of its inverse. The chains only depend on the size of the gene sets, so they are shared by all gene
+sets of the same size.
+
+Each round of permutations draws from its own random stream, keyed on the index of its first permutation, and the null
+enrichment scores of each round can be saved to a checkpoint. A job interrupted by the time limit can then resume
+from its last round without repeating or reusing the permutations already done.
+
+A job can score the gene sets of several databases at once. The observed ranking and the permutations are then computed
+a single time and shared by all databases, while the statistics are still reported per database. With gene set
+permutations, the null distribution is further computed once per gene set size and shared by all gene sets of that size.
+"""
+
+import logging
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from billiard import Pool
+from scipy import sparse, stats
+
+from viewer.src.checkpoint import Checkpoint, PERMUTATIONS_CHECKPOINT, get_round_checkpoint_name
+from viewer.src.constants import PERMUTATIONS_COLUMN
+from viewer.src.geneset_pack import load_pack
+
+logger = logging.getLogger(__name__)
+
+#: Upper bound on the number of values held in one block of permutations
+MAX_BLOCK_ELEMENTS = 2 ** 22
+
+#: Columns of the GSEA results, as reported by GSEApy
+RESULTS_COLUMNS = ['es', 'nes', 'pval', 'fdr', 'geneset_size', 'matched_size', 'genes', 'ledge_genes']
+
+#: Number of permutations of each round, after which progress is reported and, in adaptive mode, gene sets with a
+#: decided p-value stop being permuted
+ROUND_SIZE = 100
+
+#: Confidence level of the p-value intervals used to stop permuting a gene set
+ADAPTIVE_CONFIDENCE = 0.99
+
+#: Number of random gene sets of each multilevel chain
+MULTILEVEL_SAMPLE_SIZE = 101
+
+#: Maximum number of levels of a multilevel chain, which bounds p-values at about 2 ** -MULTILEVEL_MAX_LEVELS
+MULTILEVEL_MAX_LEVELS = 200
+
+#: Gene sets with fewer null scores at least as extreme as their enrichment score are refined with multilevel p-values
+MULTILEVEL_MIN_BEYOND = 10
+
+#: Fraction of the genes of a random gene set swapped at each level of a multilevel chain, with at least 10 swaps
+MULTILEVEL_PERTURBATION = 0.1
+
+#: Ranking metrics supported for phenotype permutations
+RANKING_METHODS = (
+    'signal_to_noise', 's2n', 'abs_signal_to_noise', 'abs_s2n', 't_test', 'ratio_of_classes', 'diff_of_classes',
+    'log2_ratio_of_classes',
+)
+
+
+class GenesetHits:
+    """Gene sets encoded as the indices of their genes in an expression dataFrame or ranked list."""
+
+    def __init__(self, terms: List[str], geneset_sizes: np.ndarray, indptr: np.ndarray, indices: np.ndarray):
+        """Initialize the gene sets.
+
+        :param terms: gene set names
+        :param geneset_sizes: number of genes of each gene set in the GMT file
+        :param indptr: offsets of each gene set in indices
+        :param indices: gene indices of each gene set
+        """
+        self.terms = terms
+        self.geneset_sizes = geneset_sizes
+        self.indptr = indptr
+        self.indices = indices
+        self.matched_sizes = np.diff(indptr)
+        self.segments = np.repeat(np.arange(len(terms)), self.matched_sizes)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def subset(self, keep: np.ndarray) -> 'GenesetHits':
+        """Return the gene sets at the given sorted positions."""
+        return GenesetHits(
+            terms=[self.terms[i] for i in keep],
+            geneset_sizes=self.geneset_sizes[keep],
+            indptr=np.concatenate([[0], np.cumsum(self.matched_sizes[keep])]).astype(np.int64),
+            indices=self.indices[np.isin(self.segments, keep)],
+        )
+
+
+def load_geneset_hits(gmt_path: str, genes: np.ndarray, min_size: int, max_size: int) -> GenesetHits:
+    """Load the gene sets of a GMT file as indices into a list of genes.
+
+    As in GSEApy, gene sets are kept if between min_size and max_size of their genes are in the list, and gene sets
+    are sorted by name.
+    """
+    pack = load_pack(gmt_path)
+
+    # Gene sets with duplicated names are overwritten by the last one in the GMT file
+    last_positions = {str(pathway): position for position, pathway in enumerate(pack.pathways.tolist())}
+    terms = sorted(last_positions)
+    positions = np.array([last_positions[term] for term in terms], dtype=np.int64)
+
+    # Map the genes of the list to the gene table of the pack
+    gene_index = pack.gene_index
+    known = [(index, gene_index[gene]) for index, gene in enumerate(genes) if gene in gene_index]
+    rows, columns = zip(*known) if known else ((), ())
+
+    selection = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+        shape=(len(genes), len(pack.genes)),
+    )
+
+    # Gene set x gene indicator matrix
+    hits = (selection @ pack.incidence_matrix(positions)).T.tocsr()
+    hits.sort_indices()
+
+    matched_sizes = np.diff(hits.indptr)
+    keep = np.flatnonzero((matched_sizes >= min_size) & (matched_sizes <= max_size))
+
+    logger.info(f'{len(terms) - len(keep)} gene sets have been filtered out when max_size={max_size} and '
+                f'min_size={min_size}')
+
+    if not len(keep):
+        raise Exception("No gene sets passed through filtering condition")
+
+    hits = hits[keep]
+
+    return GenesetHits(
+        terms=[terms[i] for i in keep],
+        geneset_sizes=pack.sizes[positions[keep]].astype(np.int64),
+        indptr=hits.indptr.astype(np.int64),
+        indices=hits.indices.astype(np.int64),
+    )
+
+
+def concatenate_geneset_hits(databases: List[GenesetHits]) -> GenesetHits:
+    """Concatenate the gene sets of several databases encoded against the same list of genes."""
+    if len(databases) == 1:
+        return databases[0]
+
+    offsets = np.cumsum([0] + [len(database.indices) for database in databases[:-1]])
+
+    return GenesetHits(
+        terms=[term for database in databases for term in database.terms],
+        geneset_sizes=np.concatenate([database.geneset_sizes for database in databases]),
+        indptr=np.concatenate(
+            [[0]] + [database.indptr[1:] + offset for database, offset in zip(databases, offsets)]
+        ).astype(np.int64),
+        indices=np.concatenate([database.indices for database in databases]),
+    )
+
+
+def _load_databases(
+    gmt: Union[str, List[str]],
+    genes: np.ndarray,
+    min_size: int,
+    max_size: int,
+) -> List[GenesetHits]:
+    """Load the gene sets of one or several GMT files as indices into the same list of genes."""
+    gmt_files = [gmt] if isinstance(gmt, str) else gmt
+
+    return [load_geneset_hits(gmt_file, genes, min_size, max_size) for gmt_file in gmt_files]
+
+
+"""Running sums"""
+
+
+def _segment_reduce(ufunc, values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Reduce the values of each gene set along the last axis."""
+    return ufunc.reduceat(values, starts, axis=-1)
+
+
+def running_sum_extremes(
+    genesets: GenesetHits,
+    positions: np.ndarray,
+    weights: np.ndarray,
+    n_genes: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the candidates for the maximum and minimum of the running sum of every gene set.
+
+    :param genesets: gene sets
+    :param positions: (block x hits) positions in the ranked list of the hits of every gene set, sorted within each
+        gene set
+    :param weights: (block x hits) weights of the hits
+    :param n_genes: number of genes in the ranked list
+    :return: running sum right after each hit, right before each hit, and its maximum and minimum per gene set
+    """
+    starts = genesets.indptr[:-1]
+    ends = genesets.indptr[1:]
+    segments = genesets.segments
+
+    # Cumulative weight of the hits within each gene set
+    cumulative = np.cumsum(weights, axis=-1)
+    exclusive = cumulative - weights
+    offsets = exclusive[..., starts]
+
+    total = (cumulative[..., ends - 1] - offsets)[..., segments]
+    offsets = offsets[..., segments]
+
+    # Number of misses before each hit
+    misses = positions - (np.arange(positions.shape[-1]) - starts[segments])
+    miss_penalty = misses / (n_genes - genesets.matched_sizes)[segments]
+
+    after_hit = (cumulative - offsets) / total - miss_penalty
+    before_hit = (exclusive - offsets) / total - miss_penalty
+
+    # The running sum ends at zero after the last gene
+    maximum = np.maximum(_segment_reduce(np.maximum, after_hit, starts), 0)
+    minimum = np.minimum(_segment_reduce(np.minimum, before_hit, starts), 0)
+
+    return after_hit, before_hit, maximum, minimum
+
+
+def enrichment_scores(
+    genesets: GenesetHits,
+    ranks: np.ndarray,
+    scores: np.ndarray,
+    weighted_score_type: float = 1,
+) -> np.ndarray:
+    """Compute the enrichment score of every gene set for a block of rankings.
+
+    :param genesets: gene sets
+    :param ranks: (block x genes) position of each gene in each ranking
+    :param scores: (block x genes) ranking metric of each gene in each ranking
+    :param weighted_score_type: exponent of the weights of the hits
+    :return: (block x gene sets) enrichment scores
+    """
+    positions = ranks[:, genesets.indices]
+    weights = _get_weights(scores[:, genesets.indices], weighted_score_type)
+
+    # Sort the hits of each gene set by position
+    order = np.argsort(genesets.segments * ranks.shape[1] + positions, axis=1, kind='stable')
+    positions = np.take_along_axis(positions, order, axis=1)
+    weights = np.take_along_axis(weights, order, axis=1)
+
+    _, _, maximum, minimum = running_sum_extremes(genesets, positions, weights, ranks.shape[1])
+
+    return np.where(np.abs(maximum) > np.abs(minimum), maximum, minimum)
+
+
+def _get_weights(scores: np.ndarray, weighted_score_type: float) -> np.ndarray:
+    """Return the weight of each hit in the running sum."""
+    if weighted_score_type == 0:
+        return np.ones(scores.shape)
+
+    return np.abs(scores) ** weighted_score_type
+
+
+"""Ranking"""
+
+
+def ranking_metric(
+    expression: np.ndarray,
+    positive: np.ndarray,
+    negative: np.ndarray,
+    method: str,
+) -> np.ndarray:
+    """Compute the ranking metric of every gene for a block of sample labellings.
+
+    Identical to the ranking computed by GSEApy for phenotype permutations.
+
+    :param expression: (samples x genes) expression matrix
+    :param positive: (block x samples of the positive class) sample indices of the positive class
+    :param negative: (block x samples of the negative class) sample indices of the negative class
+    :param method: ranking metric
+    :return: (block x genes) ranking metric
+    """
+    positive_values = expression[positive]
+    negative_values = expression[negative]
+
+    positive_mean = positive_values.mean(axis=1)
+    negative_mean = negative_values.mean(axis=1)
+    positive_std = positive_values.std(axis=1, ddof=1)
+    negative_std = negative_values.std(axis=1, ddof=1)
+
+    if method in ['signal_to_noise', 's2n']:
+        return (positive_mean - negative_mean) / (positive_std + negative_std)
+
+    elif method in ['abs_signal_to_noise', 'abs_s2n']:
+        return np.abs((positive_mean - negative_mean) / (positive_std + negative_std))
+
+    elif method == 't_test':
+        denominator = 1.0 / expression.shape[1]
+        return (positive_mean - negative_mean) / np.sqrt(
+            denominator * positive_std ** 2 + denominator * negative_std ** 2
+        )
+
+    elif method == 'ratio_of_classes':
+        return positive_mean / negative_mean
+
+    elif method == 'diff_of_classes':
+        return positive_mean - negative_mean
+
+    elif method == 'log2_ratio_of_classes':
+        return np.log2(positive_mean / negative_mean)
+
+    raise ValueError(f'Unknown ranking method {method}')
+
+
+def rank_genes(metric: np.ndarray, ascending: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """Rank genes by a block of ranking metrics.
+
+    :return: (block x genes) order of the genes in each ranking and position of each gene in each ranking
+    """
+    order = np.argsort(metric, axis=1)
+
+    if not ascending:
+        order = order[:, ::-1]
+
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(metric.shape[1])[np.newaxis, :], axis=1)
+
+    return order, ranks
+
+
+def _prepare_expression(data: pd.DataFrame, class_vector: List) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Pre-process an expression dataFrame as GSEApy does."""
+    df = data.copy()
+
+    # Drop duplicated gene names, only keep the first values
+    df = df[~df.index.duplicated(keep='first')]
+
+    if df.isnull().any().sum() > 0:
+        df = df.dropna(how='all').fillna(0)
+
+    df = df.select_dtypes(include=[np.number])
+
+    classes = np.array(class_vector)
+
+    # Drop genes without any variation within a class
+    constant = np.zeros(len(df.index), dtype=bool)
+    for label in _get_phenotypes(class_vector):
+        constant |= (df.loc[:, classes == label].std(axis=1) == 0).to_numpy()
+
+    return df[~constant] + 0.00001, classes
+
+
+def _get_phenotypes(class_vector: List) -> List:
+    """Return the two phenotypes in order of appearance."""
+    phenotypes = list(dict.fromkeys(class_vector))
+
+    if len(phenotypes) != 2:
+        raise Exception("Input groups have to be 2!")
+
+    return phenotypes
+
+
+def _prepare_ranking(rnk: Union[pd.DataFrame, pd.Series], ascending: bool = False) -> pd.Series:
+    """Pre-process a pre-ranked list of genes as GSEApy does."""
+    if isinstance(rnk, pd.Series):
+        rank_metric = rnk.reset_index()
+    else:
+        rank_metric = rnk.reset_index() if rnk.shape[1] == 1 else rnk.copy()
+
+    rank_metric = rank_metric.sort_values(by=rank_metric.columns[1], ascending=ascending)
+    rank_metric = rank_metric.dropna(how='any')
+    rank_metric = rank_metric.drop_duplicates(subset=rank_metric.columns[0], keep='first')
+
+    return pd.Series(rank_metric.iloc[:, 1].to_numpy(), index=rank_metric.iloc[:, 0].to_numpy())
+
+
+"""Significance"""
+
+
+def gsea_significance(es: np.ndarray, esnull: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the normalized enrichment scores, nominal p-values and FDR q-values as GSEApy does.
+
+    :param es: enrichment score of each gene set
+    :param esnull: (gene sets x permutations) enrichment scores of the permutations, padded with NaN for gene sets
+        with fewer permutations
+    :return: normalized enrichment scores, p-values and FDRs
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Nominal p-values from the part of the null distribution with the same sign as the enrichment score
+        beyond, same_sign = _count_null_beyond(es, esnull)
+        pvals = beyond / same_sign
+
+        # Normalize positive and negative scores by the mean of the positive and negative null scores
+        positive = esnull >= 0
+        negative = esnull < 0
+        positive_mean = np.where(positive, esnull, 0).sum(axis=1) / positive.sum(axis=1)
+        negative_mean = np.where(negative, esnull, 0).sum(axis=1) / negative.sum(axis=1)
+
+        nes = np.where(es >= 0, es / positive_mean, -es / negative_mean)
+        nesnull = np.where(positive, esnull / positive_mean[:, np.newaxis], -esnull / negative_mean[:, np.newaxis])
+
+        fdrs = gsea_fdr(nes, nesnull)
+
+    return nes, pvals, fdrs
+
+
+def _count_null_beyond(es: np.ndarray, esnull: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Count the null scores at least as extreme as the enrichment score and the null scores of the same sign."""
+    is_negative = es[:, np.newaxis] < 0
+
+    beyond = np.where(is_negative, esnull < es[:, np.newaxis], esnull >= es[:, np.newaxis]).sum(axis=1)
+    same_sign = np.where(is_negative, esnull < 0, esnull >= 0).sum(axis=1)
+
+    return beyond, same_sign
+
+
+def gsea_fdr(nes: np.ndarray, nesnull: np.ndarray) -> np.ndarray:
+    """Compute FDR q-values from the null distribution of normalized enrichment scores pooled over all gene sets.
+
+    The null scores of each gene set are weighted by its number of permutations, so that gene sets permuted fewer
+    times in adaptive mode weigh as much in the pooled distribution as the others.
+    """
+    valid = ~np.isnan(nesnull)
+    weights = np.broadcast_to(1 / np.maximum(valid.sum(axis=1), 1)[:, np.newaxis], nesnull.shape)[valid]
+
+    order = np.argsort(nesnull[valid], kind='stable')
+    null_values = nesnull[valid][order]
+    null_weights = np.concatenate([[0], np.cumsum(weights[order])])
+    observed_values = np.sort(nes)
+
+    def _weigh_higher(values, threshold):
+        return null_weights[-1] - null_weights[np.searchsorted(values, threshold, side='left')]
+
+    def _weigh_lower(values, threshold):
+        return null_weights[np.searchsorted(values, threshold, side='right')]
+
+    def _count_higher(values, threshold):
+        return len(values) - np.searchsorted(values, threshold, side='left')
+
+    def _count_lower(values, threshold):
+        return np.searchsorted(values, threshold, side='right')
+
+    all_positive = _weigh_higher(null_values, 0)
+    observed_positive = len(observed_values) - np.searchsorted(observed_values, 0, side='left')
+    all_negative = null_weights[np.searchsorted(null_values, 0, side='left')]
+    observed_negative = np.searchsorted(observed_values, 0, side='left')
+
+    is_positive = nes >= 0
+
+    all_total = np.where(is_positive, all_positive, all_negative)
+    observed_total = np.where(is_positive, observed_positive, observed_negative)
+    all_beyond = np.where(is_positive, _weigh_higher(null_values, nes), _weigh_lower(null_values, nes))
+    observed_beyond = np.where(is_positive, _count_higher(observed_values, nes), _count_lower(observed_values, nes))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fdrs = (all_beyond / all_total) / (observed_beyond / observed_total)
+
+    fdrs = np.where(fdrs < 1, fdrs, 1.0)
+
+    # GSEApy reports a division by zero as 1e9
+    return np.where((all_total == 0) | (observed_total == 0) | (observed_beyond == 0), 1000000000.0, fdrs)
+
+
+"""Results"""
+
+
+def _get_results(
+    genesets: GenesetHits,
+    ranked_genes: np.ndarray,
+    ranked_scores: np.ndarray,
+    es: np.ndarray,
+    esnull: np.ndarray,
+    weighted_score_type: float,
+    adaptive: bool = False,
+    pvals: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """Build the results dataFrame with the columns reported by GSEApy.
+
+    In adaptive mode, the number of permutations of each gene set is reported as well. P-values estimated otherwise,
+    e.g. with the multilevel method, replace the permutation p-values.
+    """
+    nes, permutation_pvals, fdrs = gsea_significance(es, esnull)
+
+    if pvals is None:
+        pvals = permutation_pvals
+
+    # Positions of the hits in the ranked list, which here are the gene indices themselves
+    positions = genesets.indices[np.newaxis, :]
+    weights = _get_weights(ranked_scores[genesets.indices], weighted_score_type)[np.newaxis, :]
+
+    after_hit, before_hit, _, _ = running_sum_extremes(genesets, positions, weights, len(ranked_genes))
+
+    genes = []
+    ledge_genes = []
+
+    for i, (start, end) in enumerate(zip(genesets.indptr[:-1], genesets.indptr[1:])):
+        hits = genesets.indices[start:end]
+        genes.append(';'.join(str(gene).strip() for gene in ranked_genes[hits]))
+
+        # Leading edge: hits up to the maximum of the running sum, or from its minimum
+        if es[i] > 0:
+            leading_edge = hits[:np.argmax(after_hit[0, start:end]) + 1]
+        elif es[i] < 0:
+            leading_edge = hits[np.argmin(before_hit[0, start:end]):]
+        else:
+            leading_edge = hits
+
+        ledge_genes.append(';'.join(str(gene) for gene in ranked_genes[leading_edge]))
+
+    df = pd.DataFrame(
+        {
+            'es': es,
+            'nes': nes,
+            'pval': pvals,
+            'fdr': fdrs,
+            'geneset_size': genesets.geneset_sizes,
+            'matched_size': genesets.matched_sizes,
+            'genes': genes,
+            'ledge_genes': ledge_genes,
+        },
+        index=pd.Index(genesets.terms, name='Term'),
+        columns=RESULTS_COLUMNS,
+    )
+
+    if adaptive:
+        df[PERMUTATIONS_COLUMN] = (~np.isnan(esnull)).sum(axis=1)
+
+    return df.sort_values(by=['fdr', 'pval'])
+
+
+def _get_database_results(
+    databases: List[GenesetHits],
+    ranked_genes: np.ndarray,
+    ranked_scores: np.ndarray,
+    es: np.ndarray,
+    esnull: np.ndarray,
+    weighted_score_type: float,
+    adaptive: bool = False,
+    pvals: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """Build the results of each database from the scores of their concatenated gene sets.
+
+    NES and FDRs are normalized within each database, as if every database had been run on its own.
+    """
+    results = []
+    start = 0
+
+    for database in databases:
+        end = start + len(database)
+        results.append(_get_results(
+            database, ranked_genes, ranked_scores, es[start:end], esnull[start:end], weighted_score_type, adaptive,
+            pvals[start:end] if pvals is not None else None,
+        ))
+        start = end
+
+    return pd.concat(results)
+
+
+def _get_block_size(n_permutations: int, values_per_permutation: int) -> int:
+    """Return the number of permutations to compute together."""
+    return int(max(1, min(n_permutations, MAX_BLOCK_ELEMENTS // max(values_per_permutation, 1))))
+
+
+"""Permutations"""
+
+
+def split_permutations(
+    permutation_num: int,
+    processes: int,
+    seed: Union[None, int, np.random.SeedSequence],
+) -> List[Tuple[int, np.random.SeedSequence]]:
+    """Split permutations into one independent random stream per process.
+
+    The split only depends on the number of permutations, the number of processes and the seed, so results are
+    reproducible for a given seed and number of processes.
+    """
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    streams = root.spawn(max(1, processes))
+    counts = [len(chunk) for chunk in np.array_split(np.arange(permutation_num), len(streams))]
+
+    return [(count, stream) for count, stream in zip(counts, streams) if count]
+
+
+def _phenotype_null(
+    expression: np.ndarray,
+    genesets: GenesetHits,
+    positive: np.ndarray,
+    negative: np.ndarray,
+    method: str,
+    weighted_score_type: float,
+    ascending: bool,
+    permutation_num: int,
+    stream: np.random.SeedSequence,
+) -> np.ndarray:
+    """Compute (permutations x gene sets) enrichment scores after shuffling the class labels of the samples.
+
+    Gene sets are given as indices into the expression matrix.
+    """
+    rng = np.random.default_rng(stream)
+    n_samples, n_genes = expression.shape
+
+    block_size = _get_block_size(permutation_num, max(n_samples * n_genes, len(genesets.indices)))
+
+    esnull = []
+    done = 0
+
+    while done < permutation_num:
+        size = min(block_size, permutation_num - done)
+
+        labels = np.argsort(rng.random((size, n_samples)), axis=1)
+
+        metric = ranking_metric(expression, labels[:, positive], labels[:, negative], method)
+        _, ranks = rank_genes(metric, ascending)
+
+        esnull.append(enrichment_scores(genesets, ranks, metric, weighted_score_type))
+        done += size
+
+    return np.vstack(esnull)
+
+
+def _sample_positions(rng: np.random.Generator, n_genes: int, n_sets: int, size: int) -> np.ndarray:
+    """Draw the (gene sets x size) positions in the ranked list of random gene sets of the same size.
+
+    Each gene set is a uniform random subset of positions. Small gene sets are drawn with replacement and their
+    repeated positions drawn again, so that drawing them does not take a random relabelling of the whole ranked list.
+    """
+    if 2 * size > n_genes:
+        return np.argsort(rng.random((n_sets, n_genes)), axis=1)[:, :size]
+
+    positions = rng.integers(n_genes, size=(n_sets, size))
+
+    while True:
+        positions.sort(axis=1)
+
+        repeated = np.zeros(positions.shape, dtype=bool)
+        repeated[:, 1:] = positions[:, 1:] == positions[:, :-1]
+
+        if not repeated.any():
+            return positions
+
+        positions[repeated] = rng.integers(n_genes, size=repeated.sum())
+
+
+def _gene_set_null(
+    ranked_scores: np.ndarray,
+    size: int,
+    weighted_score_type: float,
+    permutation_num: int,
+    stream: np.random.SeedSequence,
+) -> np.ndarray:
+    """Compute the (permutations x 1) enrichment scores of random gene sets of the given size.
+
+    The hits of the gene set become a random subset of positions with the weights of those positions.
+    """
+    rng = np.random.default_rng(stream)
+
+    block_size = _get_block_size(permutation_num, size)
+
+    esnull = []
+    done = 0
+
+    while done < permutation_num:
+        block = min(block_size, permutation_num - done)
+
+        positions = _sample_positions(rng, len(ranked_scores), block, size)
+
+        esnull.append(_random_set_scores(positions, ranked_scores, weighted_score_type))
+        done += block
+
+    return np.concatenate(esnull)[:, np.newaxis]
+
+
+#: Data of the job shared by all the calls of a process of a permutation pool
+_shared_data = None
+
+
+def _load_shared_data(data: np.ndarray) -> None:
+    global _shared_data
+    _shared_data = data
+
+
+def _call_shared(arguments: Tuple) -> np.ndarray:
+    function, args = arguments
+    return function(_shared_data, *args)
+
+
+class PermutationPool:
+    """Processes computing the permutations of a job, which all hold its expression matrix or ranked list.
+
+    The data is loaded once in each process when the pool starts, so the rounds of permutations only send the gene sets
+    and random streams of their chunks. Without more than one process, the chunks are computed in the calling process.
+    """
+
+    def __init__(self, data: np.ndarray, processes: int = 1):
+        """Initialize the pool.
+
+        :param data: expression matrix or ranked scores passed as first argument to the functions of the chunks
+        :param processes: number of processes
+        """
+        self.data = data
+        self.processes = max(1, processes)
+        self._pool = None
+
+    def __enter__(self) -> 'PermutationPool':
+        if self.processes > 1:
+            # Celery worker processes are daemonic and can only start children with billiard
+            self._pool = Pool(self.processes, initializer=_load_shared_data, initargs=(self.data,))
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def map(self, chunks: List[Tuple[Callable, Tuple]]) -> List[np.ndarray]:
+        """Call each function with the data of the pool followed by its arguments."""
+        if self._pool is None or len(chunks) == 1:
+            return [function(self.data, *args) for function, args in chunks]
+
+        return self._pool.map(_call_shared, chunks)
+
+
+def run_permutations(
+    function: Callable,
+    args: Tuple,
+    n_genesets: int,
+    permutation_num: int,
+    pool: PermutationPool,
+    seed: Union[None, int, np.random.SeedSequence] = None,
+) -> np.ndarray:
+    """Compute the (gene sets x permutations) null enrichment scores, splitting the permutations across processes."""
+    chunks = [
+        (function, (*args, count, stream))
+        for count, stream in split_permutations(permutation_num, pool.processes, seed)
+    ]
+
+    if not chunks:
+        return np.empty((n_genesets, 0))
+
+    return np.vstack(pool.map(chunks)).T
+
+
+class SizeNullCache:
+    """Null enrichment scores of random gene sets of each size for one ranked list of genes.
+
+    With gene set permutations, the null distribution of a gene set only depends on its size for a given ranked list and
+    weight. The cache is built from the ranking of a job, so it cannot serve the scores of another ranking.
+    """
+
+    def __init__(
+        self,
+        pool: PermutationPool,
+        weighted_score_type: float,
+        seed: Optional[int] = None,
+    ):
+        """Initialize an empty cache.
+
+        :param pool: pool holding the ranking metric of the ranked list
+        :param weighted_score_type: exponent of the weights of the hits
+        :param seed: random seed
+        """
+        self._pool = pool
+        self._weighted_score_type = weighted_score_type
+        self._root = np.random.SeedSequence(seed)
+        # Index of the first permutation held for each size, which is not 0 when a job resumed from a checkpoint
+        self._starts = {}
+        self._nulls = {}
+
+    def get(self, sizes: np.ndarray, start: int, stop: int) -> np.ndarray:
+        """Return the (sizes x permutations) null enrichment scores of the permutations from start to stop.
+
+        The missing permutations of each size are computed, so the ranges of successive calls must not go backwards.
+        """
+        missing = {}
+
+        for size in np.unique(sizes).tolist():
+            if size not in self._nulls:
+                self._starts[size] = start
+                self._nulls[size] = np.empty(0)
+
+            done = self._starts[size] + self._nulls[size].shape[0]
+
+            if done < stop:
+                missing.setdefault(done, []).append(size)
+
+        for done, group in missing.items():
+            self._extend(group, done, stop)
+
+        if not len(sizes):
+            return np.empty((0, stop - start))
+
+        return np.vstack([
+            self._nulls[size][start - self._starts[size]:stop - self._starts[size]]
+            for size in sizes.tolist()
+        ])
+
+    def _extend(self, sizes: List[int], done: int, permutation_num: int) -> None:
+        """Compute the permutations of the given sizes from done up to permutation_num."""
+        logger.info(f'Computing {permutation_num - done} permutations of {len(sizes)} gene set sizes')
+
+        # Each size draws its random gene sets from its own stream, so the nulls of different sizes are independent
+        chunks, owners = [], []
+
+        for size in sizes:
+            stream = _get_round_stream(self._root, done, size)
+
+            for count, chunk_stream in split_permutations(permutation_num - done, self._pool.processes, stream):
+                chunks.append((_gene_set_null, (size, self._weighted_score_type, count, chunk_stream)))
+                owners.append(size)
+
+        blocks = self._pool.map(chunks)
+
+        for size in sizes:
+            scores = [block[:, 0] for owner, block in zip(owners, blocks) if owner == size]
+            self._nulls[size] = np.concatenate([self._nulls[size], *scores])
+
+
+def _get_round_stream(
+    root: np.random.SeedSequence,
+    start: int,
+    size: Optional[int] = None,
+) -> np.random.SeedSequence:
+    """Return the random stream of the permutations starting at the given index, or of those of a gene set size.
+
+    Keying the stream on the index rather than on the number of streams spawned so far keeps the streams of a resumed
+    job distinct from those of the permutations it already did.
+    """
+    if size is None:
+        return np.random.SeedSequence(root.entropy, spawn_key=(start,))
+
+    return np.random.SeedSequence(root.entropy, spawn_key=(start, size))
+
+
+def permutation_rounds(
+    function: Callable,
+    get_args: Callable[[np.ndarray], Tuple],
+    pool: PermutationPool,
+    seed: Optional[int] = None,
+) -> Callable[[np.ndarray, int, int], np.ndarray]:
+    """Return a function computing the null enrichment scores of some gene sets for a range of permutations.
+
+    :param function: function computing the null enrichment scores of a block of permutations
+    :param get_args: returns the arguments of the function after the data of the pool for the gene sets at the given
+        positions
+    :param pool: pool the permutations are split across
+    :param seed: random seed
+    """
+    root = np.random.SeedSequence(seed)
+
+    def compute_null(active: np.ndarray, start: int, stop: int) -> np.ndarray:
+        return run_permutations(
+            function, get_args(active), len(active), stop - start, pool, _get_round_stream(root, start),
+        )
+
+    return compute_null
+
+
+def run_permutation_rounds(
+    compute_null: Callable[[np.ndarray, int, int], np.ndarray],
+    es: np.ndarray,
+    permutation_num: int,
+    significance_threshold: Optional[float] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> np.ndarray:
+    """Compute the null enrichment scores in rounds of permutations.
+
+    In adaptive mode, i.e. with a significance threshold, only gene sets whose p-value is still undecided with respect
+    to the nominal cutoffs derived from the FDR threshold are permuted in the next round. With a checkpoint, the rounds
+    already saved are skipped and each new round is saved on its own, so that the scores of the earlier rounds are not
+    written again.
+
+    :param compute_null: computes the (gene sets x permutations) null enrichment scores of the gene sets at the given
+        positions for a range of permutations
+    :param es: enrichment score of each gene set
+    :param permutation_num: number of permutations, or maximum number of permutations of a gene set in adaptive mode
+    :param significance_threshold: FDR threshold of the job, from which the nominal p-value cutoffs the confidence
+        intervals are compared to are derived in adaptive mode
+    :param progress: called with the number of permutations done and permutation_num after each round
+    :param checkpoint: checkpoint the null enrichment scores are resumed from and saved to
+    :return: (gene sets x permutations) null enrichment scores, padded with NaN after a gene set stopped
+    """
+    esnull = np.full((len(es), permutation_num), np.nan)
+    active = np.arange(len(es))
+    done = 0
+
+    if significance_threshold is not None:
+        lower_cutoff, upper_cutoff = get_nominal_cutoffs(significance_threshold, len(es))
+
+    for name in checkpoint.list_names(PERMUTATIONS_CHECKPOINT) if checkpoint else []:
+        saved = checkpoint.load(name)
+
+        # Rounds are only resumed in order and for the same gene sets and number of permutations
+        if saved is None or saved['shape'] != esnull.shape or saved['start'] != done:
+            break
+
+        esnull[saved['rows'], done:saved['stop']] = saved['esnull']
+        active, done = saved['active'], saved['stop']
+
+    if done:
+        logger.info(f'Resuming after {done} permutations')
+
+    while done < permutation_num and len(active):
+        size = min(ROUND_SIZE, permutation_num - done)
+        rows = active
+
+        block = compute_null(rows, done, done + size)
+        esnull[rows, done:done + size] = block
+
+        if significance_threshold is not None:
+            decided = is_decided(es[active], esnull[active, :done + size], lower_cutoff, upper_cutoff)
+            active = active[~decided]
+
+            logger.info(f'{len(active)} gene sets are still permuted after {done + size} permutations')
+
+        if checkpoint is not None:
+            checkpoint.save(get_round_checkpoint_name(done), {
+                'shape': esnull.shape,
+                'start': done,
+                'stop': done + size,
+                'rows': rows,
+                'esnull': block,
+                'active': active,
+            })
+
+        done += size
+
+        if progress is not None:
+            progress(done, permutation_num)
+
+    return esnull
+
+
+def get_nominal_cutoffs(fdr_threshold: float, num_genesets: int) -> Tuple[float, float]:
+    """Return the nominal p-value cutoffs below and above which a gene set is decided, for an FDR threshold.
+
+    A gene set whose nominal p-value is above the FDR threshold is not expected to pass it, while one whose p-value is
+    below the Bonferroni cutoff passes it whatever the p-values of the other gene sets.
+    """
+    return fdr_threshold / max(num_genesets, 1), fdr_threshold
+
+
+def is_decided(es: np.ndarray, esnull: np.ndarray, lower_cutoff: float, upper_cutoff: float) -> np.ndarray:
+    """Check which p-values have a Clopper-Pearson confidence interval entirely below or above the nominal cutoffs.
+
+    The significance threshold of a job is an FDR threshold, not a nominal p-value cutoff, so the cutoffs are derived
+    from it conservatively by get_nominal_cutoffs. Gene sets whose p-value may lie between them are still permuted.
+    """
+    beyond, same_sign = _count_null_beyond(es, esnull)
+
+    alpha = 1 - ADAPTIVE_CONFIDENCE
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = np.where(beyond > 0, stats.beta.ppf(alpha / 2, beyond, same_sign - beyond + 1), 0.0)
+        upper = np.where(beyond < same_sign, stats.beta.ppf(1 - alpha / 2, beyond + 1, same_sign - beyond), 1.0)
+
+    return (upper < lower_cutoff) | (lower > upper_cutoff)
+
+
+"""Multilevel p-values"""
+
+
+def _random_set_scores(positions: np.ndarray, ranked_scores: np.ndarray, weighted_score_type: float) -> np.ndarray:
+    """Compute the enrichment score of random gene sets given as (gene sets x size) positions in the ranked list."""
+    n_sets, size = positions.shape
+
+    # Unnamed gene sets
+    genesets = GenesetHits(
+        terms=[''] * n_sets,
+        geneset_sizes=np.full(n_sets, size, dtype=np.int64),
+        indptr=np.arange(0, n_sets * size + 1, size, dtype=np.int64),
+        indices=positions.ravel(),
+    )
+
+    return _observed_enrichment_scores(genesets, ranked_scores, weighted_score_type)
+
+
+def _perturb_sets(
+    positions: np.ndarray,
+    statistics: np.ndarray,
+    threshold: float,
+    ranked_scores: np.ndarray,
+    sign: int,
+    weighted_score_type: float,
+    rng: np.random.Generator,
+) -> None:
+    """Swap genes of random gene sets in place, only accepting swaps that keep their statistic above the threshold."""
+    n_sets, size = positions.shape
+    rows = np.arange(n_sets)
+
+    for _ in range(max(10, int(size * MULTILEVEL_PERTURBATION))):
+        proposal = positions.copy()
+        genes = rng.integers(len(ranked_scores), size=n_sets)
+        proposal[rows, rng.integers(size, size=n_sets)] = genes
+
+        proposal_statistics = sign * _random_set_scores(proposal, ranked_scores, weighted_score_type)
+
+        # Genes already in the gene set cannot be swapped in
+        accept = ~(positions == genes[:, np.newaxis]).any(axis=1) & (proposal_statistics > threshold)
+
+        positions[accept] = proposal[accept]
+        statistics[accept] = proposal_statistics[accept]
+
+
+def multilevel_tail_probabilities(
+    ranked_scores: np.ndarray,
+    size: int,
+    sign: int,
+    targets: np.ndarray,
+    weighted_score_type: float,
+    stream: np.random.SeedSequence,
+) -> np.ndarray:
+    """Estimate the probability that a random gene set of a given size reaches each target enrichment score.
+
+    :param ranked_scores: ranking metric of the ranked list
+    :param size: number of genes of the random gene sets
+    :param sign: 1 for positive targets, -1 for negative targets
+    :param targets: enrichment scores multiplied by sign
+    :param weighted_score_type: exponent of the weights of the hits
+    :param stream: random stream
+    :return: estimated probability of a signed enrichment score at least as high as each target
+    """
+    rng = np.random.default_rng(stream)
+    n_genes = len(ranked_scores)
+
+    positions = np.argsort(rng.random((MULTILEVEL_SAMPLE_SIZE, n_genes)), axis=1)[:, :size]
+    statistics = sign * _random_set_scores(positions, ranked_scores, weighted_score_type)
+
+    probabilities = np.zeros(len(targets))
+    remaining = np.ones(len(targets), dtype=bool)
+    log_level = 0.0
+
+    for _ in range(MULTILEVEL_MAX_LEVELS):
+        threshold = np.median(statistics)
+        above = statistics > threshold
+
+        # Targets reached by the current level, or the last level if the chain cannot go any higher
+        resolved = remaining & ((targets <= threshold) | ~above.any())
+        probabilities[resolved] = np.exp(log_level) * (statistics[:, np.newaxis] >= targets[resolved]).mean(axis=0)
+        remaining &= ~resolved
+
+        if not remaining.any():
+            break
+
+        # Condition the sample on the statistic being above the median
+        log_level += np.log(above.mean())
+
+        below = np.flatnonzero(~above)
+        copies = rng.choice(np.flatnonzero(above), size=len(below))
+        positions[below] = positions[copies]
+        statistics[below] = statistics[copies]
+
+        _perturb_sets(positions, statistics, threshold, ranked_scores, sign, weighted_score_type, rng)
+
+    # Targets beyond the last level
+    probabilities[remaining] = np.exp(log_level) * (statistics[:, np.newaxis] >= targets[remaining]).mean(axis=0)
+
+    return probabilities
+
+
+def multilevel_p_values(
+    genesets: GenesetHits,
+    es: np.ndarray,
+    esnull: np.ndarray,
+    weighted_score_type: float,
+    pool: PermutationPool,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """Refine the p-values that the permutations cannot resolve with multilevel estimates.
+
+    As the permutation p-values, the p-values are conditioned on the sign of the enrichment score, using the fraction
+    of permutations of each gene set with the same sign.
+
+    :param pool: pool holding the ranking metric of the ranked list, the chains are split across
+    :return: p-value of each gene set
+    """
+    beyond, same_sign = _count_null_beyond(es, esnull)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pvals = beyond / same_sign
+        same_sign_fraction = same_sign / (~np.isnan(esnull)).sum(axis=1)
+
+    refine = (beyond < MULTILEVEL_MIN_BEYOND) & (same_sign > 0)
+    signs = np.where(es < 0, -1, 1)
+
+    # One chain for each size and sign, shared by all gene sets of that size and sign
+    groups = sorted({
+        (int(size), int(sign))
+        for size, sign in zip(genesets.matched_sizes[refine], signs[refine])
+    })
+    members = [
+        np.flatnonzero(refine & (genesets.matched_sizes == size) & (signs == sign))
+        for size, sign in groups
+    ]
+
+    # Streams independent of those of the permutations run with the same seed
+    streams = np.random.SeedSequence(None if seed is None else (seed, 1)).spawn(len(groups))
+    chunks = [
+        (multilevel_tail_probabilities, (size, sign, sign * es[indices], weighted_score_type, stream))
+        for (size, sign), indices, stream in zip(groups, members, streams)
+    ]
+
+    logger.info(f'Estimating multilevel p-values of {refine.sum()} gene sets with {len(chunks)} chains')
+
+    probabilities = pool.map(chunks)
+
+    for indices, tail in zip(members, probabilities):
+        pvals[indices] = np.minimum(tail / same_sign_fraction[indices], 1.0)
+
+    return pvals
+
+
+"""GSEA"""
+
+
+def gsea(
+    data: pd.DataFrame,
+    gmt: Union[str, List[str]],
+    class_vector: List,
+    min_size: int,
+    max_size: int,
+    permutation_type: str,
+    permutation_num: int,
+    method: str,
+    weighted_score_type: float = 1,
+    ascending: bool = False,
+    seed: Optional[int] = None,
+    processes: int = 1,
+    significance_threshold: Optional[float] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> pd.DataFrame:
+    """Run GSEA on an expression dataFrame indexed by gene symbol.
+
+    Unlike GSEApy 0.10, which draws a fixed number of phenotype permutations per block of gene sets, exactly
+    permutation_num permutations are run and shared by all gene sets.
+
+    :param data: expression dataFrame with genes as rows and samples as columns
+    :param gmt: path to the GMT file, or paths to the GMT files of several databases sharing the same permutations
+    :param class_vector: class label of each sample
+    :param min_size: minimum number of genes of a gene set in the dataset
+    :param max_size: maximum number of genes of a gene set in the dataset
+    :param permutation_type: 'phenotype' or 'gene_set'
+    :param permutation_num: number of permutations, or maximum number of permutations in adaptive mode
+    :param method: ranking metric
+    :param weighted_score_type: exponent of the weights of the hits
+    :param ascending: sort the ranking in ascending order
+    :param seed: random seed
+    :param processes: number of processes to split the permutations across
+    :param significance_threshold: FDR threshold. If given, run in adaptive mode and stop permuting gene sets whose
+        p-value is clearly above or below the nominal cutoffs derived from it
+    :param progress: called with the number of permutations done and permutation_num after each round of permutations
+    :param checkpoint: checkpoint the permutations are resumed from and saved to after each round
+    :return: results dataFrame with the columns reported by GSEApy
+    """
+    if method not in RANKING_METHODS:
+        raise ValueError(f'Unknown ranking method {method}')
+
+    positive_class, negative_class = _get_phenotypes(class_vector)
+    df, classes = _prepare_expression(data, class_vector)
+
+    expression = df.to_numpy(dtype=np.float64).T
+    positive = np.flatnonzero(classes == positive_class)
+    negative = np.flatnonzero(classes == negative_class)
+
+    # Observed ranking
+    metric = ranking_metric(expression, positive[np.newaxis, :], negative[np.newaxis, :], method)
+    order, _ = rank_genes(metric, ascending)
+
+    ranked_genes = df.index.to_numpy()[order[0]]
+    ranked_scores = metric[0, order[0]]
+
+    databases = _load_databases(gmt, ranked_genes, min_size, max_size)
+
+    if permutation_type == 'gene_set':
+        return _gene_set_permutation_gsea(
+            databases, ranked_genes, ranked_scores, permutation_num, weighted_score_type, seed, processes,
+            significance_threshold, progress=progress, checkpoint=checkpoint,
+        )
+
+    genesets = concatenate_geneset_hits(databases)
+
+    # Gene sets as indices into the expression matrix
+    expression_genesets = GenesetHits(
+        terms=genesets.terms,
+        geneset_sizes=genesets.geneset_sizes,
+        indptr=genesets.indptr,
+        indices=order[0][genesets.indices],
+    )
+
+    es = _observed_enrichment_scores(genesets, ranked_scores, weighted_score_type)
+
+    with PermutationPool(expression, processes) as pool:
+        compute_null = permutation_rounds(
+            _phenotype_null,
+            lambda active: (
+                expression_genesets.subset(active), positive, negative, method, weighted_score_type, ascending,
+            ),
+            pool,
+            seed,
+        )
+
+        esnull = run_permutation_rounds(
+            compute_null, es, permutation_num, significance_threshold, progress, checkpoint,
+        )
+
+    return _get_database_results(
+        databases, ranked_genes, ranked_scores, es, esnull, weighted_score_type, significance_threshold is not None,
+    )
+
+
+def prerank(
+    rnk: Union[pd.DataFrame, pd.Series],
+    gmt: Union[str, List[str]],
+    min_size: int,
+    max_size: int,
+    permutation_num: int,
+    weighted_score_type: float = 1,
+    ascending: bool = False,
+    seed: Optional[int] = None,
+    processes: int = 1,
+    significance_threshold: Optional[float] = None,
+    multilevel: bool = False,
+    progress: Optional[Callable[[int, int], None]] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> pd.DataFrame:
+    """Run GSEA on a pre-ranked list of genes.
+
+    :param rnk: dataFrame with gene symbols and ranking values, or a series of ranking values indexed by gene symbol
+    :param gmt: path to the GMT file, or paths to the GMT files of several databases sharing the same permutations
+    :param min_size: minimum number of genes of a gene set in the ranked list
+    :param max_size: maximum number of genes of a gene set in the ranked list
+    :param permutation_num: number of permutations, or maximum number of permutations in adaptive mode
+    :param weighted_score_type: exponent of the weights of the hits
+    :param ascending: sort the ranking in ascending order
+    :param seed: random seed
+    :param processes: number of processes to split the permutations across
+    :param significance_threshold: FDR threshold. If given, run in adaptive mode and stop permuting gene sets whose
+        p-value is clearly above or below the nominal cutoffs derived from it
+    :param multilevel: estimate the p-values the permutations cannot resolve with the multilevel method
+    :param progress: called with the number of permutations done and permutation_num after each round of permutations
+    :param checkpoint: checkpoint the permutations are resumed from and saved to after each round
+    :return: results dataFrame with the columns reported by GSEApy
+    """
+    ranking = _prepare_ranking(rnk, ascending)
+
+    ranked_genes = ranking.index.to_numpy()
+    ranked_scores = ranking.to_numpy(dtype=np.float64)
+
+    databases = _load_databases(gmt, ranked_genes, min_size, max_size)
+
+    return _gene_set_permutation_gsea(
+        databases, ranked_genes, ranked_scores, permutation_num, weighted_score_type, seed, processes,
+        significance_threshold, multilevel, progress, checkpoint,
+    )
+
+
+def _observed_enrichment_scores(
+    genesets: GenesetHits,
+    ranked_scores: np.ndarray,
+    weighted_score_type: float,
+) -> np.ndarray:
+    """Compute the enrichment score of every gene set in the observed ranking."""
+    return enrichment_scores(
+        genesets,
+        np.arange(len(ranked_scores))[np.newaxis, :],
+        ranked_scores[np.newaxis, :],
+        weighted_score_type,
+    )[0]
+
+
+def _gene_set_permutation_gsea(
+    databases: List[GenesetHits],
+    ranked_genes: np.ndarray,
+    ranked_scores: np.ndarray,
+    permutation_num: int,
+    weighted_score_type: float,
+    seed: Optional[int],
+    processes: int,
+    significance_threshold: Optional[float],
+    multilevel: bool = False,
+    progress: Optional[Callable[[int, int], None]] = None,
+    checkpoint: Optional[Checkpoint] = None,
+) -> pd.DataFrame:
+    """Run GSEA with gene set permutations on a ranked list of genes.
+
+    The null distribution of each matched gene set size is computed once and shared by all gene sets of that size.
+    """
+    genesets = concatenate_geneset_hits(databases)
+
+    es = _observed_enrichment_scores(genesets, ranked_scores, weighted_score_type)
+
+    pvals = None
+
+    with PermutationPool(ranked_scores, processes) as pool:
+        nulls = SizeNullCache(pool, weighted_score_type, seed)
+
+        esnull = run_permutation_rounds(
+            lambda active, start, stop: nulls.get(genesets.matched_sizes[active], start, stop),
+            es,
+            permutation_num,
+            significance_threshold,
+            progress,
+            checkpoint,
+        )
+
+        if multilevel:
+            pvals = multilevel_p_values(genesets, es, esnull, weighted_score_type, pool, seed)
+
+    return _get_database_results(
+        databases, ranked_genes, ranked_scores, es, esnull, weighted_score_type, significance_threshold is not None,
+        pvals,
+    )
@@ -5,13 +5,15 @@ import json
 import logging
 from collections import defaultdict
 from itertools import combinations
-from typing import List, Dict, Union
+from typing import List, Dict, Optional, Union
 
 import pandas as pd
 from django.core.exceptions import ObjectDoesNotExist
 
 from viewer.models import EnrichmentResult, Pathway
+from viewer.src.checkpoint import get_checkpoint
 from viewer.src.constants import *
+from viewer.src.geneset_pack import load_pack
 from viewer.src.results_utils import (
     clean_none_values,
     check_consensus,
@@ -20,10 +22,16 @@ from viewer.src.results_utils import (
     get_dc_info_gsea,
     get_consensus_gsea, get_dc_info_ora, get_database_by_pathway_id,
 )
-from viewer.src.utils import get_database_by_id, spliterate
+from viewer.src.utils import get_database_by_id
 
 logger = logging.getLogger(__name__)
 
+#: Columns of the ORA, GSEA and uploaded results read by the circles visualization
+CIRCLES_COLUMNS = ['pathway_id', 'p_value', 'q_value', 'nes', 'fdr', 'geneset_size']
+
+#: Columns of the DESeq2 and uploaded fold changes read by the zoom-in and export views
+FOLD_CHANGE_COLUMNS = [GENE_SYMBOL, 'log2fc', 'log2FoldChange', 'q_value', 'padj']
+
 
 def create_summary_table(current_user):
     """Generate experiment summary table for user with link to results for a given experiment."""
@@ -97,6 +105,8 @@ def create_summary_table(current_user):
             clean_none_values(obj.permutation_number),
             clean_none_values(obj.significance_threshold_fc),
             obj.fold_changes_filename,
+            obj.result_id,  # Used to poll the progress of running experiments, not displayed
+            obj.result_status == 0 and get_checkpoint(obj.result_id).exists(),  # Failed experiments that can be resumed
         ]
         table_body.append(row)
         objs.append(obj)
@@ -146,7 +156,13 @@ def get_ranking_table(results_df: pd.DataFrame):
 
             databases = sorted(list(df.Database.unique()))
 
-            df = df[['Identifier', 'Pathway', 'Database', 'nes', 'es', 'pval', 'fdr', 'geneset_size', 'matched_size']]
+            columns = ['Identifier', 'Pathway', 'Database', 'nes', 'es', 'pval', 'fdr', 'geneset_size', 'matched_size']
+
+            # Number of permutations of each gene set if GSEA was run with adaptive permutations
+            if PERMUTATIONS_COLUMN in df.columns:
+                columns.append(PERMUTATIONS_COLUMN)
+
+            df = df[columns]
             df.rename(columns={
                 'pval': 'p-value',
                 'fdr': 'q-value',
@@ -154,6 +170,7 @@ def get_ranking_table(results_df: pd.DataFrame):
                 'es': 'ES',
                 'geneset_size': 'Gene Set Size',
                 'matched_size': 'Mapped Genes',
+                PERMUTATIONS_COLUMN: 'Permutations',
             }, inplace=True)
 
             df['p-value'] = df['p-value'].map(round_float)
@@ -221,18 +238,14 @@ def get_genesets(databases: List, size=None):
     for database in databases:
         path = os.path.join(GMT_FILES_DIR, f"{database}.gmt")
 
-        with open(path) as file:
-            # Get dictionary with pathway and corresponding gene set
-            genesets_dict = {
-                name: genes
-                for name, _, *genes in spliterate(file)
-            }
+        pack = load_pack(path)
 
+        # Read gene set sizes from the precomputed size array of the pack
         if size is True:
-            geneset_list.append({k: len(v) for k, v in genesets_dict.items()})
+            geneset_list.append(dict(zip(pack.pathways.tolist(), pack.sizes.tolist())))
 
         else:
-            geneset_list.append({k: v for k, v in genesets_dict.items()})
+            geneset_list.append(pack.to_dict())
 
     geneset_dict = {
         pathway_id: geneset_size
@@ -740,8 +753,17 @@ def generate_consensus_table_ora(results_df: pd.DataFrame, significance_value):
     )
 
 
-def query_results_model(result_id, current_user):
-    """Query results model."""
+def query_results_model(
+    result_id,
+    current_user,
+    columns: Optional[List[str]] = None,
+    fold_change_columns: Optional[List[str]] = None,
+):
+    """Query results model.
+
+    :param columns: columns of the results to read, all of them by default
+    :param fold_change_columns: columns of the fold changes to read. The fold changes are only read if they are given.
+    """
     try:
         result_object = EnrichmentResult.objects.get(result_id=result_id, user=current_user)
     except ObjectDoesNotExist:
@@ -751,12 +773,14 @@ def query_results_model(result_id, current_user):
         return f'It appears {result_object} are empty. Please ensure the correct files were submitted.'
 
     # Get results data
-    df = result_object.get_df()
+    df = result_object.get_df(columns)
     databases = result_object.get_databases()
     significance_value = result_object.significance_threshold
     enrichment_method = result_object.enrichment_method
     data_filename = result_object.data_filename
-    symbol_to_fold_change = result_object.fold_change_results
+    symbol_to_fold_change = (
+        result_object.get_fold_change_df(fold_change_columns) if fold_change_columns is not None else None
+    )
     fc_filename = result_object.fold_changes_filename
 
     return df, databases, significance_value, enrichment_method, data_filename, symbol_to_fold_change, fc_filename
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""Measure where the time and memory of jobs go.
+
+Each stage of a job, and each database of the engines running the databases separately, is saved as a JobMetrics row
+with its wall time, CPU time and peak resident memory. The rows are saved as soon as a stage ends, so jobs that fail or
+hit the time limit keep the metrics of the stages they went through.
+
+The peak resident memory is the one of the task process. On Linux it is reset at the start of each stage, elsewhere it
+is the peak since the worker process started. The CPU time includes the child processes that ended during the stage,
+such as the GSEA process pools, but not the long-lived DESeq2 pool processes.
+"""
+
+import logging
+import resource
+import time
+from typing import List, Optional, Union
+
+from django.utils import timezone
+
+from viewer.models import EnrichmentResult, JobMetrics
+
+logger = logging.getLogger(__name__)
+
+#: Writing 5 to this file resets the peak resident memory of the process on Linux
+CLEAR_REFS_PATH = '/proc/self/clear_refs'
+
+#: Status of the process, with its peak resident memory on Linux
+STATUS_PATH = '/proc/self/status'
+
+
+def get_cpu_time() -> float:
+    """Return the CPU seconds used by the process and by its child processes that have ended."""
+    cpu_time = 0.0
+
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        cpu_time += usage.ru_utime + usage.ru_stime
+
+    return cpu_time
+
+
+def reset_peak_rss() -> None:
+    """Reset the peak resident memory of the process, if the kernel allows it."""
+    try:
+        with open(CLEAR_REFS_PATH, 'w') as file:
+            file.write('5')
+
+    except OSError:
+        pass
+
+
+def get_peak_rss() -> int:
+    """Return the peak resident memory of the process in bytes."""
+    try:
+        with open(STATUS_PATH) as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+
+    except OSError:
+        pass
+
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageMetrics:
+    """Measure the stages of a task and save them as JobMetrics rows of its jobs.
+
+    The jobs run by a single batch task share its metrics.
+    """
+
+    def __init__(self, job_ids: Union[str, List[str]]):
+        """Initialize the metrics of one job or of the jobs run by a single batch task."""
+        self.job_ids = list(job_ids) if isinstance(job_ids, list) else [job_ids]
+        self.stage = None
+        self.database = None
+        self._started = None
+        self._wall_time = 0.0
+        self._cpu_time = 0.0
+
+    def start(self, stage: str, database: Optional[str] = None) -> None:
+        """Save the metrics of the current stage and start measuring a new one."""
+        self.stop()
+
+        self.stage = stage
+        self.database = database
+
+        reset_peak_rss()
+
+        self._started = timezone.now()
+        self._wall_time = time.monotonic()
+        self._cpu_time = get_cpu_time()
+
+    def stop(self) -> None:
+        """Save the metrics of the current stage, if any."""
+        if self.stage is None:
+            return
+
+        wall_time = time.monotonic() - self._wall_time
+        cpu_time = get_cpu_time() - self._cpu_time
+        peak_rss = get_peak_rss()
+
+        name = f'{self.stage} [{self.database}]' if self.database else self.stage
+
+        logger.info(f'{name}: {wall_time:.1f}s wall, {cpu_time:.1f}s CPU, {peak_rss / 1024 ** 2:.0f} MB peak RSS')
+
+        # Jobs deleted while running keep no metrics
+        job_ids = EnrichmentResult.objects.filter(result_id__in=self.job_ids).values_list('result_id', flat=True)
+
+        JobMetrics.objects.bulk_create([
+            JobMetrics(
+                job_id=job_id,
+                stage=self.stage,
+                database=self.database,
+                started=self._started,
+                wall_time=wall_time,
+                cpu_time=cpu_time,
+                peak_rss=peak_rss,
+            )
+            for job_id in job_ids
+        ])
+
+        self.stage = None
+        self.database = None
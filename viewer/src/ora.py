@@ -3,34 +3,194 @@
 """This module contains the functions to run Over Representation Analysis (ORA)."""
 
 import logging
-from typing import Mapping, Set, List
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple, Union
 
 import numpy as np
 import pandas as pd
-from scipy.stats import fisher_exact
+from scipy import sparse
+from scipy.stats import fisher_exact, hypergeom
 from statsmodels.stats.multitest import multipletests
 
 from viewer.src.constants import GENE_UNIVERSE
-from viewer.src.utils import spliterate
+from viewer.src.geneset_pack import GenesetPack, load_pack
 
 logger = logging.getLogger(__name__)
 
 
-def run_ora(gmt_path: str, set_gene_symbols: Set[str], min_size: int, max_size: int):
-    """Run hyper-geometric test."""
-    # Note that by default, parser filters out gene sets smaller than 3 and larger than 5000
-    gene_sets = gmt_parser(gmt_path, min_size=min_size, max_size=max_size)
+def run_ora(
+    gmt_path: str,
+    set_gene_symbols: Set[str],
+    min_size: int,
+    max_size: int,
+    background: Optional[Iterable[str]] = None,
+):
+    """Run hyper-geometric test.
+
+    If a background is given, gene sets, their sizes and the query are restricted to the background genes and the
+    gene universe is the size of the background instead of the number of HGNC symbols.
+    """
+    return run_ora_batch(gmt_path, [set_gene_symbols], min_size, max_size, background=background)[0]
+
+
+def run_ora_batch(
+    gmt_path: str,
+    gene_lists: Sequence[Iterable[str]],
+    min_size: int,
+    max_size: int,
+    background: Optional[Iterable[str]] = None,
+) -> List[pd.DataFrame]:
+    """Run hyper-geometric tests of several gene lists against the same gene sets.
+
+    :param gmt_path: path to the GMT file
+    :param gene_lists: gene lists to test
+    :param min_size: gene sets of this size or smaller are removed
+    :param max_size: gene sets larger than this size are removed
+    :param background: optional background genes, defaults to all HGNC symbols
+    :return: one results dataFrame per gene list, in the same order
+    """
+    pack = load_pack(gmt_path)
+
+    if background is not None:
+        background = set(background)
+        gene_lists = [set(genes) & background for genes in gene_lists]
+
+    incidence, positions, gene_universe = _get_incidence(pack, min_size, max_size, background)
+
+    results = hypergeometric_test_incidence_batch(
+        gene_lists=gene_lists,
+        incidence=incidence,
+        pathway_ids=pack.pathways[positions].tolist(),
+        gene_index=pack.gene_index,
+        gene_universe=gene_universe,
+    )
+
+    logger.info(f'ORA run on {len(results)} gene lists against {len(positions)} pathways')
+
+    return results
+
 
-    df = perform_hypergeometric_test(
-        genes_to_test=set_gene_symbols,
-        pathway_dict=gene_sets,
+def run_ora_sweep(
+    gmt_path: str,
+    genes: Sequence[str],
+    values: Sequence[float],
+    cutoffs: Sequence[float],
+    min_size: int,
+    max_size: int,
+    background: Optional[Iterable[str]] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Run hyper-geometric tests on the genes passing each of several significance thresholds.
+
+    Genes are sorted once by value and the query at each cutoff is the genes with a value lower than or equal to the
+    cutoff. Overlaps with every pathway are obtained as cumulative sums over the genes in rank order, so each gene is
+    counted once regardless of the number of cutoffs.
+
+    :param gmt_path: path to the GMT file
+    :param genes: gene symbols
+    :param values: value used to filter each gene, such as its adjusted p-value
+    :param cutoffs: significance thresholds
+    :param min_size: gene sets of this size or smaller are removed
+    :param max_size: gene sets larger than this size are removed
+    :param background: optional background genes, defaults to all HGNC symbols
+    :return: pathway x cutoff dataFrames of p-values and of q-values
+    """
+    pack = load_pack(gmt_path)
+
+    cutoffs = sorted(set(cutoffs))
+
+    ranked = pd.DataFrame({'gene': genes, 'value': values}).dropna()
+
+    if background is not None:
+        background = set(background)
+        ranked = ranked[ranked['gene'].isin(background)]
+
+    # Rank genes once, keeping the most significant value of duplicated symbols
+    ranked = ranked.sort_values('value', kind='mergesort').drop_duplicates('gene')
+
+    # Number of genes passing each cutoff
+    query_sizes = np.searchsorted(ranked['value'].to_numpy(), cutoffs, side='right')
+    ranked_genes = ranked['gene'].to_numpy()[:query_sizes[-1]]
+
+    incidence, positions, gene_universe = _get_incidence(pack, min_size, max_size, background)
+
+    # Pathway memberships of the genes in rank order, for genes found in the gene sets
+    ranks = np.array([rank for rank, gene in enumerate(ranked_genes) if gene in pack.gene_index], dtype=np.int64)
+    memberships = incidence[[pack.gene_index[gene] for gene in ranked_genes[ranks]]].tocoo()
+
+    # Count the genes entering the query at each cutoff and accumulate them over cutoffs
+    cutoff_bins = np.searchsorted(query_sizes, ranks[memberships.row], side='right')
+    overlaps = np.zeros((len(cutoffs), incidence.shape[1]), dtype=np.int64)
+    np.add.at(overlaps, (cutoff_bins, memberships.col), 1)
+    overlaps = np.cumsum(overlaps, axis=0)
+
+    pathway_sizes = np.asarray(incidence.sum(axis=0)).ravel()
+
+    p_values = hypergeometric_p_values(
+        overlaps,
+        pathway_sizes[np.newaxis, :],
+        query_sizes[:, np.newaxis],
+        gene_universe,
     )
+    q_values = np.array([multipletests(row, method='fdr_bh')[1] for row in p_values])
+
+    pathway_ids = pd.Index(pack.pathways[positions].tolist(), name='pathway_id')
 
-    logger.info(f'# of pathways enriched {len(df.index)}')
+    logger.info(f'ORA run at {len(cutoffs)} cutoffs against {len(positions)} pathways')
+
+    return (
+        pd.DataFrame(p_values.T, index=pathway_ids, columns=cutoffs),
+        pd.DataFrame(q_values.T, index=pathway_ids, columns=cutoffs),
+    )
+
+
+def merge_ora_results(results: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate the results of ORA run on each database separately and correct their p-values together.
+
+    The p-values do not depend on the other gene sets, so the merged results are the ones of ORA run on all databases.
+    """
+    df = pd.concat(results, ignore_index=True)
+    df['q_value'] = multipletests(df['p_value'], method='fdr_bh')[1]
 
     return df
 
 
+def merge_ora_sweeps(p_values: Sequence[pd.DataFrame]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Concatenate the pathway x cutoff p-values of sweeps run on each database and correct each cutoff together.
+
+    :return: pathway x cutoff dataFrames of p-values and of q-values
+    """
+    p_values_df = pd.concat(p_values)
+    q_values_df = p_values_df.apply(lambda column: multipletests(column, method='fdr_bh')[1])
+
+    return p_values_df, q_values_df
+
+
+def _get_incidence(
+    pack: GenesetPack,
+    min_size: int,
+    max_size: int,
+    background: Optional[Set[str]] = None,
+) -> Tuple[sparse.csr_matrix, np.ndarray, int]:
+    """Return the incidence matrix of the gene sets passing the size filters, their positions and the gene universe.
+
+    If a background is given, gene sets are restricted to the background genes before filtering on their sizes.
+    """
+    # Note that by default, parser filters out gene sets smaller than 3 and larger than 5000
+    if background is None:
+        positions = pack.size_filter(min_size=min_size, max_size=max_size, exclusive_min=True)
+        _check_genesets_filter(len(pack), len(positions), min_size, max_size)
+
+        return pack.incidence_matrix(positions), positions, GENE_UNIVERSE
+
+    # Restrict every gene set to the background once, then filter gene sets on their restricted sizes
+    incidence = pack.incidence_matrix(gene_ids=pack.gene_ids(background))
+    sizes = np.asarray(incidence.sum(axis=0)).ravel()
+
+    positions = np.flatnonzero((sizes > min_size) & (sizes <= max_size))
+    _check_genesets_filter(len(pack), len(positions), min_size, max_size)
+
+    return incidence[:, positions].tocsr(), positions, len(background)
+
+
 def _prepare_hypergeometric_test(
     query_gene_set: Set[str],
     pathway_gene_set: Set[str],
@@ -88,6 +248,189 @@ def perform_hypergeometric_test(
     return df
 
 
+def build_incidence_matrix(
+    pathway_dict: Mapping[str, List[str]],
+) -> Tuple[sparse.csr_matrix, List[str], Dict[str, int]]:
+    """Encode gene sets as a binary gene x pathway sparse incidence matrix.
+
+    :param pathway_dict: pathway name to gene set
+    :return: incidence matrix, pathway names in column order and gene symbol to row index mapping
+    """
+    gene_index = {}
+    rows = []
+    columns = []
+
+    for column, pathway_gene_set in enumerate(pathway_dict.values()):
+        # Duplicated symbols in a GMT line count once, as in the set based test
+        for gene in set(pathway_gene_set):
+            rows.append(gene_index.setdefault(gene, len(gene_index)))
+            columns.append(column)
+
+    incidence = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+        shape=(len(gene_index), len(pathway_dict)),
+    )
+
+    return incidence, list(pathway_dict), gene_index
+
+
+def encode_gene_set(genes: Iterable[str], gene_index: Mapping[str, int]) -> sparse.csr_matrix:
+    """Encode a gene set as a binary sparse row vector over the rows of an incidence matrix."""
+    return encode_gene_sets([genes], gene_index)
+
+
+def encode_gene_sets(gene_lists: Sequence[Iterable[str]], gene_index: Mapping[str, int]) -> sparse.csr_matrix:
+    """Encode gene sets as a binary sparse matrix with one row per gene set over the rows of an incidence matrix."""
+    rows = []
+    columns = []
+
+    for row, genes in enumerate(gene_lists):
+        indices = sorted({gene_index[gene] for gene in genes if gene in gene_index})
+        rows.extend([row] * len(indices))
+        columns.extend(indices)
+
+    return sparse.csr_matrix(
+        (np.ones(len(columns), dtype=np.int32), (np.array(rows, dtype=np.int32), np.array(columns, dtype=np.int32))),
+        shape=(len(gene_lists), len(gene_index)),
+    )
+
+
+def hypergeometric_p_values(
+    overlaps: np.ndarray,
+    pathway_sizes: np.ndarray,
+    query_sizes: Union[int, np.ndarray],
+    gene_universe: Union[int, np.ndarray],
+) -> np.ndarray:
+    """Calculate one-sided hypergeometric p-values for arrays of overlap counts in a single call.
+
+    Equivalent to Fisher's exact test with alternative='greater' on the 2x2 table built by
+    :func:`_prepare_hypergeometric_test`. All arguments are broadcast against each other.
+
+    :param overlaps: number of query genes in each pathway
+    :param pathway_sizes: number of genes in each pathway
+    :param query_sizes: number of genes in the query
+    :param gene_universe: number of genes in the background
+    :return: p-values with the shape of the broadcast arguments
+    """
+    overlaps, pathway_sizes, query_sizes, gene_universe = np.broadcast_arrays(
+        overlaps, pathway_sizes, query_sizes, gene_universe,
+    )
+
+    # p-values only depend on the four counts, which repeat a lot across pathways and gene sets
+    counts = np.stack([overlaps.ravel(), pathway_sizes.ravel(), query_sizes.ravel(), gene_universe.ravel()], axis=1)
+    unique_counts, inverse = np.unique(counts, axis=0, return_inverse=True)
+
+    p_values = hypergeom.sf(
+        unique_counts[:, 0] - 1, unique_counts[:, 3], unique_counts[:, 2], unique_counts[:, 1],
+    )[inverse.ravel()].reshape(overlaps.shape)
+
+    # fisher_exact returns 1 when a row or a column of the contingency table sums to zero
+    degenerate = (
+        (query_sizes == 0) | (query_sizes == gene_universe) |
+        (pathway_sizes == 0) | (pathway_sizes == gene_universe)
+    )
+
+    return np.where(degenerate, 1.0, p_values)
+
+
+def perform_sparse_hypergeometric_test(
+    genes_to_test: Set[str],
+    pathway_dict: Mapping[str, List[str]],
+    gene_universe: int = GENE_UNIVERSE,
+) -> pd.DataFrame:
+    """Perform hypergeometric tests for all pathways at once.
+
+    Gives the same results as :func:`perform_hypergeometric_test`, with every overlap obtained from one sparse
+    product and every p-value from one vectorized call.
+
+    :param genes_to_test: gene set to test against pathway
+    :param pathway_dict: pathway name to gene set
+    :param gene_universe: number of HGNC symbols
+    """
+    incidence, pathway_ids, gene_index = build_incidence_matrix(pathway_dict)
+
+    return hypergeometric_test_incidence(genes_to_test, incidence, pathway_ids, gene_index, gene_universe)
+
+
+def hypergeometric_test_incidence(
+    genes_to_test: Set[str],
+    incidence: sparse.csr_matrix,
+    pathway_ids: List[str],
+    gene_index: Mapping[str, int],
+    gene_universe: int = GENE_UNIVERSE,
+) -> pd.DataFrame:
+    """Perform hypergeometric tests of a gene set against every column of a gene x pathway incidence matrix.
+
+    :param genes_to_test: gene set to test against pathway
+    :param incidence: binary gene x pathway incidence matrix
+    :param pathway_ids: pathway names in column order
+    :param gene_index: gene symbol to row index mapping
+    :param gene_universe: number of HGNC symbols
+    """
+    return hypergeometric_test_incidence_batch([genes_to_test], incidence, pathway_ids, gene_index, gene_universe)[0]
+
+
+def hypergeometric_test_incidence_batch(
+    gene_lists: Sequence[Iterable[str]],
+    incidence: sparse.csr_matrix,
+    pathway_ids: List[str],
+    gene_index: Mapping[str, int],
+    gene_universe: int = GENE_UNIVERSE,
+) -> List[pd.DataFrame]:
+    """Perform hypergeometric tests of several gene sets against every column of a gene x pathway incidence matrix.
+
+    All overlaps are obtained from one sparse product and all p-values from one vectorized call. Multiple testing
+    correction is applied separately to the results of each gene set.
+
+    :param gene_lists: gene sets to test against pathway
+    :param incidence: binary gene x pathway incidence matrix
+    :param pathway_ids: pathway names in column order
+    :param gene_index: gene symbol to row index mapping
+    :param gene_universe: number of HGNC symbols
+    :return: one results dataFrame per gene set
+    """
+    gene_lists = [set(genes) for genes in gene_lists]
+
+    queries = encode_gene_sets(gene_lists, gene_index)
+
+    # gene sets x pathways
+    overlaps = (queries @ incidence).toarray()
+    pathway_sizes = np.asarray(incidence.sum(axis=0)).ravel()
+    query_sizes = np.array([len(genes) for genes in gene_lists])
+
+    p_values = hypergeometric_p_values(
+        overlaps,
+        pathway_sizes[np.newaxis, :],
+        query_sizes[:, np.newaxis],
+        gene_universe,
+    )
+
+    results = []
+
+    for row in p_values:
+        df = pd.DataFrame({'pathway_id': pathway_ids, 'p_value': row})
+
+        correction_test = multipletests(df.p_value, method='fdr_bh')
+        df['q_value'] = correction_test[1]
+
+        results.append(df)
+
+    return results
+
+
+def _check_genesets_filter(total: int, remaining: int, min_size: int, max_size: int) -> None:
+    """Log the number of gene sets removed by the size filters and raise if none are left."""
+    filsets_num = total - remaining
+    logging.info(f"{filsets_num} gene sets were removed with filters: max_size={max_size} and min_size={min_size}")
+
+    if filsets_num == total:
+        logging.error(
+            "No gene sets passed filtering condition!! Try new parameters!\n" + "GSEApy gene names are case sensitive."
+        )
+        raise Exception(
+            "No gene sets passed filtering condition!! Try new parameters!\n" + "GSEApy gene names are case sensitive.")
+
+
 def gmt_parser(
     path: str,
     min_size: int,
@@ -95,19 +438,10 @@ def gmt_parser(
     gene_list=None,
 ) -> dict:
     """Parse GMT file."""
-    with open(path) as file:
-
-        # Get dictionary with pathway and corresponding gene set
-        genesets_dict = {
-            name: genes
-            for name, _, *genes in spliterate(file)
-        }
-    # Apply gene set filter
-    genesets_filter = {
-        key: genes
-        for key, genes in genesets_dict.items()
-        if min_size < len(genes) <= max_size
-    }
+    pack = load_pack(path)
+
+    # Get dictionary with pathway and corresponding gene set after applying gene set filter
+    genesets_filter = pack.to_dict(pack.size_filter(min_size=min_size, max_size=max_size, exclusive_min=True))
 
     if gene_list is not None:
         subsets = sorted(genesets_filter.keys())
@@ -119,14 +453,6 @@ def gmt_parser(
             else:
                 continue
 
-    filsets_num = len(genesets_dict) - len(genesets_filter)
-    logging.info(f"{filsets_num} gene sets were removed with filters: max_size={max_size} and min_size={min_size}")
+    _check_genesets_filter(len(pack), len(genesets_filter), min_size, max_size)
 
-    if filsets_num == len(genesets_dict):
-        logging.error(
-            "No gene sets passed filtering condition!! Try new parameters!\n" + "GSEApy gene names are case sensitive."
-        )
-        raise Exception(
-            "No gene sets passed filtering condition!! Try new parameters!\n" + "GSEApy gene names are case sensitive.")
-    else:
-        return genesets_filter
+    return genesets_filter
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""Report the progress of running jobs."""
+
+import logging
+import time
+from typing import Dict, List, Optional, Union
+
+from amqp.exceptions import ChannelError
+from celery import current_app
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from viewer.models import JobProgress
+from viewer.src.metrics import StageMetrics
+
+logger = logging.getLogger(__name__)
+
+#: Minimum number of seconds between two updates of the permutations done
+PERMUTATIONS_UPDATE_INTERVAL = 5
+
+#: Seconds the depths of the queues are cached for, so that polling the experiments page does not load the broker
+QUEUE_DEPTHS_CACHE_TIMEOUT = 60
+
+#: Cache key of the depths of the queues
+QUEUE_DEPTHS_CACHE_KEY = 'queue_depths'
+
+#: Seconds to wait for the broker when reading the depths of the queues
+QUEUE_DEPTHS_CONNECT_TIMEOUT = 2
+
+#: Names of the queues of the jobs shown on the experiments page
+JOB_QUEUES = {
+    settings.ORA_QUEUE: 'ORA',
+    settings.DESEQ_QUEUE: 'DESeq2',
+    settings.PRERANK_QUEUE: 'GSEA Pre-Ranked',
+    settings.GSEA_QUEUE: 'GSEA',
+}
+
+"""Stages of a job"""
+
+LOADING_STAGE = 'Loading files'
+DESEQ_STAGE = 'Differential expression analysis'
+GSEA_STAGE = 'GSEA'
+ORA_STAGE = 'ORA'
+SAVING_STAGE = 'Saving results'
+
+
+class ProgressReporter:
+    """Record the stage, database and permutations of a job in the JobProgress table.
+
+    Every update is a single UPDATE query on the progress rows, and updates of the permutations are throttled, so
+    reporting does not slow down the job. The resources used by each stage are measured in the JobMetrics table.
+    """
+
+    def __init__(self, job_ids: Union[str, List[str]]):
+        """Create the progress rows of one job or of the jobs run by a single batch task."""
+        self.job_ids = list(job_ids) if isinstance(job_ids, list) else [job_ids]
+        self.metrics = StageMetrics(self.job_ids)
+        self._last_update = 0.0
+
+        for job_id in self.job_ids:
+            JobProgress.objects.update_or_create(
+                job_id=job_id,
+                defaults={'stage': 'Starting', 'updated': timezone.now()},
+            )
+
+    def _update(self, **fields):
+        JobProgress.objects.filter(job_id__in=self.job_ids).update(updated=timezone.now(), **fields)
+
+    def stage(self, name: str):
+        """Start a new stage of the job."""
+        self.metrics.start(name)
+        self._update(stage=name, step=0, total_steps=0, permutations_done=0, permutations_total=0)
+
+    def database(self, step: int, total_steps: int, name: Optional[str] = None):
+        """Report the database being processed, counting from 1.
+
+        :param name: name of the database, given when the databases are run one after the other so that each one is
+            measured separately
+        """
+        if name is not None:
+            self.metrics.start(self.metrics.stage, database=name)
+
+        self._update(step=step, total_steps=total_steps, permutations_done=0)
+
+    def finish(self):
+        """Save the metrics of the last stage, once the results are saved."""
+        self.metrics.stop()
+
+    def permutations(self, done: int, total: int):
+        """Report the number of permutations done."""
+        now = time.monotonic()
+
+        if done < total and now - self._last_update < PERMUTATIONS_UPDATE_INTERVAL:
+            return
+
+        self._last_update = now
+        self._update(permutations_done=done, permutations_total=total)
+
+
+def report_stage(job_id: str, name: str, total_steps: int = 0) -> None:
+    """Report the stage of a job run by several tasks, with the number of databases its tasks run in parallel."""
+    JobProgress.objects.filter(job_id=job_id).update(
+        stage=name,
+        step=0,
+        total_steps=total_steps,
+        permutations_done=0,
+        permutations_total=0,
+        updated=timezone.now(),
+    )
+
+
+def set_job_tasks(job_id: str, task_ids: List[str]) -> None:
+    """Record the tasks a job fanned out to, so that stopping the job revokes them."""
+    JobProgress.objects.filter(job_id=job_id).update(task_ids=task_ids)
+
+
+def get_job_tasks(job_id: str) -> List[str]:
+    """Return the tasks a job fanned out to, if any."""
+    return JobProgress.objects.filter(job_id=job_id).values_list('task_ids', flat=True).first() or []
+
+
+def count_database_done(job_id: str) -> None:
+    """Count a database of a job run by a parallel task."""
+    JobProgress.objects.filter(job_id=job_id).update(step=F('step') + 1, updated=timezone.now())
+
+
+def get_queue_depths() -> Dict[str, Optional[int]]:
+    """Return the number of tasks waiting in the queue of each kind of job, read from the broker at most every minute.
+
+    The depth of a queue is None if the queue has not been created yet, and no depth is returned if the broker cannot
+    be reached in time.
+    """
+    depths = cache.get(QUEUE_DEPTHS_CACHE_KEY)
+
+    if depths is None:
+        depths = _read_queue_depths()
+        cache.set(QUEUE_DEPTHS_CACHE_KEY, depths, QUEUE_DEPTHS_CACHE_TIMEOUT)
+
+    return depths
+
+
+def _read_queue_depths() -> Dict[str, Optional[int]]:
+    """Read the number of tasks waiting in the queue of each kind of job from the broker."""
+    depths = dict.fromkeys(JOB_QUEUES.values())
+
+    try:
+        with current_app.connection_for_read(connect_timeout=QUEUE_DEPTHS_CONNECT_TIMEOUT) as connection:
+            connection.ensure_connection(max_retries=1)
+
+            for queue, name in JOB_QUEUES.items():
+                # A passive declaration only reads the queue, and closes the channel if the queue does not exist
+                try:
+                    with connection.channel() as channel:
+                        depths[name] = channel.queue_declare(queue=queue, passive=True).message_count
+
+                except ChannelError:
+                    continue
+
+    except Exception as e:
+        logger.warning(f'Could not read the depths of the queues: {e}')
+        return {}
+
+    return depths
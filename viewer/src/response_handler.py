@@ -30,8 +30,12 @@ ORA_EMPTY_FORM_MSG = 'Looks like no files were uploaded to run ORA. Please ensur
                      ' files for differential gene expression analysis.'
 
 ORA_UPLOAD_MSG = 'To run ORA, please ensure only one of the following is uploaded: a file containing a list of genes,' \
-                 ' files to run differential gene expression analysis or results of differential gene expression' \
-                 ' analysis. If the problem persists, try refreshing the home page.'
+                 ' a file containing multiple gene lists, files to run differential gene expression analysis or' \
+                 ' results of differential gene expression analysis. If the problem persists, try refreshing the' \
+                 ' home page.'
+
+ORA_GENE_LISTS_MSG = 'None of the gene lists in your file contain HGNC symbols. Please ensure each column of your file' \
+                     ' contains a list of genes. See FAQs and example files for more details.'
 
 GSEA_EMPTY_FORM_MSG = 'It seems you are missing some files to run GSEA or GSEA preranked. Please ensure appropriate ' \
                       'files have been uploaded. See the FAQs section for more details. If the problem persists,' \
@@ -81,6 +85,9 @@ DGE_OPTIONS_MSG = 'Please ensure only 1 of the 2 options is selected. You can ei
                   'log 2 fold changes or the files required to perform differential gene expression analysis. ' \
                   'See the FAQs section for more details.'
 
+CONTRAST_MSG = 'Please ensure the contrast is made of two different class labels from your class labels file ' \
+               'separated by a comma, e.g. disease,control.'
+
 DOWNLOAD_ONTOLOGY_MSG = "Looks like the DecoPath ontology has not been loaded. Please make sure it's downloaded first."
 
 DOWNLOAD_DECOPATH_NAMES = "Looks like the DecoPath ID to name mapping file is missing. Please make sure it's " \
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""Storage of results dataFrames.
+
+Results and fold changes are stored in the binary fields of the results model as compressed Parquet, which is smaller
+than pickled dataFrames and lets the views read only the columns they need instead of loading whole results. Results
+stored by older versions are pickled dataFrames: they are still read and are converted to Parquet when they are first
+read through the results model. DataFrames that Arrow cannot store, such as columns of mixed types in user uploads,
+are still pickled. The p-values and q-values of an ORA threshold sweep are stored as a single dataFrame with a column
+per value and cutoff, since Parquet columns are named by strings.
+"""
+
+import io
+import logging
+import pickle
+from typing import List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+#: Magic bytes at the start of every Parquet file
+PARQUET_MAGIC = b'PAR1'
+
+#: Compression codec of the Parquet results
+COMPRESSION = 'zstd'
+
+Blob = Union[bytes, memoryview]
+
+
+def is_columnar(blob: Blob) -> bool:
+    """Check if results are stored as Parquet rather than pickled."""
+    return bytes(blob[:len(PARQUET_MAGIC)]) == PARQUET_MAGIC
+
+
+def dump_results(df: pd.DataFrame) -> bytes:
+    """Serialize a results dataFrame as compressed Parquet, or pickle it if Arrow cannot represent its columns."""
+    try:
+        table = pa.Table.from_pandas(df)
+
+    except (pa.ArrowException, TypeError, ValueError) as e:
+        logger.warning(f'Pickling results that cannot be stored as Parquet: {e}')
+        return pickle.dumps(df)
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=COMPRESSION)
+
+    return buffer.getvalue()
+
+
+def join_sweep_results(p_values: pd.DataFrame, q_values: pd.DataFrame) -> pd.DataFrame:
+    """Join the pathway x cutoff dataFrames of p-values and q-values of a threshold sweep, e.g. into p_value_0.05."""
+    df = pd.concat({'p_value': p_values, 'q_value': q_values}, axis=1)
+    df.columns = [f'{value}_{cutoff}' for value, cutoff in df.columns]
+
+    return df
+
+
+def load_results(blob: Blob, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Deserialize results stored as Parquet or pickled.
+
+    :param blob: serialized results
+    :param columns: columns to read, all of them by default. Missing columns are ignored and the index is always read.
+    """
+    if not is_columnar(blob):
+        df = pickle.loads(blob)
+
+        return df if columns is None else df[[column for column in columns if column in df.columns]]
+
+    parquet_file = pq.ParquetFile(pa.BufferReader(blob))
+
+    if columns is not None:
+        columns = [column for column in columns if column in parquet_file.schema_arrow.names]
+
+    return parquet_file.read(columns=columns, use_pandas_metadata=True).to_pandas()
@@ -24,6 +24,7 @@ import matplotlib.colors
 import networkx as nx
 import pandas as pd
 import requests
+from pyarrow import feather
 from bio2bel_reactome import Manager as ReactomeManager
 from django.core.files.uploadedfile import UploadedFile
 from django.core.files.uploadhandler import FileUploadHandler
@@ -32,6 +33,7 @@ from networkx.readwrite.json_graph import tree_data
 
 from viewer.models import PathwayDatabase, User, Pathway
 from viewer.src.constants import *
+from viewer.src.geneset_pack import load_pack
 
 logger = logging.getLogger(__name__)
 
@@ -62,6 +64,27 @@ def read_data_file(file_path: str, filename: str) -> Union[pd.DataFrame, str]:
         return f'There is a problem with your file {filename}. please check that it meets the criteria.'
 
 
+def save_upload_artifact(df: pd.DataFrame) -> str:
+    """Save an upload parsed and validated by the web tier for the workers and return the path of the artifact.
+
+    The index is stored as a column, so the workers get the frame they would get by reading the text file, but with the
+    HGNC symbols already cleaned up. The Feather file is not compressed, so the workers can memory-map it.
+    """
+    temp_name = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
+    artifact_path = os.path.join(tempfile.gettempdir(), f'{temp_name}{UPLOAD_ARTIFACT_EXTENSION}')
+
+    feather.write_feather(df.reset_index(), artifact_path, compression='uncompressed')
+
+    return artifact_path
+
+
+def read_upload_artifact(artifact_path: str) -> pd.DataFrame:
+    """Read an upload saved by the web tier by memory-mapping it."""
+    logger.info(f"Reading {artifact_path}")
+
+    return feather.read_table(artifact_path, memory_map=True).to_pandas()
+
+
 @functools.lru_cache()
 def _get_hgnc_mapping_dict(hgnc_mappings=HGNC_MAPPINGS):
     """Load HGNC name-id mappings."""
@@ -499,10 +522,7 @@ def get_dc_pathway_resources(decopath_ontology):
 
 def _get_gmt_dict(filename):
     """Parse gmt files and get gene sets."""
-    with open(filename, 'r') as f:
-        content = [line.strip().split('\t') for line in f]
-
-    return {pathway[0]: pathway[2:] for pathway in content}
+    return load_pack(filename).to_dict()
 
 
 def get_decopath_genesets(decopath_ontology, gmt_dir: str):
@@ -1,22 +1,38 @@
 from __future__ import absolute_import, unicode_literals
 
 import logging
-import pickle
+import os
 from datetime import timedelta
 from typing import List, Optional
 
 import pandas as pd
-from billiard.exceptions import SoftTimeLimitExceeded
-from celery import shared_task, Task
+from billiard.exceptions import SoftTimeLimitExceeded, TimeLimitExceeded
+from celery import chord, group, shared_task
+from celery.result import AsyncResult
+from celery.utils import uuid
 from cleanup_later.models import CleanupFile
+from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
 from django.db.models import F
 
 from viewer.models import User, EnrichmentResult
-from viewer.src.constants import make_gsea_export_directories, GENE_SYMBOL
-from viewer.src.gsea import perform_gsea, perform_prerank
-from viewer.src.ora import run_ora
-from viewer.src.utils import read_data_file
+from viewer.src.checkpoint import (
+    INPUTS_CHECKPOINT, QUERY_CHECKPOINT, TASK_CHECKPOINT, Checkpoint, get_checkpoint, get_database_checkpoint_name,
+)
+from viewer.src.constants import (
+    make_gsea_export_directories, DESEQ2_ENGINE, GENE_SYMBOL, GSEA, GSEAPY_ENGINE, NATIVE_DE_ENGINE, ORA, PRERANK,
+)
+from viewer.src.de_engine import differential_expression
+from viewer.src.deseq import run_deseq
+from viewer.src.gsea import run_gsea, run_prerank
+from viewer.src.metrics import StageMetrics
+from viewer.src.ora import merge_ora_results, merge_ora_sweeps, run_ora, run_ora_batch, run_ora_sweep
+from viewer.src.progress import (
+    DESEQ_STAGE, GSEA_STAGE, LOADING_STAGE, ORA_STAGE, SAVING_STAGE, ProgressReporter, count_database_done,
+    get_job_tasks, report_stage, set_job_tasks,
+)
+from viewer.src.results_storage import dump_results, join_sweep_results
+from viewer.src.utils import read_upload_artifact
 
 
 @shared_task
@@ -27,8 +43,24 @@ def email(subject: str, text_content: str, html_content: str, sender: str, recip
     return None
 
 
-@shared_task(soft_time_limit=28800)
+#: Appended to the error message of the GSEA jobs that hit the time limit and kept a checkpoint
+RESUME_MSG = " Its progress has been saved, so it can be resumed from the experiments page."
+
+#: Error message of the jobs fanned out over their databases whose tasks were lost without an error
+LOST_JOB_MSG = "The experiment was interrupted. Please try again."
+
+#: Errors of the tasks that hit the soft or the hard time limit
+TIME_LIMIT_ERRORS = (SoftTimeLimitExceeded, TimeLimitExceeded)
+
+
+def _get_time_limit_msg(time_limit: int) -> str:
+    """Return the error message of a job that exceeded the time limit of its queue, given in seconds."""
+    return f"The experiment exceeded the acceptable time limit ({time_limit / 3600:g} hours)."
+
+
+@shared_task(bind=True, soft_time_limit=settings.GSEA_TIME_LIMIT)
 def deploy_gsea(
+    self,
     data_path: str,
     class_labels_path: str,
     data_filename: str,
@@ -44,13 +76,24 @@ def deploy_gsea(
     job_id: str,
     read_counts_path: Optional = None,
     read_counts_filename: Optional = None,
+    engine: str = GSEAPY_ENGINE,
+    de_engine: str = DESEQ2_ENGINE,
+    contrast: Optional[List[str]] = None,
+    resume: bool = False,
 ):
     current_user = User.objects.filter(email=user_mail)[0]
     job = EnrichmentResult.objects.filter(result_id=job_id)[0]
+    checkpoint = get_checkpoint(job_id)
+    progress = None
+    fanned_out = False
     err = None
 
+    # GSEApy keeps its results in memory and only writes its reports when they are requested
+    output_dir = output_dir if settings.GSEA_REPORTS else None
+
     try:
-        make_gsea_export_directories()
+        if output_dir:
+            make_gsea_export_directories()
 
         # Check if quota has been reached
         if not current_user.is_quota_left():
@@ -62,105 +105,123 @@ def deploy_gsea(
 
             return False
 
-        # Remove transient files
-        CleanupFile.register(data_path, timedelta(minutes=30))
-        CleanupFile.register(class_labels_path, timedelta(minutes=30))
-
-        logging.info(f'Loading data file {data_filename}....')
-
-        try:
-            df = read_data_file(data_path, data_filename)
-        except:
-            raise ValueError(open(data_path, "r").read())
-
-        if GENE_SYMBOL in df:
-            df.set_index(GENE_SYMBOL, inplace=True)
-
-        logging.info(f'Loading class labels file {class_filename}....')
+        progress = ProgressReporter(job_id)
+        progress.stage(LOADING_STAGE)
+
+        # A resumed job reads the artifacts of its uploads from its checkpoint
+        inputs = checkpoint.load(INPUTS_CHECKPOINT) if resume else None
+
+        if inputs is None:
+            checkpoint.save(TASK_CHECKPOINT, {'task': self.name, 'kwargs': self.request.kwargs})
+
+            inputs = _keep_inputs(checkpoint, dict(
+                data_path=data_path,
+                class_labels_path=class_labels_path,
+                read_counts_path=read_counts_path,
+            ))
+
+        # GSEApy runs each database on its own, so the databases run in parallel tasks after the DGE analysis, unless a
+        # resumed job already did it
+        if engine == GSEAPY_ENGINE and len(gmt_files) > 1:
+            _fan_out_databases(
+                job_id,
+                user_mail,
+                GSEA,
+                gmt_files,
+                dict(prerank=False, parameters=dict(
+                    output_dir=output_dir,
+                    min_size=min_size,
+                    max_size=max_size,
+                    method=method,
+                    permutation_type=permutation_type,
+                    permutation_num=permutation_num,
+                )),
+                dict(
+                    read_counts_path=inputs['read_counts_path'],
+                    design_matrix_path=inputs['class_labels_path'],
+                    de_engine=de_engine,
+                    contrast=contrast,
+                ) if inputs['read_counts_path'] and job.fold_change_results is None else None,
+            )
+            fanned_out = True
 
-        try:
-            class_df = read_data_file(class_labels_path, class_filename)
-        except:
-            raise ValueError(open(class_labels_path, "r").read())
+            return err
 
-        logging.info('Files to run GSEA have been loaded....')
+        df, class_df, read_counts_df = _load_gsea_inputs(
+            data_filename=data_filename,
+            class_filename=class_filename,
+            read_counts_filename=read_counts_filename,
+            **inputs,
+        )
 
         # Get class labels vector
         class_vector = class_df['class_label'].to_list()
 
-        # Run DESeq2
-        if read_counts_path:
-
-            CleanupFile.register(read_counts_path, timedelta(minutes=30))
-
-            logging.info(f'Loading read counts file {read_counts_filename}....')
-
-            try:
-                read_counts_df = read_data_file(read_counts_path, read_counts_filename)
-            except:
-                raise ValueError(open(read_counts_path, "r").read())
-
-            logging.info('Read counts file has been loaded....')
-
-            if read_counts_df.index.name == GENE_SYMBOL:
-                read_counts_df.reset_index(inplace=True)
-
-            deseq = DeseqTask(
-                count_matrix=read_counts_df,
-                design_matrix=class_df,
-                design_formula='~ class_label',
-                gene_column=GENE_SYMBOL
-            )
-
-            pd_from_r_df = deseq.run()
-
-            job.fold_change_results = pickle.dumps(pd_from_r_df)
-
-        results = []
-
-        for gmt_file in gmt_files:
-            logging.info(f'Running GSEA on gene sets from {gmt_file}')
-
-            gsea_results = perform_gsea(
-                data=df,
-                gmt=gmt_file,
-                class_vector=class_vector,
-                output_dir=output_dir,
-                min_size=min_size,
-                max_size=max_size,
-                method=method,
-                permutation_type=permutation_type,
-                permutation_num=permutation_num,
-            )
-
-            logging.info('Getting results...')
-
-            results_df = gsea_results.res2d
-            results.append(results_df)
+        # Run DESeq2, unless a resumed job already did
+        if read_counts_df is not None and job.fold_change_results is None:
+            progress.stage(DESEQ_STAGE)
+
+            pd_from_r_df = _run_differential_expression(read_counts_df, class_df, de_engine, contrast)
+
+            job.fold_change_results = dump_results(pd_from_r_df)
+
+        progress.stage(GSEA_STAGE)
+
+        logging.info(f'Running GSEA on gene sets from {", ".join(gmt_files)} with the {engine} engine')
+
+        # All databases are scored against the same ranking and permutations
+        df = run_gsea(
+            data=df,
+            gmt=gmt_files,
+            class_vector=class_vector,
+            output_dir=output_dir,
+            min_size=min_size,
+            max_size=max_size,
+            method=method,
+            permutation_type=permutation_type,
+            permutation_num=permutation_num,
+            engine=engine,
+            processes=settings.GSEA_PROCESSES,
+            seed=settings.GSEA_SEED,
+            significance_threshold=job.significance_threshold,
+            progress=progress,
+            checkpoint=checkpoint,
+        )
 
-        df = pd.concat(results)
+        progress.stage(SAVING_STAGE)
 
-        job.result = pickle.dumps(df)
+        job.result = dump_results(df)
         job.result_status = 2
+        checkpoint.clear()
 
     except SoftTimeLimitExceeded:
         job.result_status = 0
-        job.error_message = "The experiment exceeded the acceptable time limit (8 hours)"
+        job.error_message = _get_time_limit_msg(settings.GSEA_TIME_LIMIT)
+
+        if checkpoint.exists():
+            job.error_message += RESUME_MSG
 
     except Exception as e:
         err = e
         job.result_status = 0
         job.error_message = str(e)
+        checkpoint.clear()
 
     finally:
-        User.objects.filter(email__exact=user_mail).update(num_of_jobs=F('num_of_jobs') - 1)
-        job.save()
+        # The chord of a job fanned out over its databases saves its outcome
+        if not fanned_out:
+            User.objects.filter(email__exact=user_mail).update(num_of_jobs=F('num_of_jobs') - 1)
+            job.save()
+
+        if progress is not None:
+            progress.finish()
 
     return err
 
 
-@shared_task(soft_time_limit=28800)
+@shared_task(bind=True, soft_time_limit=settings.PRERANK_TIME_LIMIT)
 def deploy_prerank(
+    self,
     rnk_path: str,
     rnk_filename: str,
     gmt_files: list,
@@ -174,13 +235,24 @@ def deploy_prerank(
     read_counts_filename: Optional = None,
     class_labels_path: Optional = None,
     class_filename: Optional = None,
+    engine: str = GSEAPY_ENGINE,
+    de_engine: str = DESEQ2_ENGINE,
+    contrast: Optional[List[str]] = None,
+    resume: bool = False,
 ):
     current_user = User.objects.filter(email=user_mail)[0]
     job = EnrichmentResult.objects.filter(result_id=job_id)[0]
+    checkpoint = get_checkpoint(job_id)
+    progress = None
+    fanned_out = False
     err = None
 
+    # GSEApy keeps its results in memory and only writes its reports when they are requested
+    output_dir = output_dir if settings.GSEA_REPORTS else None
+
     try:
-        make_gsea_export_directories()
+        if output_dir:
+            make_gsea_export_directories()
 
         # Check if quota has been reached
         if not current_user.is_quota_left():
@@ -192,100 +264,632 @@ def deploy_prerank(
 
             return False
 
-        # Remove transient files
-        CleanupFile.register(rnk_path, timedelta(minutes=30))
+        progress = ProgressReporter(job_id)
+        progress.stage(LOADING_STAGE)
+
+        # A resumed job reads the artifacts of its uploads from its checkpoint
+        inputs = checkpoint.load(INPUTS_CHECKPOINT) if resume else None
+
+        if inputs is None:
+            checkpoint.save(TASK_CHECKPOINT, {'task': self.name, 'kwargs': self.request.kwargs})
+
+            inputs = _keep_inputs(checkpoint, dict(
+                rnk_path=rnk_path,
+                read_counts_path=read_counts_path,
+                class_labels_path=class_labels_path,
+            ))
+
+        # GSEApy runs each database on its own, so the databases run in parallel tasks after the DGE analysis, unless a
+        # resumed job already did it
+        if engine == GSEAPY_ENGINE and len(gmt_files) > 1:
+            _fan_out_databases(
+                job_id,
+                user_mail,
+                PRERANK,
+                gmt_files,
+                dict(prerank=True, parameters=dict(
+                    output_dir=output_dir,
+                    min_size=min_size,
+                    max_size=max_size,
+                    permutation_num=permutation_num,
+                )),
+                dict(
+                    read_counts_path=inputs['read_counts_path'],
+                    design_matrix_path=inputs['class_labels_path'],
+                    de_engine=de_engine,
+                    contrast=contrast,
+                ) if inputs['read_counts_path'] and job.fold_change_results is None else None,
+            )
+            fanned_out = True
 
-        logging.info(f'Loading preranked file {rnk_path}....')
+            return err
 
-        try:
-            df = read_data_file(rnk_path, rnk_filename)
-        except:
-            raise ValueError(open(rnk_path, "r").read())
+        df, read_counts_df, class_df = _load_prerank_inputs(
+            rnk_filename=rnk_filename,
+            read_counts_filename=read_counts_filename,
+            class_filename=class_filename,
+            **inputs,
+        )
 
-        logging.info('Pre-ranked file has been loaded....')
+        # Run DESeq2, unless a resumed job already did
+        if read_counts_df is not None and job.fold_change_results is None:
+            progress.stage(DESEQ_STAGE)
 
-        # Run DESeq2
-        if read_counts_path:
+            pd_from_r_df = _run_differential_expression(read_counts_df, class_df, de_engine, contrast)
+
+            job.fold_change_results = dump_results(pd_from_r_df)
+
+        progress.stage(GSEA_STAGE)
+
+        logging.info(f'Running GSEA Pre-Ranked on gene sets from {", ".join(gmt_files)} with the {engine} engine')
+
+        # All databases are scored against the same ranking and permutations
+        df = run_prerank(
+            rnk=df,
+            gmt=gmt_files,
+            output_dir=output_dir,
+            min_size=min_size,
+            max_size=max_size,
+            permutation_num=permutation_num,
+            engine=engine,
+            processes=settings.GSEA_PROCESSES,
+            seed=settings.GSEA_SEED,
+            significance_threshold=job.significance_threshold,
+            progress=progress,
+            checkpoint=checkpoint,
+        )
+
+        progress.stage(SAVING_STAGE)
+
+        job.result = dump_results(df)
+        job.result_status = 2
+        checkpoint.clear()
+
+    except SoftTimeLimitExceeded:
+        job.result_status = 0
+        job.error_message = _get_time_limit_msg(settings.PRERANK_TIME_LIMIT)
+
+        if checkpoint.exists():
+            job.error_message += RESUME_MSG
+
+    except Exception as e:
+        err = e
+        job.result_status = 0
+        job.error_message = str(e)
+        checkpoint.clear()
+
+    finally:
+        # The chord of a job fanned out over its databases saves its outcome
+        if not fanned_out:
+            User.objects.filter(email__exact=user_mail).update(num_of_jobs=F('num_of_jobs') - 1)
+            job.save()
+
+        if progress is not None:
+            progress.finish()
+
+    return err
+
+
+def _get_database_task_options(enrichment_method: str) -> dict:
+    """Return the queue and time limit of the tasks of the databases of a job, which are the ones of the job."""
+    if enrichment_method == ORA:
+        return {'queue': settings.ORA_QUEUE, 'soft_time_limit': settings.ORA_TIME_LIMIT}
+
+    if enrichment_method == PRERANK:
+        return {'queue': settings.PRERANK_QUEUE, 'soft_time_limit': settings.PRERANK_TIME_LIMIT}
+
+    return {'queue': settings.GSEA_QUEUE, 'soft_time_limit': settings.GSEA_TIME_LIMIT}
+
+
+def _fan_out_databases(
+    job_id: str,
+    user_mail: str,
+    enrichment_method: str,
+    gmt_files: List[str],
+    database_kwargs: dict,
+    deseq_kwargs: Optional[dict] = None,
+) -> None:
+    """Run each database of a job in its own task, so that idle workers share the databases of the job.
+
+    The tasks of the databases run as a chord, whose callback merges their results once all of them succeeded. If one
+    of them fails, hits the time limit or is lost with its worker, the error callback of the chord ends the job. The
+    DGE analysis of the job, if any, runs once in a task before the tasks of the databases.
+
+    :param enrichment_method: ORA, GSEA or GSEA pre-ranked
+    :param database_kwargs: arguments of the task of each database, besides the job and its GMT file
+    :param deseq_kwargs: arguments of the DGE analysis task besides the job, or None to skip the DGE analysis
+    """
+    logging.info(f'Running {len(gmt_files)} databases in parallel tasks')
+
+    options = _get_database_task_options(enrichment_method)
+    database_task = deploy_ora_database if enrichment_method == ORA else deploy_gsea_database
+
+    # The error callback reads why the tasks failed from their results, so their IDs are set in advance
+    task_ids = [uuid() for _ in gmt_files]
+
+    job_chord = chord(
+        group(
+            database_task.si(
+                job_id=job_id,
+                user_mail=user_mail,
+                gmt_file=gmt_file,
+                **database_kwargs,
+            ).set(task_id=task_id, **options)
+            for gmt_file, task_id in zip(gmt_files, task_ids)
+        ),
+        merge_databases.s(
+            job_id=job_id,
+            user_mail=user_mail,
+            enrichment_method=enrichment_method,
+            gmt_files=gmt_files,
+        ).set(queue=options['queue']).on_error(
+            fail_fanned_out_job.s(
+                job_id=job_id,
+                user_mail=user_mail,
+                task_ids=task_ids,
+                time_limit=options['soft_time_limit'],
+            ).set(queue=options['queue'])
+        ),
+    )
+
+    if deseq_kwargs is None:
+        report_stage(job_id, ORA_STAGE if enrichment_method == ORA else GSEA_STAGE, len(gmt_files))
+        set_job_tasks(job_id, task_ids)
+        job_chord.apply_async()
+
+        return
+
+    report_stage(job_id, DESEQ_STAGE)
+
+    deseq_task_id = uuid()
+    set_job_tasks(job_id, [deseq_task_id] + task_ids)
+
+    (
+        deploy_deseq_stage.si(
+            job_id=job_id,
+            user_mail=user_mail,
+            enrichment_method=enrichment_method,
+            total_databases=len(gmt_files),
+            **deseq_kwargs,
+        ).set(task_id=deseq_task_id).on_error(
+            fail_fanned_out_job.s(
+                job_id=job_id,
+                user_mail=user_mail,
+                task_ids=[deseq_task_id],
+                time_limit=settings.DESEQ_TIME_LIMIT,
+            ).set(queue=options['queue'])
+        ) | job_chord
+    ).apply_async()
+
+
+@shared_task(ignore_result=False, soft_time_limit=settings.DESEQ_TIME_LIMIT)
+def deploy_deseq_stage(
+    job_id: str,
+    user_mail: str,
+    enrichment_method: str,
+    total_databases: int,
+    read_counts_path: str,
+    design_matrix_path: str,
+    de_engine: str = DESEQ2_ENGINE,
+    contrast: Optional[List[str]] = None,
+    sig_threshold_fc: Optional[float] = None,
+    background: Optional[List[str]] = None,
+    data_background: bool = False,
+):
+    """Run the DGE analysis of a job fanned out over its databases, before the tasks of its databases.
+
+    The fold changes are saved in the job, and ORA jobs save the DEGs passing the significance threshold as the query
+    of their databases. Errors are raised after ending the job, so that the tasks of the databases do not run.
+    """
+    metrics = StageMetrics(job_id)
 
-            CleanupFile.register(read_counts_path, timedelta(minutes=30))
-            CleanupFile.register(class_labels_path, timedelta(minutes=30))
+    try:
+        metrics.start(DESEQ_STAGE)
+
+        read_counts_df = read_upload_artifact(read_counts_path)
+        design_matrix = read_upload_artifact(design_matrix_path)
+
+        pd_from_r_df = _run_differential_expression(read_counts_df, design_matrix, de_engine, contrast)
 
-            logging.info(f'Loading read counts file {read_counts_filename}....')
+        EnrichmentResult.objects.filter(result_id=job_id).update(fold_change_results=dump_results(pd_from_r_df))
 
-            try:
-                read_counts_df = read_data_file(read_counts_path, read_counts_filename)
-            except:
-                raise ValueError(open(read_counts_path, "r").read())
+        if enrichment_method == ORA:
+            # Use the expressed genes as background
+            if background is None and data_background:
+                background = pd_from_r_df.loc[pd_from_r_df['baseMean'] > 0, GENE_SYMBOL].to_list()
 
-            logging.info('Read counts file has been loaded....')
+            _save_ora_query(job_id, pd_from_r_df, 'padj', sig_threshold_fc, background)
 
-            logging.info(f'Loading class labels file {class_filename}....')
+        report_stage(job_id, ORA_STAGE if enrichment_method == ORA else GSEA_STAGE, total_databases)
 
-            try:
-                class_df = read_data_file(class_labels_path, class_filename)
-            except:
-                raise ValueError(open(class_labels_path, "r").read())
+    except SoftTimeLimitExceeded:
+        # The error callback of the job reports the time limit
+        raise
 
-            logging.info('Class labels file has been loaded....')
+    except Exception as e:
+        _finish_database_job(job_id, user_mail, result_status=0, error_message=str(e))
+        raise
 
-            if read_counts_df.index.name == GENE_SYMBOL:
-                read_counts_df.reset_index(inplace=True)
+    finally:
+        metrics.stop()
+
+
+@shared_task(ignore_result=False, soft_time_limit=settings.GSEA_TIME_LIMIT)
+def deploy_gsea_database(
+    job_id: str,
+    user_mail: str,
+    gmt_file: str,
+    prerank: bool,
+    parameters: dict,
+):
+    """Run GSEApy on one database of a job and save its results in the checkpoint of the job.
 
-            deseq = DeseqTask(
-                count_matrix=read_counts_df,
-                design_matrix=class_df,
-                design_formula='~ class_label',
-                gene_column=GENE_SYMBOL
+    Errors are raised after ending the job, so that the results of the databases are not merged.
+    """
+    checkpoint = get_checkpoint(job_id)
+    metrics = StageMetrics(job_id)
+
+    try:
+        metrics.start(GSEA_STAGE, database=os.path.splitext(os.path.basename(gmt_file))[0])
+
+        inputs = checkpoint.load(INPUTS_CHECKPOINT)
+
+        if inputs is None:
+            raise ValueError('The experiment was stopped or its files are no longer available')
+
+        if prerank:
+            inputs = _load_prerank_inputs(rnk_filename=inputs['rnk_path'], **inputs)
+        else:
+            inputs = _load_gsea_inputs(
+                data_filename=inputs['data_path'], class_filename=inputs['class_labels_path'], **inputs,
+            )
+
+        logging.info(f'Running GSEApy on gene sets from {gmt_file}')
+
+        # The results of the database are saved in the checkpoint, or read from it when the job was resumed
+        if prerank:
+            run_prerank(
+                rnk=inputs[0],
+                gmt=[gmt_file],
+                engine=GSEAPY_ENGINE,
+                processes=settings.GSEA_PROCESSES,
+                seed=settings.GSEA_SEED,
+                checkpoint=checkpoint,
+                **parameters,
             )
 
-            pd_from_r_df = deseq.run()
+        else:
+            run_gsea(
+                data=inputs[0],
+                gmt=[gmt_file],
+                class_vector=inputs[1]['class_label'].to_list(),
+                engine=GSEAPY_ENGINE,
+                processes=settings.GSEA_PROCESSES,
+                seed=settings.GSEA_SEED,
+                checkpoint=checkpoint,
+                **parameters,
+            )
 
-            job.fold_change_results = pickle.dumps(pd_from_r_df)
+        count_database_done(job_id)
 
-        results = []
+    except SoftTimeLimitExceeded:
+        # The error callback of the job reports the time limit and keeps the checkpoint to resume the job
+        raise
+
+    except Exception as e:
+        _finish_database_job(job_id, user_mail, result_status=0, error_message=str(e))
+        checkpoint.clear()
+        raise
+
+    finally:
+        metrics.stop()
+
+
+@shared_task(ignore_result=False, soft_time_limit=settings.ORA_TIME_LIMIT)
+def deploy_ora_database(
+    job_id: str,
+    user_mail: str,
+    gmt_file: str,
+    min_size: int,
+    max_size: int,
+    sweep_cutoffs: Optional[List[float]] = None,
+):
+    """Run ORA on one database of a job and save its results in the checkpoint of the job.
+
+    The q-values are corrected once the results of all databases are merged. Errors are raised after ending the job, so
+    that the results of the databases are not merged.
+    """
+    checkpoint = get_checkpoint(job_id)
+    metrics = StageMetrics(job_id)
+
+    try:
+        metrics.start(ORA_STAGE, database=os.path.splitext(os.path.basename(gmt_file))[0])
+
+        query = checkpoint.load(QUERY_CHECKPOINT)
+
+        if query is None:
+            raise ValueError('The experiment was stopped or its files are no longer available')
+
+        logging.info(f'Running ORA on gene sets from {gmt_file}')
+
+        results = run_ora(
+            gmt_path=gmt_file,
+            set_gene_symbols=query['genes'],
+            min_size=min_size,
+            max_size=max_size,
+            background=query['background'],
+        )
 
-        for gmt_file in gmt_files:
-            logging.info(f'Running GSEA Pre-Ranked on gene sets from {gmt_file}')
+        sweep = None
 
-            prerank_results = perform_prerank(
-                rnk=df,
-                gmt=gmt_file,
-                output_dir=output_dir,
+        # Run ORA at each cutoff of the threshold sweep
+        if sweep_cutoffs and query['fold_changes'] is not None:
+            logging.info(f"Running ORA at {len(sweep_cutoffs)} significance thresholds...")
+
+            sweep, _ = run_ora_sweep(
+                gmt_path=gmt_file,
+                genes=query['fold_changes'][GENE_SYMBOL].to_list(),
+                values=query['fold_changes']['value'].to_numpy(dtype=float),
+                cutoffs=sweep_cutoffs,
                 min_size=min_size,
                 max_size=max_size,
-                permutation_num=permutation_num,
+                background=query['background'],
             )
 
-            logging.info('Getting results...')
+        checkpoint.save(get_database_checkpoint_name(gmt_file), {'results': results, 'sweep': sweep})
 
-            results_df = prerank_results.res2d
+        count_database_done(job_id)
 
-            results.append(results_df)
+    except SoftTimeLimitExceeded:
+        # The error callback of the job reports the time limit
+        raise
 
-        df = pd.concat(results)
+    except Exception as e:
+        _finish_database_job(job_id, user_mail, result_status=0, error_message=str(e))
+        checkpoint.clear()
+        raise
 
-        job.result = pickle.dumps(df)
-        job.result_status = 2
+    finally:
+        metrics.stop()
 
-    except SoftTimeLimitExceeded:
-        job.result_status = 0
-        job.error_message = "The experiment exceeded the acceptable time limit (8 hours)"
+
+@shared_task
+def merge_databases(
+    results: list,
+    job_id: str,
+    user_mail: str,
+    enrichment_method: str,
+    gmt_files: List[str],
+):
+    """Merge and save the results of the databases of a job, once the tasks of all its databases succeeded.
+
+    :param results: return values of the tasks of the databases, which save their results in the checkpoint instead
+    """
+    checkpoint = get_checkpoint(job_id)
+    metrics = StageMetrics(job_id)
+
+    try:
+        report_stage(job_id, SAVING_STAGE)
+        metrics.start(SAVING_STAGE)
+
+        databases = [checkpoint.load(get_database_checkpoint_name(gmt_file)) for gmt_file in gmt_files]
+
+        if enrichment_method == ORA:
+            fields = {'result': dump_results(merge_ora_results([database['results'] for database in databases]))}
+
+            sweeps = [database['sweep'] for database in databases]
+
+            if all(sweep is not None for sweep in sweeps):
+                fields['sweep_results'] = dump_results(join_sweep_results(*merge_ora_sweeps(sweeps)))
+
+        else:
+            fields = {'result': dump_results(pd.concat(databases))}
+
+        _finish_database_job(job_id, user_mail, result_status=2, **fields)
 
     except Exception as e:
-        err = e
-        job.result_status = 0
-        job.error_message = str(e)
+        _finish_database_job(job_id, user_mail, result_status=0, error_message=str(e))
 
     finally:
+        checkpoint.clear()
+        metrics.stop()
+
+
+@shared_task
+def fail_fanned_out_job(task_id: str, *, job_id: str, user_mail: str, task_ids: List[str], time_limit: int):
+    """End a job fanned out over its databases whose DGE analysis or databases did not all succeed.
+
+    The arguments besides the task ID are keyword-only, so that Celery passes the ID of the failed task alone.
+
+    :param task_id: ID of the task whose failure called this error callback
+    :param task_ids: IDs of the tasks of the job, whose errors are read from the result backend
+    :param time_limit: time limit of the tasks in seconds
+    """
+    # The job was resumed since, so its checkpoint belongs to its new tasks
+    if not set(task_ids).issubset(get_job_tasks(job_id)):
+        return
+
+    errors = [AsyncResult(task).result for task in task_ids if AsyncResult(task).failed()]
+
+    checkpoint = get_checkpoint(job_id)
+
+    # Jobs that hit the time limit can be resumed from their checkpoint, if they kept one
+    if errors and all(isinstance(error, TIME_LIMIT_ERRORS) for error in errors):
+        error_message = _get_time_limit_msg(time_limit)
+
+        if checkpoint.load(TASK_CHECKPOINT) is not None:
+            error_message += RESUME_MSG
+        else:
+            checkpoint.clear()
+
+    else:
+        error_message = next(
+            (str(error) for error in errors if not isinstance(error, TIME_LIMIT_ERRORS)),
+            LOST_JOB_MSG,
+        )
+        checkpoint.clear()
+
+    _finish_database_job(job_id, user_mail, result_status=0, error_message=error_message)
+
+
+def _save_ora_query(
+    job_id: str,
+    fold_changes_df: pd.DataFrame,
+    column: str,
+    sig_threshold_fc: float,
+    background: Optional[List[str]] = None,
+) -> None:
+    """Save the DEGs passing the significance threshold as the query of the databases of an ORA job.
+
+    The adjusted p-values of all genes are saved as well for the threshold sweep.
+    """
+    logging.info("Filtering DEGs by adjusted p-value...")
+
+    # Query genes which pass significance threshold based on adjusted p-value
+    df = fold_changes_df.query(f'{column} <= {sig_threshold_fc}')
+
+    get_checkpoint(job_id).save(QUERY_CHECKPOINT, {
+        'genes': set(df[GENE_SYMBOL]),
+        'background': background,
+        'fold_changes': fold_changes_df[[GENE_SYMBOL, column]].rename(columns={column: 'value'}),
+    })
+
+
+def _finish_database_job(job_id: str, user_mail: str, **fields) -> None:
+    """Save the outcome of a job fanned out over its databases, unless another task or the user already ended it."""
+    if EnrichmentResult.objects.filter(result_id=job_id, result_status=1).update(**fields):
         User.objects.filter(email__exact=user_mail).update(num_of_jobs=F('num_of_jobs') - 1)
-        job.save()
 
-    return err
 
+def _keep_inputs(checkpoint: Checkpoint, paths: dict) -> dict:
+    """Move the artifacts of the uploads of a job into its checkpoint and save their paths as its inputs.
+
+    The artifacts are otherwise removed after 30 minutes, while a job can wait longer in the queues of its tasks or be
+    resumed later after hitting the time limit.
+    """
+    inputs = {name: checkpoint.add_file(name, path) if path else None for name, path in paths.items()}
+
+    checkpoint.save(INPUTS_CHECKPOINT, inputs)
+
+    return inputs
+
+
+def _load_gsea_inputs(
+    data_path: str,
+    data_filename: str,
+    class_labels_path: str,
+    class_filename: str,
+    read_counts_path: Optional[str] = None,
+    read_counts_filename: Optional[str] = None,
+):
+    """Load the expression data, class labels and read counts files of a GSEA job from its checkpoint."""
+    logging.info(f'Loading data file {data_filename}....')
+
+    df = read_upload_artifact(data_path)
+
+    if GENE_SYMBOL in df:
+        df.set_index(GENE_SYMBOL, inplace=True)
+
+    logging.info(f'Loading class labels file {class_filename}....')
+
+    class_df = read_upload_artifact(class_labels_path)
+
+    logging.info('Files to run GSEA have been loaded....')
+
+    read_counts_df = None
+
+    if read_counts_path:
+
+        logging.info(f'Loading read counts file {read_counts_filename}....')
+
+        read_counts_df = read_upload_artifact(read_counts_path)
+
+        logging.info('Read counts file has been loaded....')
+
+    return df, class_df, read_counts_df
+
+
+def _load_prerank_inputs(
+    rnk_path: str,
+    rnk_filename: str,
+    read_counts_path: Optional[str] = None,
+    read_counts_filename: Optional[str] = None,
+    class_labels_path: Optional[str] = None,
+    class_filename: Optional[str] = None,
+):
+    """Load the pre-ranked, read counts and class labels files of a GSEA pre-ranked job from its checkpoint."""
+    logging.info(f'Loading preranked file {rnk_path}....')
+
+    df = read_upload_artifact(rnk_path)
+
+    logging.info('Pre-ranked file has been loaded....')
+
+    read_counts_df = class_df = None
+
+    if read_counts_path:
+
+        logging.info(f'Loading read counts file {read_counts_filename}....')
+
+        read_counts_df = read_upload_artifact(read_counts_path)
+
+        logging.info('Read counts file has been loaded....')
+
+        logging.info(f'Loading class labels file {class_filename}....')
+
+        class_df = read_upload_artifact(class_labels_path)
 
-@shared_task(soft_time_limit=28800)
+        logging.info('Class labels file has been loaded....')
+
+    return df, read_counts_df, class_df
+
+
+def _run_differential_expression(
+    count_matrix: pd.DataFrame,
+    design_matrix: pd.DataFrame,
+    engine: str,
+    contrast: Optional[List[str]] = None,
+):
+    """Compare the expression of each gene between the class labels with the selected engine.
+
+    :param contrast: class labels [numerator, denominator] to compare. By default, the last class label is compared to
+        the first one.
+    """
+    # DESeq2 is fitted once for all the contrasts, so other contrasts of the same counts are read from its cache
+    contrast = tuple(contrast) if contrast else None
+
+    if engine == NATIVE_DE_ENGINE:
+        return differential_expression(
+            count_matrix=count_matrix,
+            design_matrix=design_matrix,
+            gene_column=GENE_SYMBOL,
+            contrast=contrast,
+            min_count=settings.DESEQ_MIN_COUNT,
+        )
+
+    return run_deseq(
+        count_matrix=count_matrix,
+        design_matrix=design_matrix,
+        design_formula='~ class_label',
+        gene_column=GENE_SYMBOL,
+        contrast=contrast,
+    )
+
+
+def resume_job(job_id: str):
+    """Re-queue a GSEA job from its checkpoint and return the task, or None if the job has no checkpoint."""
+    saved = get_checkpoint(job_id).load(TASK_CHECKPOINT)
+
+    if saved is None:
+        return None
+
+    task = {deploy_gsea.name: deploy_gsea, deploy_prerank.name: deploy_prerank}[saved['task']]
+
+    return task.delay(**{**saved['kwargs'], 'resume': True})
+
+
+@shared_task(soft_time_limit=settings.ORA_TIME_LIMIT)
 def deploy_ora(
-    gmt_file_path: str,
+    gmt_files: List[str],
     min_size: int,
     max_size: int,
     user_mail: str,
@@ -298,10 +902,16 @@ def deploy_ora(
     read_counts_filename: Optional = None,
     design_matrix_filename: Optional = None,
     fold_changes_filename: Optional = None,
-
+    background: Optional[List[str]] = None,
+    data_background: bool = False,
+    sweep_cutoffs: Optional[List[float]] = None,
+    de_engine: str = DESEQ2_ENGINE,
+    contrast: Optional[List[str]] = None,
 ):
     current_user = User.objects.filter(email=user_mail)[0]
     job = EnrichmentResult.objects.filter(result_id=job_id)[0]
+    progress = None
+    fanned_out = False
     err = None
 
     try:
@@ -313,141 +923,162 @@ def deploy_ora(
 
             return False
 
-        # Perform DGE analysis and run ORA on genes that pass significance
-        if read_counts_path:
-
-            # Remove transient files
-            CleanupFile.register(read_counts_path, timedelta(minutes=30))
-            CleanupFile.register(design_matrix_path, timedelta(minutes=30))
-
-            logging.info(f'Loading data file {read_counts_filename}....')
-
-            try:
-                read_counts_df = read_data_file(read_counts_path, read_counts_filename)
-            except:
-                raise ValueError(open(read_counts_path, "r").read())
-
-            if read_counts_df.index.name == GENE_SYMBOL:
-                read_counts_df.reset_index(inplace=True)
-
-            logging.info(f'Loading class labels file {design_matrix_filename}....')
+        progress = ProgressReporter(job_id)
+        progress.stage(LOADING_STAGE)
 
-            try:
-                design_matrix = read_data_file(design_matrix_path, design_matrix_path)
-            except:
-                raise ValueError(open(read_counts_path, "r").read())
+        deseq_kwargs = None
 
-            logging.info('Files have been loaded. Starting DESeq2...')
-
-            # Run DESeq2
-            deseq = DeseqTask(
-                read_counts_df,
-                design_matrix,
-                '~ class_label',
-                GENE_SYMBOL
+        # Perform DGE analysis before the databases and run ORA on genes that pass significance
+        if read_counts_path:
+            logging.info(f'DGE analysis of {read_counts_filename} and {design_matrix_filename} runs before ORA...')
+
+            # The files are kept until the DGE analysis task, which can wait in its queue, is done
+            inputs = _keep_inputs(get_checkpoint(job_id), dict(
+                read_counts_path=read_counts_path,
+                design_matrix_path=design_matrix_path,
+            ))
+
+            deseq_kwargs = dict(
+                **inputs,
+                de_engine=de_engine,
+                contrast=contrast,
+                sig_threshold_fc=sig_threshold_fc,
+                background=background,
+                data_background=data_background,
             )
 
-            pd_from_r_df = deseq.run()
-
-            logging.info("Filtering DEGs by adjusted p-value...")
-
-            # Query genes which pass significance threshold based on adjusted p-value
-            query_exp = f'{"padj"} <= {sig_threshold_fc}'
-
-            df = pd_from_r_df.query(query_exp)
+        # Run ORA on DEGs that pass significance
+        elif fold_changes_path:
 
-            ora_gene_set = set(df[GENE_SYMBOL])
+            # Remove transient files
+            CleanupFile.register(fold_changes_path, timedelta(minutes=30))
 
-            job.fold_change_results = pickle.dumps(pd_from_r_df)
+            logging.info(f'Loading fold changes file {fold_changes_filename}....')
 
-            logging.info("Running ORA...")
+            fold_changes_df = read_upload_artifact(fold_changes_path)
 
-            # Run ORA
-            ora_results_df = run_ora(
-                gmt_path=gmt_file_path,
-                set_gene_symbols=ora_gene_set,
-                min_size=min_size,
-                max_size=max_size,
-            )
+            logging.info(f'Fold changes file has been loaded....')
 
-            logging.info("ORA successfully run...")
+            # Use the genes in the fold changes file as background
+            if background is None and data_background:
+                background = fold_changes_df[GENE_SYMBOL].to_list()
 
-            job.result = pickle.dumps(ora_results_df)
+            _save_ora_query(job_id, fold_changes_df, 'q_value', sig_threshold_fc, background)
 
-            # Job Success
-            job.result_status = 2
+        # Run ORA
+        else:
+            get_checkpoint(job_id).save(QUERY_CHECKPOINT, {
+                'genes': set(set_gene_symbols),
+                'background': background,
+                'fold_changes': None,
+            })
+
+        # Each database runs in its own task, and the q-values are corrected once their results are merged
+        _fan_out_databases(
+            job_id,
+            user_mail,
+            ORA,
+            gmt_files,
+            dict(min_size=min_size, max_size=max_size, sweep_cutoffs=sweep_cutoffs),
+            deseq_kwargs,
+        )
+        fanned_out = True
 
-        # Run ORA on DEGs that pass significance
-        elif fold_changes_path:
+    except SoftTimeLimitExceeded:
+        job.result_status = 0
+        job.error_message = _get_time_limit_msg(settings.ORA_TIME_LIMIT)
+        get_checkpoint(job_id).clear()
 
-            # Remove transient files
-            CleanupFile.register(fold_changes_path, timedelta(minutes=30))
+    except Exception as e:
+        err = e
+        job.result_status = 0
+        job.error_message = str(e)
+        get_checkpoint(job_id).clear()
 
-            logging.info(f'Loading fold changes file {fold_changes_filename}....')
+    finally:
+        # The chord of the databases saves the outcome of the job
+        if not fanned_out:
+            User.objects.filter(email__exact=user_mail).update(num_of_jobs=F('num_of_jobs') - 1)
+            job.save()
 
-            try:
-                fold_changes_df = read_data_file(fold_changes_path, fold_changes_filename)
-            except:
-                raise ValueError(open(fold_changes_path, "r").read())
+        if progress is not None:
+            progress.finish()
 
-            logging.info(f'Fold changes file has been loaded....')
+    return err
 
-            logging.info("Filtering DEGs by adjusted p-value")
 
-            # Query genes which pass significance threshold based on adjusted p-value
-            query_exp = f'{"q_value"} <= {sig_threshold_fc}'
+@shared_task(soft_time_limit=settings.ORA_TIME_LIMIT)
+def deploy_ora_batch(
+    gmt_file_path: str,
+    min_size: int,
+    max_size: int,
+    user_mail: str,
+    job_ids: List[str],
+    gene_lists: List[List[str]],
+    background: Optional[List[str]] = None,
+):
+    current_user = User.objects.filter(email=user_mail)[0]
+    jobs = [EnrichmentResult.objects.filter(result_id=job_id)[0] for job_id in job_ids]
+    progress = None
+    err = None
 
-            df = fold_changes_df.query(query_exp)
-            ora_gene_set = set(df[GENE_SYMBOL])
+    try:
+        if not current_user.is_quota_left():
+            for job in jobs:
+                job.result_status = 0
+                job.error_message = "You have exceeded your quota for the number of experiments. Please cancel an " \
+                                    "existing experiment to start a new one."
+                job.save()
 
-            logging.info("Running ORA")
+            return False
 
-            # Run ORA
-            ora_results_df = run_ora(
-                gmt_path=gmt_file_path,
-                set_gene_symbols=ora_gene_set,
-                min_size=min_size,
-                max_size=max_size,
-            )
+        progress = ProgressReporter(job_ids)
+        progress.stage(ORA_STAGE)
 
-            logging.info("ORA successfully run")
+        logging.info(f'Running ORA on {len(gene_lists)} gene lists...')
 
-            job.result = pickle.dumps(ora_results_df)
+        # Run ORA on all gene lists at once
+        ora_results = run_ora_batch(
+            gmt_path=gmt_file_path,
+            gene_lists=[set(gene_list) for gene_list in gene_lists],
+            min_size=min_size,
+            max_size=max_size,
+            background=background,
+        )
 
-            # Job Success
-            job.result_status = 2
+        logging.info("ORA successfully run...")
 
-        # Run ORA
-        else:
-            ora_results_df = run_ora(
-                gmt_path=gmt_file_path,
-                set_gene_symbols=set(set_gene_symbols),
-                min_size=min_size,
-                max_size=max_size,
-            )
+        progress.stage(SAVING_STAGE)
 
-            job.result = pickle.dumps(ora_results_df)
+        for job, ora_results_df in zip(jobs, ora_results):
+            job.result = dump_results(ora_results_df)
 
             # Job Success
             job.result_status = 2
 
     except SoftTimeLimitExceeded:
-        job.result_status = 0
-        job.error_message = "The experiment exceeded the acceptable time limit (8 hours)"
+        for job in jobs:
+            job.result_status = 0
+            job.error_message = _get_time_limit_msg(settings.ORA_TIME_LIMIT)
 
     except Exception as e:
         err = e
-        job.result_status = 0
-        job.error_message = str(e)
+        for job in jobs:
+            job.result_status = 0
+            job.error_message = str(e)
 
     finally:
         User.objects.filter(email__exact=user_mail).update(num_of_jobs=F('num_of_jobs') - 1)
-        job.save()
+        for job in jobs:
+            job.save()
+
+        if progress is not None:
+            progress.finish()
 
     return err
 
 
-@shared_task(soft_time_limit=28800)
+@shared_task(soft_time_limit=settings.DESEQ_TIME_LIMIT)
 def deploy_deseq(
     read_counts_path: str,
     read_counts_filename: str,
@@ -455,9 +1086,12 @@ def deploy_deseq(
     design_matrix_filename: str,
     user_mail: str,
     job_id: str,
+    de_engine: str = DESEQ2_ENGINE,
+    contrast: Optional[List[str]] = None,
 ):
     current_user = User.objects.filter(email=user_mail)[0]
     job = EnrichmentResult.objects.filter(result_id=job_id)[0]
+    progress = None
     err = None
 
     try:
@@ -469,44 +1103,35 @@ def deploy_deseq(
 
             return False
 
+        progress = ProgressReporter(job_id)
+        progress.stage(LOADING_STAGE)
+
         # Remove transient files
         CleanupFile.register(read_counts_path, timedelta(minutes=30))
         CleanupFile.register(design_matrix_path, timedelta(minutes=30))
 
         logging.info(f'Loading read counts file {read_counts_filename}....')
 
-        try:
-            read_counts_df = read_data_file(read_counts_path, read_counts_filename)
-        except:
-            raise ValueError(open(read_counts_path, "r").read())
-
-        if read_counts_df.index.name == GENE_SYMBOL:
-            read_counts_df.reset_index(inplace=True)
+        read_counts_df = read_upload_artifact(read_counts_path)
 
         logging.info(f'Loading design matrix file {design_matrix_path}....')
 
-        try:
-            design_matrix = read_data_file(design_matrix_path, design_matrix_filename)
-        except:
-            raise ValueError(open(design_matrix_path, "r").read())
+        design_matrix = read_upload_artifact(design_matrix_path)
 
         logging.info('Files have been loaded. Starting DESeq2...')
 
-        deseq = DeseqTask(
-            count_matrix=read_counts_df,
-            design_matrix=design_matrix,
-            design_formula='~ class_label',
-            gene_column=GENE_SYMBOL
-        )
+        progress.stage(DESEQ_STAGE)
+
+        pd_from_r_df = _run_differential_expression(read_counts_df, design_matrix, de_engine, contrast)
 
-        pd_from_r_df = deseq.run()
+        progress.stage(SAVING_STAGE)
 
-        job.fold_change_results = pickle.dumps(pd_from_r_df)
+        job.fold_change_results = dump_results(pd_from_r_df)
         job.result_status = 2
 
     except SoftTimeLimitExceeded:
         job.result_status = 0
-        job.error_message = "The experiment exceeded the acceptable time limit (8 hours)"
+        job.error_message = _get_time_limit_msg(settings.DESEQ_TIME_LIMIT)
 
     except Exception as e:
         err = e
@@ -517,85 +1142,7 @@ def deploy_deseq(
         User.objects.filter(email__exact=user_mail).update(num_of_jobs=F('num_of_jobs') - 1)
         job.save()
 
-    return err
-
-
-class DeseqTask(Task):
-    def __init__(self, count_matrix, design_matrix, design_formula, gene_column):
-        try:
-            assert gene_column in count_matrix.columns, 'Wrong gene id column name'
-
-        except AttributeError:
-            raise Exception('Wrong Pandas dataframe?')
-
-        import rpy2
-        from rpy2.robjects import pandas2ri, Formula, conversion
-
-        pandas2ri.activate()
-
-        self.dds = None
-        self.deseq_result = None
-        self.comparison = None
-        self.normalized_count_matrix = None
-        self.gene_column = gene_column
-        self.gene_id = count_matrix[self.gene_column]
+        if progress is not None:
+            progress.finish()
 
-        count_matrix = count_matrix.drop(gene_column, axis=1)
-
-        logging.info(
-            f'Number of columns in counts data {count_matrix.shape[1]} | '
-            f'Number of rows in design matrix {design_matrix.shape[0]}'
-        )
-
-        # Load dataframe into R environment
-        # Important: Change to r.data() if you use numpys and rpy2 latest versions
-        self.count_matrix = conversion.py2rpy(count_matrix)
-
-        # Assign columns to NULL
-        self.count_matrix.names = rpy2.rinterface.NULL
-        self.count_matrix = count_matrix
-        self.design_matrix = conversion.py2rpy(design_matrix)
-        self.design_formula = Formula(design_formula)
-
-    def run(self, **kwargs):
-
-        import rpy2
-        from rpy2.robjects import pandas2ri, r, default_converter
-        from rpy2.robjects.conversion import localconverter
-        from rpy2.robjects.packages import importr
-
-        pandas2ri.activate()
-        deseq = importr('DESeq2')
-
-        logging.info('imported DESeq2')
-
-        to_dataframe = r('function(x) data.frame(x)')
-
-        logging.info("running DESeq")
-
-        self.dds = deseq.DESeqDataSetFromMatrix(
-            countData=self.count_matrix,
-            colData=self.design_matrix,
-            design=self.design_formula
-        )
-        self.dds = deseq.DESeq(self.dds, **kwargs)
-        # Previous script had "deseq.counts" instead
-        # TODO check standard practice
-        self.normalized_count_matrix = deseq.counts_DESeqDataSet(self.dds, normalized=True)
-
-        self.comparison = deseq.resultsNames(self.dds)
-
-        logging.info("Get DESeq2 results")
-
-        self.deseq_result = deseq.results(self.dds, **kwargs)
-        self.deseq_result = to_dataframe(self.deseq_result)
-        self.deseq_result = rpy2.robjects.conversion.py2rpy(self.deseq_result)
-
-        logging.info("Back to pandas dataframe")
-
-        with localconverter(default_converter + pandas2ri.converter):
-            results = rpy2.robjects.conversion.rpy2py(self.deseq_result)
-
-        results[self.gene_column] = self.gene_id.values
-
-        return results
+    return err
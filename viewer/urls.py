@@ -25,7 +25,10 @@ urlpatterns = [
     # Experiment pages
     path('run_decopath', run_decopath, name='run_decopath'),
     path('experiments', experiments, name='experiments'),
+    path('progress/<int:result_id>', job_progress, name='job_progress'),
+    path('queues', queue_depths, name='queue_depths'),
     path('results_ora/<int:result_id>', results_ora, name='results_ora'),
+    path('results_ora_sweep/<int:result_id>', results_ora_sweep, name='results_ora_sweep'),
     path('results_gsea/<int:result_id>', results_gsea, name='results_gsea'),
     path('consensus_gsea/<int:result_id>', consensus_gsea, name='consensus_gsea'),
     path('consensus_ora/<int:result_id>', consensus_ora, name='consensus_ora'),
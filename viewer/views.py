@@ -4,7 +4,6 @@
 
 import json
 import os.path
-import pickle
 
 import pandas as pd
 from celery.result import AsyncResult
@@ -16,7 +15,7 @@ from django.contrib.sites.shortcuts import get_current_site
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import F
 from django.forms import formset_factory
-from django.http import HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render, redirect
 from django.utils.encoding import force_text
 from django.utils.http import urlsafe_base64_decode
@@ -25,7 +24,8 @@ from pandas import DataFrame, notna
 
 from viewer.forms import *
 from viewer.glob_utils import verify_email
-from viewer.models import PathwayHierarchy, User, Pathway
+from viewer.models import EnrichmentResult, PathwayHierarchy, User, Pathway
+from viewer.src.checkpoint import get_checkpoint
 from viewer.src.constants import *
 from viewer.src.data_preprocessing import (
     parse_custom_gmt, parse_gmt_file)
@@ -40,6 +40,8 @@ from viewer.src.form_processing import (
 )
 from viewer.src.form_processing_utils import add_forms_to_formset, check_mapping_validity
 from viewer.src.handle_results import (
+    CIRCLES_COLUMNS,
+    FOLD_CHANGE_COLUMNS,
     create_summary_table,
     query_results_model,
     get_ranking_table,
@@ -48,9 +50,11 @@ from viewer.src.handle_results import (
     get_results_circle_viz,
     process_overlap_for_venn_diagram,
 )
+from viewer.src.progress import get_job_tasks, get_queue_depths
 from viewer.src.response_handler import *
 from viewer.src.utils import (map_results_to_hierarchy, _get_gmt_dict, handle_file_download, get_dc_pathway_resources,
                               del_user)
+from viewer.tasks import resume_job
 from viewer.tokens import account_activation_token
 
 """HTML Pages"""
@@ -328,7 +332,14 @@ def experiments(request):
 
         for idx, obj in enumerate(objs):
             if request.POST.get(f"Delete_{idx}"):
+                get_checkpoint(obj.result_id).clear()
                 obj.delete()
+            if request.POST.get(f"Resume_{idx}") and obj.result_status == 0:
+                task = resume_job(obj.result_id)
+                if task is not None:
+                    obj.result_status = 1
+                    obj.error_message = "NA"
+                    _update_job_user(request, obj.user, obj, task)
             if request.POST.get(f"Stop_{idx}"):
                 task = AsyncResult(id=obj.get_task_id())
                 task.revoke(terminate=True)
@@ -337,21 +348,80 @@ def experiments(request):
                     parent.revoke(terminate=True)
                     parent = parent.parent
 
+                # The task of a job fanned out over its databases has returned, but the tasks it queued still run
+                for task_id in get_job_tasks(obj.result_id):
+                    AsyncResult(id=task_id).revoke(terminate=True)
+
+                # Queued tasks of the job fail as soon as they start without its inputs
+                get_checkpoint(obj.result_id).clear()
+
                 obj.result_status = 0
                 obj.error_message = "Stopped by User."
                 obj.save()
 
+                # The gene lists of a batch share its task, so they are all stopped with it
+                if obj.task_id:
+                    EnrichmentResult.objects.filter(user=obj.user, task_id=obj.task_id, result_status=1).update(
+                        result_status=0,
+                        error_message="Stopped by User.",
+                    )
+
     summary_table_body, objs = create_summary_table(current_user)
 
-    context = {"headers": RESULTS_METADATA_HEADER, "body": summary_table_body}
+    context = {
+        "headers": RESULTS_METADATA_HEADER,
+        "body": summary_table_body,
+    }
 
     return render(request=request, template_name="viewer/experiments.html", context=context)
 
 
+@login_required
+def job_progress(request, result_id):
+    """Return the status and progress of an experiment as JSON, without loading its results."""
+    query_results = EnrichmentResult.objects.filter(result_id=result_id)
+
+    if not request.user.is_staff:
+        query_results = query_results.filter(user=request.user)
+
+    job = query_results.values(
+        'result_status',
+        'progress__stage',
+        'progress__step',
+        'progress__total_steps',
+        'progress__permutations_done',
+        'progress__permutations_total',
+        'progress__updated',
+    ).first()
+
+    if job is None:
+        return HttpResponseBadRequest('Your experiment was not found.')
+
+    return JsonResponse({
+        'status': job['result_status'],
+        'stage': job['progress__stage'],
+        'database': job['progress__step'],
+        'databases': job['progress__total_steps'],
+        'permutations_done': job['progress__permutations_done'],
+        'permutations': job['progress__permutations_total'],
+        'updated': job['progress__updated'],
+    })
+
+
+@login_required
+def queue_depths(request):
+    """Return the number of experiments waiting in the queue of each kind of job as JSON, or nothing on errors."""
+    return JsonResponse(get_queue_depths())
+
+
 # TODO: Add it to celery task
 def _update_job_user(request, current_user, job, task):
-    job.task_id = task.id
-    job.save()
+    # Batch tasks load several results but count as a single job
+    jobs = job if isinstance(job, list) else [job]
+
+    for job in jobs:
+        job.task_id = task.id
+        job.save()
 
     User.objects.filter(email__exact=current_user.email).update(num_of_jobs=F('num_of_jobs') + 1)
 
@@ -384,12 +454,35 @@ def results_ora(request, result_id):
         'ranking_table': data,
         'result_id': result_id,
         'enrichment_method': enrichment_method,
-        'data_filename': data_filename
+        'data_filename': data_filename,
+        'has_sweep': EnrichmentResult.objects.filter(
+            result_id=result_id, user=current_user, sweep_results__isnull=False,
+        ).exists(),
     }
 
     return render(request, 'viewer/results_ora.html', context=context)
 
 
+@login_required
+def results_ora_sweep(request, result_id):
+    """Download the results of an ORA threshold sweep."""
+    try:
+        result_object = EnrichmentResult.objects.get(result_id=result_id, user=request.user)
+    except ObjectDoesNotExist:
+        return HttpResponseBadRequest('Your experiment was not found.')
+
+    # One p-value and one q-value column per cutoff
+    df = result_object.get_sweep_results()
+
+    if df is None:
+        return HttpResponseBadRequest('No results across significance thresholds were found for this experiment.')
+
+    response = HttpResponse(df.to_csv(sep='\t'), content_type='text/tab-separated-values')
+    response['Content-Disposition'] = f'attachment; filename="ora_threshold_sweep_{result_id}.tsv"'
+
+    return response
+
+
 @login_required
 def results_gsea(request, result_id):
     """Render results page."""
@@ -592,7 +685,7 @@ def circles_viz(request, result_id):
     current_user = request.user
 
     # Get results dataframe and databases from results model
-    query_results_val = query_results_model(result_id, current_user)
+    query_results_val = query_results_model(result_id, current_user, columns=CIRCLES_COLUMNS)
 
     # Check if file cannot be read and throw error
     if isinstance(query_results_val, str):
@@ -636,7 +729,10 @@ def circles_viz(request, result_id):
 @login_required
 def zoom_in(request, result_id, pathway_id):
     """Render zoom-in page."""
-    query_results_val = query_results_model(result_id, request.user)
+    # Only the fold changes are needed, so no column of the results is read
+    query_results_val = query_results_model(
+        result_id, request.user, columns=[], fold_change_columns=FOLD_CHANGE_COLUMNS,
+    )
 
     # Check if query cannot be made and throw error
     if isinstance(query_results_val, str):
@@ -645,9 +741,7 @@ def zoom_in(request, result_id, pathway_id):
         _, databases, _, _, _, symbol_to_fold_change, _ = query_results_val
 
     # Get fold changes
-    if symbol_to_fold_change:
-
-        symbol_to_fold_change = pickle.loads(symbol_to_fold_change)
+    if symbol_to_fold_change is not None:
 
         if isinstance(symbol_to_fold_change, DataFrame):
 
@@ -693,7 +787,10 @@ def zoom_in(request, result_id, pathway_id):
 @login_required
 def export(request, result_id):
     """Render export fold changes page."""
-    query_results_val = query_results_model(result_id, request.user)
+    # Only the fold changes are needed, so no column of the results is read
+    query_results_val = query_results_model(
+        result_id, request.user, columns=[], fold_change_columns=FOLD_CHANGE_COLUMNS,
+    )
 
     # Check if query cannot be made and throw error
     if isinstance(query_results_val, str):
@@ -705,9 +802,9 @@ def export(request, result_id):
         fold_changes_filename = ''
 
     # Get fold changes
-    if symbol_to_fold_change:
+    if symbol_to_fold_change is not None:
 
-        fold_change_df = pickle.loads(symbol_to_fold_change)
+        fold_change_df = symbol_to_fold_change
 
         if isinstance(fold_change_df, DataFrame):
 